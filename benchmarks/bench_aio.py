@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 18:20
+# @File    : bench_aio.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    concurrent list requests on one IOLoop: blocking list in the bounded executor vs alist on async connections,
+    then latency of fast Line requests over HTTP while slow report queries keep the blocking path busy,
+    uses the database in ORK_TEST_DB
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import time
+
+import tornado.web
+from tornado import gen
+from tornado import httpclient
+from tornado import netutil
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+
+from benchmarks import common
+from tests import support
+from ork.apps.traffic import controller
+from ork.apps.traffic import resource
+from ork.common.handler import CollectionHandler
+from ork.common.handler import ItemHandler
+from ork.core import executor
+from ork.middleware import get_middleware
+
+CONCURRENCY = (8, 32)
+REQUESTS = 400
+# 同步连接池与线程数一致，异步连接池使用同样的连接数
+POOL_SIZE = 4
+# 慢查询负载：SLOW_CLIENTS个客户端不断请求耗时SLOW_QUERY秒的报表，同时FAST_CLIENTS个客户端请求线路
+SLOW_QUERY = 0.2
+SLOW_CLIENTS = POOL_SIZE
+FAST_CLIENTS = 8
+FAST_REQUESTS = 200
+
+
+def blocking(filters):
+    return executor.get_executor().submit(resource.Line().list, filters=filters, orders=['id'], limit=20)
+
+
+def non_blocking(filters):
+    return resource.Line().alist(filters=filters, orders=['id'], limit=20)
+
+
+@gen.coroutine
+def run(request, concurrency):
+    """
+    concurrency个并发的客户端共发出REQUESTS个请求
+    :returns: (总耗时, 每个请求的延迟列表)
+    :rtype: tuple
+    """
+    latencies = []
+    counter = iter(range(REQUESTS))
+
+    @gen.coroutine
+    def _client():
+        for i in counter:
+            started = time.time()
+            yield request({'city_id': 'c%d' % (i % 50)})
+            latencies.append(time.time() - started)
+
+    started = time.time()
+    yield [_client() for _ in range(concurrency)]
+    raise gen.Return((time.time() - started, latencies))
+
+
+class SlowReport(CollectionHandler):
+    """
+    报表：先执行一条耗时SLOW_QUERY秒的查询，占用同步连接以及线程
+    """
+    name = 'traffic.line'
+    resource = resource.Line
+    etag_enabled = False
+    blocking_executor = True
+
+    def list(self, criteria, **kwargs):
+        with self.make_resource().get_session(readonly=True) as session:
+            session.execute('SELECT pg_sleep(%s)' % SLOW_QUERY)
+        return super(SlowReport, self).list(criteria, **kwargs)
+
+
+class SyncLines(CollectionHandler):
+    name = 'traffic.line'
+    resource = resource.Line
+    etag_enabled = False
+    blocking_executor = True
+
+
+class SyncLine(ItemHandler):
+    name = 'traffic.line'
+    resource = resource.Line
+    etag_enabled = False
+    blocking_executor = True
+
+
+class IOLoopReport(SlowReport):
+    blocking_executor = False
+
+
+class IOLoopLines(SyncLines):
+    blocking_executor = False
+
+
+class IOLoopLine(SyncLine):
+    blocking_executor = False
+
+
+class AsyncLines(controller.CollectionLine):
+    etag_enabled = False
+
+
+class AsyncLine(controller.ItemLine):
+    etag_enabled = False
+
+
+# (名称, 报表控制器, 线路集合控制器, 线路详情控制器)
+MODES = (
+    ('blocking on IOLoop', IOLoopReport, IOLoopLines, IOLoopLine),
+    ('executor', SlowReport, SyncLines, SyncLine),
+    ('async Line handlers', SlowReport, AsyncLines, AsyncLine),
+)
+
+
+class Application(tornado.web.Application):
+    def __init__(self, report, lines, line):
+        self.middleware = get_middleware()
+        super(Application, self).__init__(handlers=[(r'/reports', report), (r'/lines', lines), (r'/line/(.*)', line)])
+
+
+@gen.coroutine
+def slow_load(port):
+    """
+    慢报表请求持续进行时，FAST_CLIENTS个客户端共发出FAST_REQUESTS个线路列表以及详情请求
+    :returns: (线路请求的延迟列表, 完成的报表请求数, 总耗时)
+    :rtype: tuple
+    """
+    http = httpclient.AsyncHTTPClient(max_clients=SLOW_CLIENTS + FAST_CLIENTS)
+    url = 'http://127.0.0.1:%d' % port
+    latencies = []
+    reports = [0]
+    counter = iter(range(FAST_REQUESTS))
+    done = []
+
+    @gen.coroutine
+    def _slow_client():
+        while not done:
+            yield http.fetch(url + '/reports?__limit=20&__count=none', request_timeout=600)
+            reports[0] += 1
+
+    @gen.coroutine
+    def _fast_client():
+        for i in counter:
+            if i % 2:
+                path = '/lines?city_id=c%d&__orders=id&__limit=20' % (i % 50)
+            else:
+                path = '/line/line-%04d' % (i * 7 % 5000)
+            started = time.time()
+            yield http.fetch(url + path, request_timeout=600)
+            latencies.append(time.time() - started)
+
+    slow = [_slow_client() for _ in range(SLOW_CLIENTS)]
+    # 等报表请求占满阻塞路径后再开始
+    yield gen.sleep(SLOW_QUERY / 2)
+    started = time.time()
+    yield [_fast_client() for _ in range(FAST_CLIENTS)]
+    elapsed = time.time() - started
+    done.append(True)
+    yield slow
+    http.close()
+    raise gen.Return((latencies, reports[0], elapsed))
+
+
+def fast_only(io_loop):
+    for concurrency in CONCURRENCY:
+        rows = []
+        for name, request in (('executor + list', blocking), ('alist', non_blocking)):
+            io_loop.run_sync(lambda: run(request, concurrency))
+            elapsed, latencies = io_loop.run_sync(lambda: run(request, concurrency))
+            rows.append((name, elapsed, REQUESTS, latencies))
+        common.report('%d concurrent clients, %d requests, %d connections' % (concurrency, REQUESTS, POOL_SIZE),
+                      [(name, elapsed, count) for name, elapsed, count, latencies in rows])
+        for name, elapsed, count, latencies in rows:
+            print('  %-28s p50 %6.2f ms  p99 %6.2f ms' % (name, common.percentile(latencies, 50) * 1000,
+                                                         common.percentile(latencies, 99) * 1000))
+
+
+def with_slow_queries(io_loop):
+    print('%d clients on a %d ms report, %d clients on /lines and /line/<uuid>, %d sync + %d async connections' % (
+        SLOW_CLIENTS, SLOW_QUERY * 1000, FAST_CLIENTS, POOL_SIZE, POOL_SIZE))
+    for name, report, lines, line in MODES:
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        server = HTTPServer(Application(report, lines, line))
+        server.add_sockets(sockets)
+        try:
+            latencies, reports, elapsed = io_loop.run_sync(lambda: slow_load(sockets[0].getsockname()[1]))
+        finally:
+            server.stop()
+            io_loop.run_sync(server.close_all_connections)
+        print('  %-22s %6.0f req/s  p50 %7.2f ms  p99 %7.2f ms  reports %d' % (
+            name, len(latencies) / elapsed, common.percentile(latencies, 50) * 1000,
+            common.percentile(latencies, 99) * 1000, reports))
+
+
+def main():
+    engine = support.connect(support.TEST_DB)
+    support.create_schema(engine)
+    support.seed(engine, cities=50, lines=5000)
+    support.refresh_pool(pool_size=POOL_SIZE, max_overflow=0, aio_pool_size=POOL_SIZE)
+    # 排队上限足够大，只比较延迟不产生拒绝
+    executor.setup(max_workers=POOL_SIZE, max_queue=REQUESTS)
+    io_loop = IOLoop.current()
+    try:
+        fast_only(io_loop)
+        with_slow_queries(io_loop)
+    finally:
+        support.pool.POOL.dispose()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 15:20
+# @File    : bench_filter_plan.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    building the filtered query for 1/10/50 filter terms, with the filter plan resolved on every call vs memoized
+"""
+from __future__ import absolute_import
+
+from sqlalchemy import orm
+
+from benchmarks import common
+from tests import support  # noqa: F401
+from ork.db import curd
+from ork.db import models
+
+NUMBER = 200
+
+
+class OperationLog(curd.ResourceBase):
+    orm_meta = models.SysOperationLog
+
+
+def make_filters(terms):
+    """
+    生成terms个过滤条件，覆盖字符串、数字、时间列以及JSONB路径
+    """
+    candidates = [('resource', 'eq', 'line'), ('tenant_uuid', 'in', ['t1', 't2']), ('user_name', 'starts', 'adm'),
+                  ('operation', 'ne', 'delete'), ('id', 'gt', 10), ('id', 'lte', 100000),
+                  ('operate_time', 'gte', '2019-05-01 00:00:00'), ('operate_time', 'lt', '2019-06-01 00:00:00')]
+    candidates += [('data_after.key%d' % i, op, 'v%d' % i) for i in range(50) for op in ('eq', 'ilike')]
+    filters = {}
+    for expression, op, value in candidates[:terms]:
+        filters.setdefault(expression, {})[op] = value
+    return filters
+
+
+def build(resource, session, filters):
+    return resource._get_query(session, filters=filters, orders=['-operate_time', 'id'])
+
+
+def build_unplanned(resource, session, filters):
+    # 清空缓存，每次调用都重新解析列、过滤器以及操作函数
+    curd._FILTER_PLAN_CACHE.clear()
+    curd._COLUMN_CACHE.clear()
+    return build(resource, session, filters)
+
+
+def main():
+    resource = OperationLog()
+    session = orm.Session()
+    for terms in (1, 10, 50):
+        filters = make_filters(terms)
+        assert str(build_unplanned(resource, session, filters)) == str(build(resource, session, filters))
+        common.report('%d filter terms, %d queries' % (terms, NUMBER), [
+            ('plan per call', common.best_of(lambda: build_unplanned(resource, session, filters), number=NUMBER),
+             NUMBER),
+            ('memoized plan', common.best_of(lambda: build(resource, session, filters), number=NUMBER), NUMBER),
+        ])
+
+
+if __name__ == '__main__':
+    main()
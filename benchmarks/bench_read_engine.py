@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 14:40
+# @File    : bench_read_engine.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    ResourceBase.list rows/sec with the ORM read engine vs the Core read engine, uses the database in ORK_TEST_DB
+"""
+from __future__ import absolute_import
+
+from benchmarks import common
+from tests import support
+from ork.apps.traffic import resource
+
+CITIES = 50
+ROWS = 2000
+
+
+class CoreCity(resource.City):
+    _read_engine = 'core'
+
+
+class CoreLine(resource.Line):
+    _read_engine = 'core'
+
+
+def main():
+    engine = support.connect(support.TEST_DB)
+    support.create_schema(engine)
+    support.seed(engine, cities=CITIES, lines=ROWS)
+    support.refresh_pool()
+    try:
+        for name, orm_resource, core_resource, count in (('line', resource.Line, CoreLine, ROWS),
+                                                         ('city', resource.City, CoreCity, CITIES)):
+            for as_json in (False, True):
+                assert orm_resource().list(as_json=as_json) == core_resource().list(as_json=as_json)
+                common.report('%s: %d rows per list, %s' % (name, count, 'json' if as_json else 'dicts'), [
+                    ('orm', common.best_of(lambda: orm_resource().list(as_json=as_json)), count),
+                    ('core', common.best_of(lambda: core_resource().list(as_json=as_json)), count),
+                ])
+    finally:
+        support.pool.POOL.dispose()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
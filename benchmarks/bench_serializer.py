@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 11:10
+# @File    : bench_serializer.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    list response encoding: to_dict + dumps/loads round trip + tornado encode vs the precompiled serializer
+"""
+from __future__ import absolute_import
+
+import datetime
+import json
+
+from tornado import escape
+
+from benchmarks import common
+from ork.core import utils
+from ork.db import models
+from ork.db import serializer
+
+ROWS = 2000
+
+
+def _lines():
+    return [models.Line(uuid='line-%06d' % i, id=i, name=u'线路 %d' % i, city_id='c%d' % (i % 50))
+            for i in range(ROWS)]
+
+
+def _logs():
+    now = datetime.datetime(2019, 5, 29, 11, 10, 0)
+    return [models.SysOperationLog(id=i, resource='line', tenant_uuid='t', user_name='admin', operation='update',
+                                   operate_time=now + datetime.timedelta(seconds=i)) for i in range(ROWS)]
+
+
+def to_dict_path(records):
+    # 改造之前CollectionHandler的输出方式
+    refs = [record.to_dict() for record in records]
+    body = json.loads(json.dumps({'count': len(refs), 'data': refs}, cls=utils.ComplexEncoder))
+    return escape.json_encode(body)
+
+
+def serializer_path(records):
+    dumps = serializer.get_serializer(type(records[0])).dumps
+    return '{"count": %s, "data": [%s]}' % (serializer.dumps(len(records)), ','.join(dumps(r) for r in records))
+
+
+def main():
+    for name, records in (('line', _lines()), ('sys_operation_log', _logs())):
+        assert json.loads(to_dict_path(records)) == json.loads(serializer_path(records))
+        common.report('%s: %d rows per response' % (name, ROWS), [
+            ('to_dict + dumps/loads', common.best_of(lambda: to_dict_path(records)), ROWS),
+            ('precompiled serializer', common.best_of(lambda: serializer_path(records)), ROWS),
+        ])
+
+
+if __name__ == '__main__':
+    main()
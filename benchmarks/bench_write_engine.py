@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 17:30
+# @File    : bench_write_engine.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    create/update/delete writes/sec with the ORM write engine vs the RETURNING write engine,
+    uses the database in ORK_TEST_DB
+"""
+from __future__ import absolute_import
+
+import time
+
+from benchmarks import common
+from tests import support
+from ork.apps.traffic import resource
+
+WRITES = 300
+
+
+class ReturningLine(resource.Line):
+    _write_engine = 'returning'
+
+
+def _run(resource_class):
+    """
+    依次创建、更新、删除WRITES条线路，返回[(写入类型, 耗时)]，删除依赖创建的数据，每种写入只能执行一轮
+    """
+    res = resource_class()
+    uuids = []
+    timings = []
+    for name, write in (('create', lambda i: uuids.append(res.create({'id': i, 'name': 'bench',
+                                                                      'city_id': 'c%d' % (i % 5)})['uuid'])),
+                        ('update', lambda i: res.update(uuids[i], {'name': 'bench %d' % i})),
+                        ('delete', lambda i: res.delete(uuids[i]))):
+        started = time.time()
+        for i in range(WRITES):
+            write(i)
+        timings.append((name, time.time() - started))
+    return timings
+
+
+def main():
+    engine = support.connect(support.TEST_DB)
+    support.create_schema(engine)
+    support.seed(engine, lines=0)
+    support.refresh_pool()
+    try:
+        # 预热连接以及语句缓存
+        _run(resource.Line)
+        _run(ReturningLine)
+        results = [_run(resource.Line), _run(ReturningLine)]
+        for index, name in enumerate(('create', 'update', 'delete')):
+            common.report('%s: %d writes' % (name, WRITES), [
+                ('orm', results[0][index][1], WRITES),
+                ('returning', results[1][index][1], WRITES),
+            ])
+    finally:
+        support.pool.POOL.dispose()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
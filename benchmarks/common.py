@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 11:00
+# @File    : common.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    timing helpers for the benchmarks, run a benchmark with python -m benchmarks.<name> from the project root
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import time
+
+
+def best_of(func, repeat=5, number=1):
+    """
+    执行repeat轮，每轮调用number次func，返回最快一轮的耗时(秒)，排除偶发的调度、GC影响
+    :param func: 被测函数
+    :type func: callable
+    :returns: 耗时(秒)
+    :rtype: float
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        for _ in range(number):
+            func()
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+def percentile(values, pct):
+    """
+    :param values: 样本
+    :type values: list
+    :param pct: 百分位，如99
+    :type pct: float
+    :returns: 最近秩法的百分位数
+    :rtype: float
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = max(int(round(pct / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def report(title, rows):
+    """
+    输出对比表格
+    :param title: 标题
+    :type title: str
+    :param rows: [(名称, 耗时(秒), 每轮处理的数量)]
+    :type rows: list
+    """
+    print(title)
+    baseline = rows[0][1]
+    for name, seconds, count in rows:
+        rate = count / seconds if seconds else float('inf')
+        print('  %-28s %9.2f ms  %12.0f /s  x%.2f' % (name, seconds * 1000, rate, baseline / seconds if seconds else 0))
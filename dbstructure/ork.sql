@@ -1,3 +1,4 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 CREATE TABLE public.city
 (
     uuid VARCHAR(63) PRIMARY KEY,
@@ -10,4 +11,7 @@ CREATE TABLE public.line
     id int NOT NULL,
     name varchar(255) NOT NULL,
     city_id varchar(63) NOT NULL
-);
\ No newline at end of file
+);
+CREATE INDEX ix_city_name_trgm ON public.city USING gin (name gin_trgm_ops);
+CREATE INDEX ix_line_name_trgm ON public.line USING gin (name gin_trgm_ops);
+CREATE UNIQUE INDEX ux_line_city_id_id ON public.line (city_id, id);
@@ -15,8 +15,15 @@ import logging
 from ...apps.traffic import resource
 from ...common.consumer import MessageConsumer
 from ...common.consumer import SubscribeConsumer
+from ...common.handler import AsyncCollectionHandler
+from ...common.handler import AsyncItemHandler
 from ...common.handler import CollectionHandler
+from ...common.handler import ExportHandler
+from ...common.handler import ImportHandler
+from ...common.handler import IndexAdviceHandler
 from ...common.handler import ItemHandler
+from ...common.handler import MetricsHandler
+from ...common.handler import PoolStatsHandler
 from ...common.handler import WSHandler
 from ...core.base import BaseHandler
 
@@ -82,16 +89,38 @@ class ItemCity(ItemHandler):
     resource = resource.City
 
 
-class CollectionLine(CollectionHandler):
+class CollectionLine(AsyncCollectionHandler):
     name = 'traffic.line'
     resource = resource.Line
 
 
-class ItemLine(ItemHandler):
+class ExportLine(ExportHandler):
     name = 'traffic.line'
     resource = resource.Line
 
 
+class ImportLine(ImportHandler):
+    name = 'traffic.line'
+    resource = resource.Line
+
+
+class ItemLine(AsyncItemHandler):
+    name = 'traffic.line'
+    resource = resource.Line
+
+
+class IndexAdvice(IndexAdviceHandler):
+    pass
+
+
+class PoolStats(PoolStatsHandler):
+    pass
+
+
+class Metrics(MetricsHandler):
+    pass
+
+
 class Index(BaseHandler):
     allow_methods = ("GET",)
 
@@ -15,12 +15,16 @@ from ...db.curd import ResourceBase
 
 class City(ResourceBase):
     orm_meta = models.City
-    _primary_keys = ('uid',)
+    _primary_keys = ('uuid',)
 
 
 class Line(ResourceBase):
     orm_meta = models.Line
     _primary_keys = ('uuid',)
+    # upsert按城市内的线路编号判断线路是否已存在
+    _unique_keys = ('city_id', 'id')
+    # 配置了分片时线路按城市分片
+    _shard_key = 'city_id'
 
     def _before_create(self, resource):
         resource['uuid'] = utils.generate_prefix_uuid(prefix='line-')
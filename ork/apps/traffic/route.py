@@ -8,6 +8,7 @@
 
 from __future__ import absolute_import
 
+from ...core.config import CONF
 from ..traffic import controller
 
 
@@ -15,7 +16,19 @@ def add_routes(api):
     api.add_route(r"/cities", controller.CollectionCity)
     api.add_route(r"/city/(.*)", controller.ItemCity)
     api.add_route(r"/lines", controller.CollectionLine)
+    api.add_route(r"/lines/export", controller.ExportLine)
+    api.add_route(r"/lines/import", controller.ImportLine)
     api.add_route(r"/line/(.*)", controller.ItemLine)
+    # 索引建议输出慢查询SQL以及执行计划，并且可以执行EXPLAIN ANALYZE，配置开启时才注册
+    if CONF.db.get('index_advice', False):
+        api.add_route(r"/admin/index-advice", controller.IndexAdvice)
+    # 连接池统计包含数据库地址以及按请求路由的统计，配置开启时才注册
+    if CONF.db.get('pool_stats', False):
+        api.add_route(r"/admin/pool-stats", controller.PoolStats)
+    # 指标关闭时不注册
+    metrics_conf = CONF.get('metrics')
+    if metrics_conf is None or metrics_conf.get('enabled', True):
+        api.add_route(r"/metrics", controller.Metrics)
     api.add_route(r"/", controller.Index)
 
     # api.add_route(r"/socket/", controller.SocketHandler),
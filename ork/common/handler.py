@@ -9,34 +9,284 @@
 from __future__ import absolute_import
 
 import copy
+import csv
+import itertools
 import json
+import logging
+import time
 
+import six
+from concurrent import futures
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.web import HTTPError
+from tornado.web import stream_request_body
+
+from ..core import exception
+from ..core import executor
+from ..core import metrics
+from ..core import utils
+from ..core.i18n import _
 from ..core.base import BaseHandler
 from ..core.base import BaseWebSocketHandler
-from ..core.utils import ComplexEncoder
+from ..db import advisor
+from ..db import cache
+from ..db import pool
+from ..db import serializer
+from ..db import telemetry
+from ..db import versioning
 
+LOG = logging.getLogger(__name__)
 
 # from .logger import change_log
 
 
+def _dumps_record(resource, data):
+    """
+    使用资源Model的预编译序列化器输出to_dict级别的字典
+    :param resource: 资源类
+    :type resource: ResourceBase
+    :param data: to_dict级别的资源字典
+    :type data: dict
+    :returns: JSON文本
+    :rtype: str
+    """
+    if data is None:
+        return 'null'
+    return serializer.get_serializer(resource.orm_meta).dumps_mapping(data)
+
+
+def _not_modified(handler, *parts):
+    """
+    根据资源表版本以及请求参数设置强ETag，与If-None-Match一致时设置304，
+    调用者应直接返回，不再查询以及序列化；变更通知的监听连接不可用时其他主机的写入不会更新表版本，不输出ETag；
+    表版本来自主库的变更通知，副本上的数据可能落后，配置了副本时只有条件请求输出ETag，并且读取主库，
+    其他请求读取副本，不输出表版本ETag
+    :param handler: 请求处理器
+    :type handler: BaseHandler
+    :param parts: 影响输出内容的参数
+    :type parts: list
+    :returns: 是否未修改
+    :rtype: bool
+    """
+    if not handler.etag_enabled or handler.resource is None or not cache.enabled():
+        return False
+    if pool.POOL.replicas and not handler.read_primary():
+        if not handler.request.headers.get('If-None-Match'):
+            return False
+        handler.primary_reads = True
+    handler.set_header('Etag', versioning.etag(handler.resource.orm_meta, handler.request.path, *parts))
+    if handler.check_etag_header():
+        handler.set_status(304)
+        return True
+    return False
+
+
 class CollectionHandler(BaseHandler):
     """集合控制器"""
-    allow_methods = ("GET", "POST")
+    allow_methods = ("GET", "POST", "PUT", "PATCH", "DELETE")
+    # 阻塞的资源调用按配置(db.blocking_executor)在有界线程池中执行
+    blocking_executor = None
+    # 是否根据资源表版本输出ETag并处理If-None-Match，数据不只经由ResourceBase修改时应关闭
+    etag_enabled = True
+    # 流式输出时每批写出并flush的行数
+    stream_chunk_size = 500
 
+    @gen.coroutine
     def get(self, *args, **kwargs):
         self._validate_method(self.request, self.allow_methods)
         criteria = self._build_criteria(self.request)
+        stream_mode = self._stream_mode(self.request)
+        if _not_modified(self, criteria, stream_mode):
+            return
+        if stream_mode:
+            yield self._stream(criteria, ndjson=(stream_mode == 'ndjson'), **kwargs)
+            return
+        refs, count = yield self.run_blocking(self._list_and_count, criteria, **kwargs)
+        self._write_list(criteria, refs, count)
+
+    def _list_and_count(self, criteria, **kwargs):
+        # 列表以及统计在同一个阻塞调用中执行，避免列表查询完成后统计被拒绝
         refs = self.list(copy.deepcopy(criteria), **kwargs)
-        count = self.count(criteria, results=refs, **kwargs)
-        self.request.json = json.loads(json.dumps({'count': count, 'data': refs}, cls=ComplexEncoder))
-        self.write(self.request.json)
+        return refs, self.count(criteria, results=refs, **kwargs)
+
+    def _write_list(self, criteria, refs, count):
+        if criteria.get('after') is None:
+            self.write_json('{"count": %s, "data": [%s]}' % (serializer.dumps(count), ','.join(refs)))
+        else:
+            self.write_json('{"count": %s, "data": [%s], "next": %s}' % (
+                serializer.dumps(count), ','.join(refs), serializer.dumps(getattr(refs, 'next_cursor', None))))
 
+    @gen.coroutine
     def post(self, *args, **kwargs):
         self._validate_method(self.request, self.allow_methods)
-        self._validate_data(self.request, self.request.json)
-        response = self.create(self.request.json)
+        self._validate_data(self.request, self.request.body)
+        if self._upsert_mode(self.request):
+            yield self._upsert(**kwargs)
+            return
+        if isinstance(self.request.json, list):
+            # 批量创建，部分失败时返回207以及每行的错误
+            refs, errors = yield self.run_blocking(self.create_many, self.request.json, **kwargs)
+            self.set_status(status_code=207 if errors else 201)
+            self.write_json('{"count": %d, "data": [%s], "errors": %s}' % (
+                len(refs), ','.join(_dumps_record(self.resource, ref) for ref in refs), serializer.dumps(errors)))
+            return
+        response = yield self.run_blocking(self.create, self.request.json)
         self.set_status(status_code=201)
-        self.write(response)
+        self.write_json(_dumps_record(self.resource, response))
+
+    @gen.coroutine
+    def put(self, *args, **kwargs):
+        """
+        创建或更新资源(upsert)，请求体为单个资源或资源列表，与POST ?__upsert=1一致
+        """
+        self._validate_method(self.request, self.allow_methods)
+        self._validate_data(self.request, self.request.body)
+        yield self._upsert(**kwargs)
+
+    @gen.coroutine
+    def _upsert(self, **kwargs):
+        """
+        执行upsert并输出每行的操作(create/update)，单个资源新建时返回201，更新时返回200；
+        资源列表部分失败时返回207以及每行的错误
+        """
+        if isinstance(self.request.json, list):
+            refs, errors = yield self.run_blocking(self.upsert_many, self.request.json, **kwargs)
+            self.set_status(status_code=207 if errors else 200)
+            self.write_json('{"count": %d, "data": [%s], "errors": %s}' % (
+                len(refs), ','.join('{"index": %d, "operation": "%s", "data": %s}' % (
+                    ref['index'], ref['operation'], _dumps_record(self.resource, ref['data'])) for ref in refs),
+                serializer.dumps(errors)))
+            return
+        operation, response = yield self.run_blocking(self.create_or_update, self.request.json, **kwargs)
+        self.set_status(status_code=201 if operation == 'create' else 200)
+        self.write_json('{"operation": "%s", "data": %s}' % (operation, _dumps_record(self.resource, response)))
+
+    @staticmethod
+    def _upsert_mode(req):
+        values = req.arguments.get('__upsert')
+        return bool(values) and utils.bool_from_string(utils.ensure_unicode(values[-1]).strip())
+
+    @gen.coroutine
+    def patch(self, *args, **kwargs):
+        """
+        按过滤条件批量更新资源，过滤条件与GET一致，至少需要一个过滤条件
+        """
+        self._validate_method(self.request, self.allow_methods)
+        self._validate_data(self.request, self.request.body)
+        criteria = self._build_criteria(self.request)
+        count, refs = yield self.run_blocking(self.update_many, criteria['filters'], self.request.json,
+                                              chunk_size=self._chunk_size(self.request), **kwargs)
+        self.write_json('{"count": %d, "data": [%s]}' % (
+            count, ','.join(_dumps_record(self.resource, ref) for ref in refs)))
+
+    @gen.coroutine
+    def delete(self, *args, **kwargs):
+        """
+        按过滤条件批量删除资源，过滤条件与GET一致，至少需要一个过滤条件
+        """
+        self._validate_method(self.request, self.allow_methods)
+        criteria = self._build_criteria(self.request)
+        count, refs = yield self.run_blocking(self.delete_many, criteria['filters'],
+                                              chunk_size=self._chunk_size(self.request), **kwargs)
+        self.write_json('{"count": %d, "detail": [%s]}' % (
+            count, ','.join(_dumps_record(self.resource, ref) for ref in refs)))
+
+    @staticmethod
+    def _chunk_size(req):
+        """
+        批量更新、删除时按主键范围分块的大小，__chunk_size未指定时不分块
+        """
+        values = req.arguments.get('__chunk_size')
+        if not values:
+            return None
+        try:
+            chunk_size = int(utils.ensure_unicode(values[-1]))
+        except ValueError:
+            chunk_size = 0
+        if chunk_size <= 0:
+            raise exception.ValidationError(message=_('__chunk_size must be a positive integer'))
+        return chunk_size
+
+    @staticmethod
+    def _stream_mode(req):
+        """
+        判断是否使用流式输出
+        Accept: application/x-ndjson 或 __stream=ndjson 使用NDJSON，每行一个资源；
+        __stream=1 使用分块输出的JSON，结构与普通列表请求一致
+        :param req: 请求对象
+        :type req: Request
+        :returns: 'ndjson'/'json'/None
+        :rtype: str
+        """
+        if 'application/x-ndjson' in req.headers.get('Accept', ''):
+            return 'ndjson'
+        values = req.arguments.get('__stream')
+        if not values:
+            return None
+        value = utils.ensure_unicode(values[-1]).strip().lower()
+        if value == 'ndjson':
+            return 'ndjson'
+        if utils.bool_from_string(value):
+            return 'json'
+        return None
+
+    @gen.coroutine
+    def _stream(self, criteria, ndjson=False, **kwargs):
+        """
+        逐批序列化并flush资源，内存占用与结果集大小无关，
+        每批行在阻塞线程中从数据库游标读取，IOLoop只负责写出
+        :param criteria: {'filters': filters, 'offset': offset, 'limit': limit}
+        :type criteria: dict
+        :param ndjson: 是否使用NDJSON格式输出
+        :type ndjson: bool
+        """
+        rows = self.iter_list(copy.deepcopy(criteria), **kwargs)
+        try:
+            if ndjson:
+                self.set_header('Content-Type', 'application/x-ndjson; charset=UTF-8')
+                separator = '\n'
+            else:
+                self.set_header('Content-Type', 'application/json; charset=UTF-8')
+                count = yield self.run_blocking(self.count, criteria, **kwargs)
+                self.write('{"count": %s, "data": [' % serializer.dumps(count))
+                separator = ','
+            first = True
+            while True:
+                chunk = yield self.run_blocking(self._next_chunk, rows, self.stream_chunk_size)
+                if not chunk:
+                    break
+                self.write(self._join_chunk(chunk, separator, first, ndjson))
+                first = False
+                if len(chunk) < self.stream_chunk_size:
+                    break
+                yield self.flush()
+            if not ndjson:
+                self.write(']}')
+        finally:
+            yield self._close_rows(rows)
+
+    @staticmethod
+    def _next_chunk(rows, size):
+        return list(itertools.islice(rows, size))
+
+    @gen.coroutine
+    def _close_rows(self, rows):
+        # 关闭生成器会释放会话以及服务端游标，线程池拒绝时在IOLoop上直接关闭，避免连接泄漏
+        try:
+            yield self.run_blocking(rows.close)
+        except HTTPError:
+            rows.close()
+
+    @staticmethod
+    def _join_chunk(chunk, separator, first, ndjson):
+        body = separator.join(chunk)
+        if ndjson:
+            return body + separator
+        if not first:
+            return separator + body
+        return body
 
     def count(self, criteria, results=None, **kwargs):
         """
@@ -47,14 +297,25 @@ class CollectionHandler(BaseHandler):
         :type criteria: dict
         :param results: criteria过滤出来的结果集
         :type results: list
-        :returns: 符合条件的资源数量
+        :returns: 符合条件的资源数量，__count=none时为None
         :rtype: int
         """
         criteria = copy.deepcopy(criteria)
+        mode = criteria.pop('count', None) or 'exact'
+        if mode == 'none':
+            return None
+        # 列表查询时已经通过窗口函数统计出总数
+        total = getattr(results, 'total', None)
+        if mode == 'exact' and total is not None:
+            return total
         # remove offset,limit
         criteria.pop('offset')
         criteria.pop('limit')
         criteria.pop('orders')
+        criteria.pop('after', None)
+        criteria.pop('fields', None)
+        if mode == 'estimate':
+            return self.make_resource().estimate_count(**criteria)
         return self.make_resource().count(**criteria)
 
     def list(self, criteria, **kwargs):
@@ -64,10 +325,22 @@ class CollectionHandler(BaseHandler):
         :type req: Request
         :param criteria: {'filters': filters, 'offset': offset, 'limit': limit}
         :type criteria: dict
-        :returns: 符合条件的资源
+        :returns: 符合条件的资源，每个资源为序列化后的JSON文本
         :rtype: list
         """
-        return self.make_resource().list(**criteria)
+        criteria['count'] = criteria.get('count') or 'exact'
+        return self.make_resource().list(as_json=True, **criteria)
+
+    def iter_list(self, criteria, **kwargs):
+        """
+        根据过滤条件，以生成器方式逐行获取资源，用于流式输出
+        :param criteria: {'filters': filters, 'offset': offset, 'limit': limit}
+        :type criteria: dict
+        :returns: 符合条件的资源生成器，每个资源为序列化后的JSON文本
+        :rtype: generator
+        """
+        criteria.pop('count', None)
+        return self.make_resource().iter_list(chunk_size=self.stream_chunk_size, as_json=True, **criteria)
 
     # @change_log()
     def create(self, data, **kwargs):
@@ -82,11 +355,447 @@ class CollectionHandler(BaseHandler):
         """
         return self.make_resource().create(data)
 
+    def update_many(self, filters, data, chunk_size=None, **kwargs):
+        """
+        按过滤条件批量更新资源
+        :param filters: 过滤条件
+        :type filters: dict
+        :param data: 更新的字段以及值
+        :type data: dict
+        :param chunk_size: 按主键范围分块的大小
+        :type chunk_size: int
+        :returns: (更新的数量, 更新后的资源列表)
+        :rtype: tuple
+        """
+        return self.make_resource().update_many(filters, data, chunk_size=chunk_size)
+
+    def delete_many(self, filters, chunk_size=None, **kwargs):
+        """
+        按过滤条件批量删除资源
+        :param filters: 过滤条件
+        :type filters: dict
+        :param chunk_size: 按主键范围分块的大小
+        :type chunk_size: int
+        :returns: (删除的数量, 删除的资源列表)
+        :rtype: tuple
+        """
+        return self.make_resource().delete_many(filters, chunk_size=chunk_size)
+
+    def create_many(self, data, **kwargs):
+        """
+        批量创建资源
+        :param data: 资源列表
+        :type data: list
+        :returns: (创建后的资源信息列表, 错误列表)
+        :rtype: tuple
+        """
+        return self.make_resource().create_many(data)
+
+    # @change_log()
+    def create_or_update(self, data, **kwargs):
+        """
+        创建或更新资源
+        :param data: 资源的内容
+        :type data: dict
+        :returns: (操作'create'/'update', 创建或更新后的资源信息)
+        :rtype: tuple
+        """
+        return self.make_resource().create_or_update(data)
+
+    # @change_log()
+    def upsert_many(self, data, **kwargs):
+        """
+        批量创建或更新资源
+        :param data: 资源列表
+        :type data: list
+        :returns: (结果列表[{'index': 输入位置, 'operation': 'create'/'update', 'data': 资源}], 错误列表)
+        :rtype: tuple
+        """
+        return self.make_resource().upsert_many(data)
+
+
+class AsyncCollectionHandler(CollectionHandler):
+    """
+    异步集合控制器，列表以及统计查询在异步连接上执行，等待数据库期间worker可以处理其他请求，
+    要求资源Model输出的属性全部为列；流式输出、估算统计以及写操作仍使用同步连接
+    """
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):
+        self._validate_method(self.request, self.allow_methods)
+        criteria = self._build_criteria(self.request)
+        stream_mode = self._stream_mode(self.request)
+        if _not_modified(self, criteria, stream_mode):
+            return
+        if stream_mode:
+            yield self._stream(criteria, ndjson=(stream_mode == 'ndjson'), **kwargs)
+            return
+        refs = yield self.alist(copy.deepcopy(criteria), **kwargs)
+        count = yield self.acount(criteria, results=refs, **kwargs)
+        self._write_list(criteria, refs, count)
+
+    @gen.coroutine
+    def acount(self, criteria, results=None, **kwargs):
+        """
+        count的异步版本，__count=estimate时使用同步的估算统计
+        :returns: 符合条件的资源数量，__count=none时为None
+        :rtype: int
+        """
+        mode = criteria.get('count') or 'exact'
+        if mode == 'none':
+            raise gen.Return(None)
+        total = getattr(results, 'total', None)
+        if mode == 'exact' and total is not None:
+            raise gen.Return(total)
+        if mode != 'exact':
+            count = yield self.run_blocking(self.count, criteria, results=results, **kwargs)
+            raise gen.Return(count)
+        count = yield self.make_resource().acount(filters=criteria['filters'])
+        raise gen.Return(count)
+
+    @gen.coroutine
+    def alist(self, criteria, **kwargs):
+        """
+        list的异步版本
+        :returns: 符合条件的资源，每个资源为序列化后的JSON文本
+        :rtype: list
+        """
+        criteria['count'] = criteria.get('count') or 'exact'
+        refs = yield self.make_resource().alist(as_json=True, **criteria)
+        raise gen.Return(refs)
+
+
+class _FlushWriter(object):
+    """
+    COPY输出的文件对象，在线程中被写入，缓冲满后交给IOLoop写出并等待flush完成，
+    客户端接收慢时COPY随之放慢，内存占用不超过一个缓冲；
+    一次flush超过write_timeout时抛出futures.TimeoutError中止COPY，释放线程以及数据库连接
+    """
+
+    def __init__(self, handler, io_loop, chunk_size, write_timeout=None):
+        self.handler = handler
+        self.io_loop = io_loop
+        self.chunk_size = chunk_size
+        self.write_timeout = write_timeout
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = b''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        future = futures.Future()
+        self.io_loop.add_callback(self._deliver, chunk, future)
+        # 客户端断开或者接收过慢时抛出异常，中止COPY
+        future.result(timeout=self.write_timeout)
+
+    @gen.coroutine
+    def _deliver(self, chunk, future):
+        try:
+            self.handler.write(chunk)
+            yield self.handler.flush()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+
+class ExportHandler(BaseHandler):
+    """
+    集合导出控制器，过滤条件与集合GET一致，format=csv|ndjson，
+    使用COPY (SELECT ...) TO STDOUT在线程中导出，边读取边输出
+    """
+    allow_methods = ('GET',)
+    blocking_executor = True
+    # 是否根据资源表版本输出ETag并处理If-None-Match，数据不只经由ResourceBase修改时应关闭
+    etag_enabled = True
+    # 每次写出并flush的字节数
+    export_chunk_size = 64 * 1024
+    # 写出一块等待flush完成的最长时间(秒)，超过时断开客户端，避免慢客户端长期占用线程以及数据库连接
+    export_write_timeout = 30
+    content_types = {'csv': 'text/csv; charset=UTF-8', 'ndjson': 'application/x-ndjson; charset=UTF-8'}
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):
+        self._validate_method(self.request, self.allow_methods)
+        criteria = self._build_criteria(self.request)
+        export_format = criteria['filters'].pop('format', None) or 'csv'
+        if export_format not in self.content_types:
+            raise exception.ValidationError(message=utils.format_kwstring(
+                _('export format must be one of csv, ndjson, not %(format)s'), format=export_format))
+        if _not_modified(self, criteria, export_format):
+            return
+        self.set_header('Content-Type', self.content_types[export_format])
+        self.set_header('Content-Disposition', 'attachment; filename="%s.%s"' % (
+            self.resource.orm_meta.__tablename__, export_format))
+        writer = _FlushWriter(self, IOLoop.current(), self.export_chunk_size, self.export_write_timeout)
+        try:
+            yield self.run_blocking(self._export, writer, criteria, export_format, **kwargs)
+        except StreamClosedError:
+            # 客户端已断开，COPY随写入失败中止，无需再输出错误
+            pass
+        except futures.TimeoutError:
+            # 响应已经开始输出，无法再返回错误状态，直接断开
+            LOG.warning('export of %s timed out writing to %s after %ss', self.request.path,
+                        self.request.remote_ip, self.export_write_timeout)
+            self.request.connection.close()
+
+    def _export(self, writer, criteria, export_format, **kwargs):
+        self.make_resource().export(writer, filters=criteria['filters'], orders=criteria['orders'],
+                                    offset=criteria['offset'], limit=criteria['limit'], fields=criteria['fields'],
+                                    export_format=export_format)
+        writer.flush()
+
+
+def _split_csv(record):
+    """
+    解析一条完整的CSV记录
+    :param record: UTF-8编码的CSV记录
+    :type record: bytes
+    :returns: 字段列表
+    :rtype: list
+    """
+    if six.PY2:
+        return [cell.decode('utf-8') for cell in next(csv.reader([record]))]
+    return next(csv.reader([record.decode('utf-8')]))
+
+
+class _RowParser(object):
+    """
+    增量解析CSV(首行为表头)/NDJSON请求体，每次输入一个数据块，输出其中完整的行
+    """
+
+    def __init__(self, import_format):
+        self.format = import_format
+        self.index = 0
+        self._buffer = b''
+        self._record = b''
+        self._header = None
+
+    def feed(self, chunk):
+        """
+        :returns: [(行号, 资源或None, 错误信息或None)]
+        :rtype: list
+        """
+        lines = (self._buffer + chunk).split(b'\n')
+        self._buffer = lines.pop()
+        return self._parse(lines)
+
+    def close(self):
+        lines = [self._buffer] if self._buffer else []
+        self._buffer = b''
+        rows = self._parse(lines)
+        if self._record:
+            rows.append(self._row(None, _('unterminated quoted field')))
+            self._record = b''
+        return rows
+
+    def _row(self, values, error=None):
+        row = (self.index, values, error)
+        self.index += 1
+        return row
+
+    def _parse(self, lines):
+        rows = []
+        for line in lines:
+            if self.format == 'csv':
+                # 引号内的换行属于字段内容，引号数为奇数时记录尚未结束
+                record = self._record + line
+                if record.count(b'"') % 2:
+                    self._record = record + b'\n'
+                    continue
+                self._record = b''
+                line = record
+            line = line.rstrip(b'\r')
+            if not line.strip():
+                continue
+            try:
+                if self.format == 'ndjson':
+                    rows.append(self._row(json.loads(line.decode('utf-8'))))
+                    continue
+                cells = _split_csv(line)
+            except (ValueError, csv.Error) as e:
+                rows.append(self._row(None, utils.format_kwstring(_('malformed row: %(error)s'), error=e)))
+                continue
+            if self._header is None:
+                self._header = cells
+            elif len(cells) != len(self._header):
+                rows.append(self._row(None, utils.format_kwstring(_('expected %(expected)d fields, got %(count)d'),
+                                                                  expected=len(self._header), count=len(cells))))
+            else:
+                rows.append(self._row(dict(zip(self._header, cells))))
+        return rows
+
+
+@stream_request_body
+class ImportHandler(BaseHandler):
+    """
+    集合导入控制器，POST ?format=csv|ndjson，请求体边接收边解析，按批插入(与批量创建一致的校验以及逐行错误)，
+    每批提交一次，批量插入期间暂停读取请求体；不会缓存整个请求体
+    """
+    allow_methods = ('POST',)
+    blocking_executor = True
+    # 每批插入的行数
+    import_batch_size = 1000
+    # 每秒最多导入的行数，0表示不限制，超过时暂停读取请求体
+    max_row_rate = 0
+    # 请求体大小上限(字节)
+    max_import_size = 1024 * 1024 * 1024
+    # 响应中最多输出的错误数，错误总数在error_count中
+    max_reported_errors = 1000
+    content_types = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+    def prepare(self):
+        super(ImportHandler, self).prepare()
+        self._validate_method(self.request, self.allow_methods)
+        import_format = self.get_query_argument('format', None)
+        if import_format is None:
+            content_type = self.request.headers.get('Content-Type', '').split(';')[0].strip()
+            import_format = self.content_types.get(content_type, 'csv')
+        if import_format not in ('csv', 'ndjson'):
+            raise exception.ValidationError(message=utils.format_kwstring(
+                _('import format must be one of csv, ndjson, not %(format)s'), format=import_format))
+        self.request.connection.set_max_body_size(self.max_import_size)
+        self._parser = _RowParser(import_format)
+        self._batch = []
+        self._created = 0
+        self._accepted = 0
+        self._errors = []
+        self._error_count = 0
+        self._failure = None
+        self._started = time.time()
+
+    @gen.coroutine
+    def data_received(self, chunk):
+        if self._failure is not None:
+            return
+        try:
+            yield self._consume(self._parser.feed(chunk))
+        except HTTPError as e:
+            # 在post中输出错误，不再处理剩余的请求体
+            self._failure = e
+
+    @gen.coroutine
+    def post(self, *args, **kwargs):
+        if self._failure is None:
+            yield self._consume(self._parser.close())
+            yield self._flush_batch(**kwargs)
+        if self._failure is not None:
+            raise self._failure
+        self.set_status(status_code=207 if self._error_count else 201)
+        self.write_json('{"count": %d, "error_count": %d, "errors": %s}' % (
+            self._created, self._error_count, serializer.dumps(sorted(self._errors, key=lambda error: error['index']))))
+
+    def _add_error(self, index, message):
+        self._error_count += 1
+        if len(self._errors) < self.max_reported_errors:
+            self._errors.append({'index': index, 'message': message})
+
+    @gen.coroutine
+    def _consume(self, rows):
+        for index, values, error in rows:
+            if error is not None:
+                self._add_error(index, error)
+                continue
+            self._batch.append((index, values))
+            if len(self._batch) >= self.import_batch_size:
+                yield self._flush_batch()
+
+    @gen.coroutine
+    def _flush_batch(self, **kwargs):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        created, errors = yield self.run_blocking(self.import_rows, [values for index, values in batch], **kwargs)
+        self._created += len(created)
+        for error in errors:
+            self._add_error(batch[error['index']][0], error['message'])
+        self._accepted += len(batch)
+        if self.max_row_rate:
+            delay = self._accepted / float(self.max_row_rate) - (time.time() - self._started)
+            if delay > 0:
+                yield gen.sleep(delay)
+
+    def import_rows(self, data, **kwargs):
+        """
+        导入一批资源
+        :param data: 资源列表，CSV导入时值为文本
+        :type data: list
+        :returns: (创建后的资源信息列表, 错误列表)
+        :rtype: tuple
+        """
+        return self.make_resource().create_many(data, text_values=(self._parser.format == 'csv'))
+
+
+class IndexAdviceHandler(BaseHandler):
+    """
+    索引建议控制器，统计数据按worker进程保存：GET输出当前进程的过滤、排序使用统计、慢查询样本以及
+    按估算收益排序的索引建议，explain=1时获取慢查询的EXPLAIN (ANALYZE, BUFFERS)执行计划；DELETE清空统计
+    """
+    allow_methods = ('GET', 'DELETE')
+    blocking_executor = True
+
+    @gen.coroutine
+    def get(self):
+        self._validate_method(self.request, self.allow_methods)
+        explain = utils.bool_from_string(self.get_argument('explain', '0'))
+        try:
+            min_rows = int(self.get_argument('min_rows', advisor.MIN_ROWS))
+        except ValueError:
+            raise exception.ValidationError(message=_('min_rows must be an integer'))
+        report = yield self.run_blocking(advisor.report, pool.POOL.engine, explain=explain, min_rows=min_rows)
+        self.write_json(serializer.dumps(report))
+
+    def delete(self):
+        self._validate_method(self.request, self.allow_methods)
+        telemetry.reset()
+        self.set_status(204)
+
+
+class PoolStatsHandler(BaseHandler):
+    """
+    连接池统计控制器，输出处理本次请求的worker进程的连接池(主库、副本、分片)以及阻塞线程池的统计
+    """
+    allow_methods = ('GET',)
+
+    def get(self):
+        self._validate_method(self.request, self.allow_methods)
+        self.write_json(serializer.dumps({'pid': pool.POOL.pid, 'pools': pool.POOL.pool_stats(),
+                                          'executor': executor.stats()}))
+
+
+class MetricsHandler(BaseHandler):
+    """
+    Prometheus指标控制器，输出整个进程组(所有worker进程)合并后的指标
+    """
+    allow_methods = ('GET',)
+    blocking_executor = True
+
+    @gen.coroutine
+    def get(self):
+        self._validate_method(self.request, self.allow_methods)
+        families = yield self.run_blocking(metrics.collect)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render(families))
+
 
 class ItemHandler(BaseHandler):
     """单项资源控制器"""
     allow_methods = ('GET', 'PATCH', 'DELETE')
+    # 阻塞的资源调用按配置(db.blocking_executor)在有界线程池中执行
+    blocking_executor = None
+    # 是否根据资源表版本输出ETag并处理If-None-Match，数据不只经由ResourceBase修改时应关闭
+    etag_enabled = True
 
+    @gen.coroutine
     def get(self, *args, **kwargs):
         """
         获取资源详情
@@ -96,12 +805,15 @@ class ItemHandler(BaseHandler):
         :rtype: dict
         """
         self._validate_method(self.request, self.allow_methods)
-        ref = self.make_resource().get(self.path_args, **kwargs)
+        if _not_modified(self):
+            return
+        ref = yield self.run_blocking(self.make_resource().get, self.path_args, as_json=True, **kwargs)
         if ref:
-            self.write(json.loads(json.dumps(ref, cls=ComplexEncoder)))
+            self.write_json(ref)
         else:
             self.set_status(404)
 
+    @gen.coroutine
     def patch(self, *args, **kwargs):
         """
         处理PATCH请求
@@ -111,10 +823,10 @@ class ItemHandler(BaseHandler):
         :type resp: Response
         """
         self._validate_method(self.request, self.allow_methods)
-        self._validate_data(self.request, self.request.json)
-        ref_before, ref_after = self.update(self.path_args, self.request.json)
+        self._validate_data(self.request, self.request.body)
+        ref_before, ref_after = yield self.run_blocking(self.update, self.path_args, self.request.json)
         if ref_after:
-            self.write(json.loads(json.dumps(ref_after, cls=ComplexEncoder)))
+            self.write_json(_dumps_record(self.resource, ref_after))
         else:
             self.set_status(404)
 
@@ -133,6 +845,7 @@ class ItemHandler(BaseHandler):
         return self.make_resource().update(rid, data)
 
     # @change_log()
+    @gen.coroutine
     def delete(self, *args, **kwargs):
         """
         删除资源
@@ -142,9 +855,27 @@ class ItemHandler(BaseHandler):
         :rtype: int
         """
         self._validate_method(self.request, self.allow_methods)
-        ref, details = self.make_resource().delete(self.path_args, **kwargs)
+        ref, details = yield self.run_blocking(self.make_resource().delete, self.path_args, **kwargs)
+        if ref:
+            self.write_json('{"count": %d, "detail": [%s]}' % (
+                ref, ','.join(_dumps_record(self.resource, detail) for detail in details)))
+        else:
+            self.set_status(404)
+
+
+class AsyncItemHandler(ItemHandler):
+    """
+    异步单项资源控制器，详情查询在异步连接上执行，写操作仍使用同步连接
+    """
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):
+        self._validate_method(self.request, self.allow_methods)
+        if _not_modified(self):
+            return
+        ref = yield self.make_resource().aget(self.path_args, as_json=True, **kwargs)
         if ref:
-            self.write(json.loads(json.dumps({'count': ref, 'detail': details}, cls=ComplexEncoder)))
+            self.write_json(ref)
         else:
             self.set_status(404)
 
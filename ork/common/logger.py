@@ -11,13 +11,12 @@ from __future__ import absolute_import
 import copy
 import datetime
 import functools
-import json
 import logging
 
 from ..common.message import PRODUCER
 from ..core import config
-from ..core import utils
 from ..core.i18n import _
+from ..db import serializer
 from ..db.resource import SysOperationLog
 
 LOG = logging.getLogger(__name__)
@@ -50,28 +49,40 @@ def change_log():
                     op = func.__name__
                     op_time = datetime.datetime.now()
                     creds = req.x_auth
-                    if op == 'create':
-                        SysOperationLog().create({
-                            'resource': resource.name,
-                            'tenant_uuid': creds['tenant'],
-                            'user_name': creds['user'],
-                            'operation': op,
-                            'operate_time': op_time,
-                            'data_before': json.loads(json.dumps(req.json, cls=utils.ComplexEncoder)),
-                            'data_after': json.loads(json.dumps(record, cls=utils.ComplexEncoder))
-                        }, validate=False)
-                        if resource.name in CONF.message.resource:
-                            routing_key = op + "." + resource.name
-                            body = {
-                                "data_before": json.loads(json.dumps(req.json, cls=utils.ComplexEncoder)),
-                                "data_after": json.loads(json.dumps(record, cls=utils.ComplexEncoder))}
-                            if CONF.message.enabled:
-                                try:
-                                    PRODUCER.send_message(routing_key, body)
-                                except Exception as e:
-                                    LOG.error(e)
-                                    PRODUCER.reconnection()
-                                    PRODUCER.send_message(routing_key, body)
+                    if op in ('create', 'create_or_update', 'upsert_many'):
+                        if op == 'create':
+                            changes = [(op, req.json, record)]
+                        elif op == 'create_or_update':
+                            # upsert按实际执行的操作(create/update)记录，更新时没有修改前的数据
+                            operation, data_after = record
+                            changes = [(operation, req.json if operation == 'create' else None, data_after)]
+                        else:
+                            results, errors = record
+                            changes = [(result['operation'],
+                                        req.json[result['index']] if result['operation'] == 'create' else None,
+                                        result['data']) for result in results]
+                        for operation, data_before, data_after in changes:
+                            SysOperationLog().create({
+                                'resource': resource.name,
+                                'tenant_uuid': creds['tenant'],
+                                'user_name': creds['user'],
+                                'operation': operation,
+                                'operate_time': op_time,
+                                'data_before': serializer.jsonable(data_before),
+                                'data_after': serializer.jsonable(data_after)
+                            }, validate=False)
+                            if resource.name in CONF.message.resource:
+                                routing_key = operation + "." + resource.name
+                                body = {
+                                    "data_before": serializer.jsonable(data_before),
+                                    "data_after": serializer.jsonable(data_after)}
+                                if CONF.message.enabled:
+                                    try:
+                                        PRODUCER.send_message(routing_key, body)
+                                    except Exception as e:
+                                        LOG.error(e)
+                                        PRODUCER.reconnection()
+                                        PRODUCER.send_message(routing_key, body)
                     elif op == 'update':
                         data_before, data_after = record
                         if _diff(resource.name, data_before, data_after):
@@ -81,14 +92,14 @@ def change_log():
                                 'user_name': creds['user'],
                                 'operation': op,
                                 'operate_time': op_time,
-                                'data_before': json.loads(json.dumps(data_before, cls=utils.ComplexEncoder)),
-                                'data_after': json.loads(json.dumps(data_after, cls=utils.ComplexEncoder))
+                                'data_before': serializer.jsonable(data_before),
+                                'data_after': serializer.jsonable(data_after)
                             }, validate=False)
                             if resource.name in CONF.message.resource:
                                 routing_key = op + "." + resource.name
                                 body = {
-                                    "data_before": json.loads(json.dumps(data_before, cls=utils.ComplexEncoder)),
-                                    "data_after": json.loads(json.dumps(data_after, cls=utils.ComplexEncoder))}
+                                    "data_before": serializer.jsonable(data_before),
+                                    "data_after": serializer.jsonable(data_after)}
                                 if CONF.message.enabled:
                                     try:
                                         PRODUCER.send_message(routing_key, body)
@@ -99,7 +110,7 @@ def change_log():
                     elif op == 'delete':
                         count, details = record
                         for x in range(count):
-                            data = json.loads(json.dumps(details[x], cls=utils.ComplexEncoder))
+                            data = serializer.jsonable(details[x])
                             SysOperationLog().create({
                                 'resource': resource.name,
                                 'tenant_uuid': creds['tenant'],
@@ -128,14 +139,14 @@ def change_log():
                             'user_name': creds['user'],
                             'operation': op,
                             'operate_time': op_time,
-                            'data_before': json.loads(json.dumps(req.json, cls=utils.ComplexEncoder)),
-                            'data_after': json.loads(json.dumps(record, cls=utils.ComplexEncoder))
+                            'data_before': serializer.jsonable(req.json),
+                            'data_after': serializer.jsonable(record)
                         }, validate=False)
                         if resource.name in CONF.message.resource:
                             routing_key = op + "." + resource.name
                             body = {
-                                "data_before": json.loads(json.dumps(req.json, cls=utils.ComplexEncoder)),
-                                "data_after": json.loads(json.dumps(record, cls=utils.ComplexEncoder))}
+                                "data_before": serializer.jsonable(req.json),
+                                "data_after": serializer.jsonable(record)}
                             if CONF.message.enabled:
                                 try:
                                     PRODUCER.send_message(routing_key, body)
@@ -146,7 +157,7 @@ def change_log():
                     elif op == 'release':
                         count, details = record
                         data = {'count': count, 'data': details}
-                        data = json.loads(json.dumps(data, cls=utils.ComplexEncoder))
+                        data = serializer.jsonable(data)
                         SysOperationLog().create({
                             'resource': resource.name,
                             'tenant_uuid': creds['tenant'],
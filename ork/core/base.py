@@ -12,13 +12,17 @@ import fnmatch
 import json
 import logging
 import re
+import time
 
+from tornado import gen
 from tornado.web import RequestHandler
 from tornado.websocket import WebSocketHandler
 
 from ..core import exception
+from ..core import executor
 from ..core import utils
 from ..core.i18n import _
+from ..db import pool
 
 LOG = logging.getLogger(__name__)
 
@@ -26,19 +30,103 @@ LOG = logging.getLogger(__name__)
 class BaseHandler(RequestHandler):
     name = ''
     resource = None
+    # 是否在有界线程池中执行阻塞的资源调用，等待数据库期间IOLoop可以处理其他请求，None表示按配置(db.blocking_executor)
+    blocking_executor = False
+    # 客户端写入后固定读取主库的截止时间cookie，用于配置了数据库副本时读到自己的写入
+    read_primary_cookie = 'ork_read_primary'
+    write_methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+    # 本次请求的读取是否固定使用主库，如输出表版本ETag的条件请求
+    primary_reads = False
+    # 本次请求执行的数据库语句耗时，由make_resource创建的资源记录
+    db_queries = None
+    _flushed_size = 0
 
     def prepare(self):
+        self.db_queries = []
         for middleware in self.application.middleware:
             middleware.process_request(self)
 
     def finish(self, chunk=None):
+        if chunk is not None:
+            # 先写入缓冲区，process_response可以获取完整的响应大小
+            self.write(chunk)
+            chunk = None
         for middleware in self.application.middleware:
             middleware.process_response(self)
+        self._pin_primary()
         return super(BaseHandler, self).finish(chunk)
 
+    def flush(self, include_footers=False):
+        self._flushed_size += sum(len(part) for part in self._write_buffer)
+        return super(BaseHandler, self).flush(include_footers)
+
+    def response_size(self):
+        """
+        响应体的大小，包括已经发送的以及缓冲区中的部分
+        :returns: 字节数
+        :rtype: int
+        """
+        return self._flushed_size + sum(len(part) for part in self._write_buffer)
+
+    def _pin_primary(self):
+        """写入成功后设置cookie，read_your_writes秒内该客户端的读取使用主库"""
+        seconds = pool.POOL.read_your_writes
+        if seconds and self.request.method in self.write_methods and self.get_status() < 400 and \
+                not self._headers_written:
+            until = time.time() + seconds
+            self.set_cookie(self.read_primary_cookie, '%.3f' % until, expires=until)
+
+    def read_primary(self):
+        """
+        当前客户端的读取是否需要使用主库
+        :returns: 是否使用主库
+        :rtype: bool
+        """
+        if self.primary_reads:
+            return True
+        seconds = pool.POOL.read_your_writes
+        if not seconds:
+            return False
+        try:
+            until = float(self.get_cookie(self.read_primary_cookie))
+        except (TypeError, ValueError):
+            return False
+        now = time.time()
+        # 截止时间超过read_your_writes的cookie不是由服务端设置的，忽略
+        return now < until <= now + seconds
+
     def data_received(self, chunk):
         pass
 
+    def write_error(self, status_code, **kwargs):
+        if status_code == exception.ServiceUnavailableError.code:
+            self.set_header('Retry-After', str(executor.RETRY_AFTER))
+        super(BaseHandler, self).write_error(status_code, **kwargs)
+
+    @gen.coroutine
+    def run_blocking(self, func, *args, **kwargs):
+        """
+        执行阻塞调用，启用blocking_executor时在线程池中执行，排队过多时抛出ServiceUnavailableError(503)
+        :param func: 阻塞函数，如资源的list/create
+        :type func: callable
+        :returns: 函数的返回值
+        """
+        enabled = executor.ENABLED if self.blocking_executor is None else self.blocking_executor
+        if enabled:
+            result = yield executor.get_executor().submit(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        raise gen.Return(result)
+
+    def write_json(self, text):
+        """
+        输出已经序列化好的JSON文本
+        :param text: JSON文本
+        :type text: str
+        """
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(text)
+
     @staticmethod
     def _validate_method(req, allow_methods):
         if req.method not in allow_methods:
@@ -65,7 +153,8 @@ class BaseHandler(RequestHandler):
         :type req: Request
         :param supported_filters: 支持参数过滤，若设置，则只允许特定字段的过滤
         :type supported_filters: list
-        :returns: {'filters': filters, 'offset': offset, 'limit': limit}
+        :returns: {'filters': filters, 'offset': offset, 'limit': limit, 'orders': orders, 'after': after,
+                   'count': count, 'fields': fields}
         :rtype: dict
         """
 
@@ -80,6 +169,10 @@ class BaseHandler(RequestHandler):
         query_dict = {}
         reg = re.compile('^(.+)\[(\d+)\]$')
         for key, value in req.arguments.items():
+            # tornado的参数值为bytes列表，单值参数还原为字符串，多值参数保留为列表
+            value = [utils.ensure_unicode(v) for v in value]
+            if len(value) == 1:
+                value = value[0]
             matches = reg.match(key)
             if matches:
                 match_key, match_index = matches.groups()
@@ -101,11 +194,15 @@ class BaseHandler(RequestHandler):
                           'istartswith': 'istarts', 'startswith': 'starts',
                           'iendswith': 'iends', 'endswith': 'ends',
                           'in': 'in', 'notin': 'nin', 'notequal': 'ne', 'equal': 'eq',  # value compare
-                          'less': 'lt', 'lessequal': 'lte', 'greater': 'gt', 'greaterequal': 'gte'}
+                          'less': 'lt', 'lessequal': 'lte', 'greater': 'gt', 'greaterequal': 'gte',
+                          'search': 'search'}  # 可搜索列的索引检索
         filters = {}
         offset = None
         limit = None
         orders = None
+        after = None
+        count = None
+        fields = None
 
         if query_dict is None:
             return filters, offset, limit
@@ -119,6 +216,27 @@ class BaseHandler(RequestHandler):
                 orders = [order.strip() for order in orders]
             else:
                 orders = [orders.strip()]
+        if '__after' in query_dict:
+            # 游标分页，空值表示从第一页开始
+            after = query_dict.pop('__after')
+            if utils.is_list_type(after):
+                after = after[-1]
+            after = after.strip()
+        if '__count' in query_dict:
+            # 总数统计方式: exact精确统计(默认)，estimate使用数据库估算值，none不统计
+            count = query_dict.pop('__count')
+            if utils.is_list_type(count):
+                count = count[-1]
+            count = count.strip().lower()
+            if count not in ('exact', 'estimate', 'none'):
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('__count must be one of exact, estimate, none, not %(count)s'), count=count))
+        if '__fields' in query_dict:
+            # 列投影，支持__fields=a,b,c以及多次指定__fields
+            fields = query_dict.pop('__fields')
+            if not utils.is_list_type(fields):
+                fields = [fields]
+            fields = [field.strip() for value in fields for field in value.split(',') if field.strip()] or None
         for key in query_dict:
             # 没有指定支持filters或者是支持的filter，并且key是简单条件
             if supported_filters is None or key in supported_filters:
@@ -145,7 +263,8 @@ class BaseHandler(RequestHandler):
                         filters[base_key][comparator] = query_dict[key]
                     else:
                         filters[base_key] = {comparator: query_dict[key]}
-        return {'filters': filters, 'offset': offset, 'limit': limit, 'orders': orders}
+        return {'filters': filters, 'offset': offset, 'limit': limit, 'orders': orders, 'after': after,
+                'count': count, 'fields': fields}
 
     def make_resource(self):
         """
@@ -153,7 +272,15 @@ class BaseHandler(RequestHandler):
         :param req:
         :return: current resource
         """
-        return self.resource()
+        return self.resource(read_primary=self.read_primary(), route=self.route_name(), queries=self.db_queries)
+
+    def route_name(self):
+        """
+        当前请求的路由名称(请求方法 + 控制器)，用于按路由统计，不包含URL中的参数
+        :returns: 路由名称，如GET CollectionLine
+        :rtype: str
+        """
+        return '%s %s' % (self.request.method, type(self).__name__)
 
 
 class BaseWebSocketHandler(WebSocketHandler):
@@ -166,4 +293,15 @@ class BaseWebSocketHandler(WebSocketHandler):
         pass
 
     def data_received(self, chunk):
-        pass
\ No newline at end of file
+        pass
+
+    def finish(self, chunk=None):
+        # 握手成功(101)或者失败时结束HTTP响应
+        for middleware in self.application.middleware:
+            middleware.process_response(self)
+        return super(BaseWebSocketHandler, self).finish(chunk)
+
+    def on_connection_close(self):
+        super(BaseWebSocketHandler, self).on_connection_close()
+        for middleware in self.application.middleware:
+            middleware.process_close(self)
\ No newline at end of file
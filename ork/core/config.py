@@ -24,6 +24,12 @@ class Config(object):
             config = json.load(f)
         self._opts = config
 
+    def get(self, attr, default=None):
+        try:
+            return getattr(self, attr)
+        except AssertionError:
+            return default
+
     def __getattr__(self, attr):
         try:
             value = self._opts[attr]
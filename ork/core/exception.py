@@ -179,4 +179,17 @@ class ConflictError(Error):
 
     @property
     def message_format(self):
-        return _('detail: %(msg)s')
\ No newline at end of file
+        return _('detail: %(msg)s')
+
+
+class ServiceUnavailableError(Error):
+    """服务繁忙异常"""
+    code = 503
+
+    @property
+    def title(self):
+        return _('Service Unavailable')
+
+    @property
+    def message_format(self):
+        return _('detail: %(msg)s')
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/23 20:10
+# @File    : executor.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    bounded thread pool for blocking work, rejects requests when the queue is full
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from concurrent import futures
+
+from ..core import exception
+from ..core.i18n import _
+
+LOG = logging.getLogger(__name__)
+
+# 线程数，一般与数据库连接池大小(pool_size + max_overflow)一致
+MAX_WORKERS = 8
+# 等待线程的任务数上限，超过时直接拒绝
+MAX_QUEUE = 32
+# 拒绝时建议客户端的重试间隔(秒)
+RETRY_AFTER = 1
+# blocking_executor为None的控制器(集合、单项资源)是否在线程池中执行阻塞调用
+ENABLED = True
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+class BoundedExecutor(object):
+    """
+    有界线程池，排队任务数超过上限时抛出ServiceUnavailableError，避免请求堆积到数据库连接池的pool_timeout
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pid = os.getpid()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交阻塞任务
+        :param func: 任务函数
+        :type func: callable
+        :returns: 任务结果的Future，可以在协程中yield
+        :rtype: Future
+        """
+        with self._lock:
+            rejected = self._queued >= self.max_queue
+            if rejected:
+                self.rejected += 1
+            else:
+                self._queued += 1
+                self.submitted += 1
+        if rejected:
+            LOG.warning('blocking executor queue is full(%d), request rejected', self.max_queue)
+            raise exception.ServiceUnavailableError(msg=_('server is busy, please retry later'))
+        queued_at = time.time()
+
+        def _run():
+            wait_time = time.time() - queued_at
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self.completed += 1
+
+        return self._executor.submit(_run)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.max_workers, 'max_queue': self.max_queue, 'active': self._active,
+                    'queued': self._queued, 'submitted': self.submitted, 'completed': self.completed,
+                    'rejected': self.rejected, 'wait_time_total': self.wait_time_total,
+                    'wait_time_max': self.wait_time_max}
+
+
+def setup(max_workers=None, max_queue=None, retry_after=None, enabled=None):
+    """
+    设置线程池参数，在fork之前调用，线程池在每个worker进程首次使用时创建
+    :param max_workers: 线程数
+    :type max_workers: int
+    :param max_queue: 排队任务数上限
+    :type max_queue: int
+    :param retry_after: 拒绝时的Retry-After(秒)
+    :type retry_after: int
+    :param enabled: 集合、单项资源控制器默认是否使用线程池
+    :type enabled: bool
+    """
+    global MAX_WORKERS, MAX_QUEUE, RETRY_AFTER, ENABLED
+    if max_workers is not None:
+        MAX_WORKERS = max_workers
+    if max_queue is not None:
+        MAX_QUEUE = max_queue
+    if retry_after is not None:
+        RETRY_AFTER = retry_after
+    if enabled is not None:
+        ENABLED = enabled
+
+
+def get_executor():
+    """
+    获取当前进程的线程池，线程不会被fork继承，子进程中重新创建
+    :returns: 线程池
+    :rtype: BoundedExecutor
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None or _EXECUTOR.pid != os.getpid():
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None or _EXECUTOR.pid != os.getpid():
+                _EXECUTOR = BoundedExecutor(MAX_WORKERS, MAX_QUEUE)
+    return _EXECUTOR
+
+
+def stats():
+    """
+    获取当前进程线程池的统计信息
+    :returns: {'active': active, 'queued': queued, 'rejected': rejected, 'wait_time_total': seconds, ...}
+    :rtype: dict
+    """
+    return get_executor().stats()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/28 14:10
+# @File    : metrics.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    in-process metrics (counter/gauge/histogram) merged across forked workers, Prometheus text exposition
+"""
+from __future__ import absolute_import
+
+import bisect
+import errno
+import glob
+import json
+import logging
+import os
+import threading
+
+import six
+from tornado.ioloop import PeriodicCallback
+
+from ..core import exception
+from ..core import executor
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 多进程汇总的目录，每个worker定期把自己的指标写到<PATH>/<pid>.json，抓取时合并；None表示只输出当前进程
+PATH = None
+# worker写入指标文件的间隔(秒)
+INTERVAL = 5
+
+_LOCK = threading.Lock()
+_METRICS = {}
+_COLLECTORS = []
+_WRITER = None
+# 正在线程池中执行的写入
+_PENDING = None
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def dump(self):
+        with self._lock:
+            samples = [[list(labels), value] for labels, value in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'samples': samples}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        """
+        :param labels: 标签值，与labelnames一一对应
+        :type labels: tuple
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """多进程汇总时只合并存活的worker进程的值"""
+    type = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels=(), value=0):
+        # 每个桶只计数落在该桶内的观测值，输出时再累加；最后一个为+Inf桶，之后为sum
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def dump(self):
+        family = super(Histogram, self).dump()
+        family['samples'] = [[labels, list(value)] for labels, value in family['samples']]
+        family['buckets'] = list(self.buckets)
+        return family
+
+
+def _register(metric):
+    with _LOCK:
+        existing = _METRICS.get(metric.name)
+        if existing is not None:
+            return existing
+        _METRICS[metric.name] = metric
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """
+    获取或者创建计数器，同名指标只创建一次
+    :param name: 指标名称
+    :type name: str
+    :param documentation: 说明
+    :type documentation: str
+    :param labelnames: 标签名称
+    :type labelnames: tuple
+    :returns: 计数器
+    :rtype: Counter
+    """
+    return _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def family(metric_type, documentation, labelnames, samples):
+    """
+    构造收集函数返回的指标
+    :param metric_type: counter/gauge
+    :type metric_type: str
+    :param samples: [(标签值tuple, 值), ...]
+    :type samples: list
+    """
+    return {'type': metric_type, 'help': documentation, 'labelnames': list(labelnames),
+            'samples': [[list(labels), value] for labels, value in samples]}
+
+
+def register_collector(collector):
+    """
+    注册收集函数，抓取时调用，返回{指标名称: family(...)}，用于输出连接池、线程池等已有的统计
+    :param collector: 收集函数
+    :type collector: callable
+    """
+    with _LOCK:
+        if collector not in _COLLECTORS:
+            _COLLECTORS.append(collector)
+
+
+def snapshot():
+    """
+    获取当前进程的全部指标
+    :returns: {名称: {'type': type, 'help': help, 'labelnames': [], 'samples': [[labels, value]]}}
+    :rtype: dict
+    """
+    with _LOCK:
+        metrics = list(_METRICS.values())
+        collectors = list(_COLLECTORS)
+    families = dict((metric.name, metric.dump()) for metric in metrics)
+    for collector in collectors:
+        try:
+            families.update(collector())
+        except Exception as e:
+            LOG.exception('metrics collector failed: %s', e)
+    return families
+
+
+def setup(path=None, interval=None):
+    """
+    设置多进程汇总的目录并清空其中上次运行的指标文件，在fork之前调用
+    :param path: 目录，None表示只输出当前进程的指标
+    :type path: str
+    :param interval: worker写入指标文件的间隔(秒)
+    :type interval: float
+    """
+    global PATH, INTERVAL
+    if interval is not None:
+        INTERVAL = interval
+    PATH = path
+    if not path:
+        return
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in glob.glob(os.path.join(path, '*.json')):
+            os.remove(name)
+    except OSError as e:
+        LOG.warning('metrics directory %s is unavailable, only current process is exported: %s', path, e)
+        PATH = None
+
+
+def write():
+    """把当前进程的指标写到<PATH>/<pid>.json，先写临时文件再重命名，读取方不会读到写了一半的文件"""
+    if not PATH:
+        return
+    pid = os.getpid()
+    name = os.path.join(PATH, '%d.json' % pid)
+    temp = '%s.%d.tmp' % (name, threading.current_thread().ident)
+    try:
+        with open(temp, 'w') as f:
+            json.dump({'pid': pid, 'metrics': snapshot()}, f, separators=(',', ':'))
+        os.rename(temp, name)
+    except (IOError, OSError) as e:
+        LOG.warning('failed to write metrics file %s: %s', name, e)
+
+
+def _write_in_background():
+    """
+    定期写入的回调：收集指标以及文件读写在阻塞线程池中执行，不占用IOLoop；
+    上一次写入尚未完成或者线程池已满时跳过本次
+    """
+    global _PENDING
+    if _PENDING is not None and not _PENDING.done():
+        return
+    try:
+        _PENDING = executor.get_executor().submit(write)
+    except exception.ServiceUnavailableError:
+        LOG.debug('blocking executor is busy, metrics file is not written this time')
+
+
+def start():
+    """
+    在当前worker的IOLoop上定期写入指标文件，在fork之后、IOLoop启动之前调用
+    """
+    global _WRITER
+    if not PATH:
+        return
+    write()
+    _WRITER = PeriodicCallback(_write_in_background, INTERVAL * 1000)
+    _WRITER.start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _merge(merged, families, alive):
+    for name, data in families.items():
+        if data['type'] == 'gauge' and not alive:
+            # 已退出的worker的计数器仍然计入，保证合计单调递增；当前值类指标不再计入
+            continue
+        target = merged.get(name)
+        if target is None:
+            target = merged[name] = dict(data, samples={})
+        samples = target['samples']
+        for labels, value in data['samples']:
+            key = tuple(six.text_type(label) for label in labels)
+            if data['type'] == 'histogram':
+                current = samples.get(key)
+                samples[key] = value if current is None else [x + y for x, y in zip(current, value)]
+            else:
+                samples[key] = samples.get(key, 0) + value
+
+
+def collect():
+    """
+    获取整个进程组的指标：当前进程先写入自己的指标文件，再合并目录中所有worker的指标文件
+    :returns: {名称: {'type': type, 'help': help, 'labelnames': [], 'samples': {labels: value}}}
+    :rtype: dict
+    """
+    merged = {}
+    if not PATH:
+        _merge(merged, snapshot(), True)
+        return merged
+    write()
+    for name in sorted(glob.glob(os.path.join(PATH, '*.json'))):
+        try:
+            with open(name) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            LOG.warning('failed to read metrics file %s: %s', name, e)
+            continue
+        _merge(merged, data['metrics'], data['pid'] == os.getpid() or _alive(data['pid']))
+    return merged
+
+
+def _escape(value):
+    return six.text_type(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return six.text_type(value)
+
+
+def render(families):
+    """
+    输出Prometheus文本格式(0.0.4)
+    :param families: collect()的结果
+    :type families: dict
+    :returns: 文本
+    :rtype: str
+    """
+    lines = []
+    for name in sorted(families):
+        data = families[name]
+        names = data['labelnames']
+        lines.append('# HELP %s %s' % (name, data['help'].replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE %s %s' % (name, data['type']))
+        for labels in sorted(data['samples']):
+            value = data['samples'][labels]
+            if data['type'] != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(names, labels), _number(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(data['buckets'] + [float('inf')], value[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (name, _labels(names, labels, ('le', _number(float(bound)))),
+                                                 cumulative))
+            lines.append('%s_sum%s %s' % (name, _labels(names, labels), _number(value[-1])))
+            lines.append('%s_count%s %s' % (name, _labels(names, labels), cumulative))
+    return '\n'.join(lines) + '\n'
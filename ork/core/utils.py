@@ -28,7 +28,8 @@ class ComplexEncoder(json.JSONEncoder):
     def default(self, obj):
         # fix, 不要使用strftime，当超过1900年时会报错
         if isinstance(obj, datetime.datetime):
-            return obj.isoformat(' ').split('.')[0]
+            # 去掉微秒，带时区的值保留UTC偏移
+            return obj.replace(microsecond=0).isoformat(' ')
         if isinstance(obj, datetime.date):
             return obj.isoformat()
         return json.JSONEncoder.default(self, obj)
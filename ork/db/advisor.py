@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/25 16:40
+# @File    : advisor.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    index suggestions from filter/order usage, table statistics and slow statements
+"""
+from __future__ import absolute_import
+
+import logging
+import re
+
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.dialects import postgresql
+
+from ..db import filter_wrapper
+from ..db import models
+from ..db import telemetry
+
+LOG = logging.getLogger(__name__)
+
+# 行数少于该值的表不建议索引，顺序扫描已经足够快
+MIN_ROWS = 1000
+# 等值条件的选择率高于该值时索引收益不大(如布尔列)
+MAX_SELECTIVITY = 0.2
+# 与PostgreSQL规划器一致的默认选择率：等值、范围、模糊匹配
+DEFAULT_EQ_SELECTIVITY = 0.005
+DEFAULT_RANGE_SELECTIVITY = 1.0 / 3
+DEFAULT_MATCH_SELECTIVITY = 0.005
+# 只用于排序的索引按避免扫描、排序一半的表估算
+ORDER_SELECTIVITY = 0.5
+
+EQ_OPS = (None, 'eq', 'in')
+RANGE_OPS = ('lt', 'lte', 'gt', 'gte')
+MATCH_OPS = ('like', 'ilike', 'starts', 'istarts', 'ends', 'iends', 'search')
+NETWORK_TYPES = ('INET', 'CIDR')
+# 报告中慢查询参数值的替代文本
+REDACTED = '***'
+
+_INDEXES_SQL = sqlalchemy.text("""
+SELECT am.amname AS method, pg_get_indexdef(x.indexrelid) AS definition,
+       array(SELECT a.attname FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+             LEFT JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+             ORDER BY k.ord) AS columns
+FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_am am ON am.oid = i.relam
+WHERE x.indrelid = to_regclass(:table) AND x.indpred IS NULL
+""")
+_ROWS_SQL = sqlalchemy.text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)")
+_DISTINCT_SQL = sqlalchemy.text("""
+SELECT attname, n_distinct FROM pg_stats WHERE schemaname = current_schema() AND tablename = :table
+""")
+_NORMALIZE = re.compile(r'::\w+|[\s()"]')
+
+
+def _normalize(definition):
+    return _NORMALIZE.sub('', definition).lower()
+
+
+def _compile(expression, table):
+    # 索引表达式中的列不带表名
+    sql = str(expression.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+    return sql.replace('%s.' % table.name, '')
+
+
+class _TableInfo(object):
+    """
+    表的行数、列的不同值个数以及已有索引
+    """
+
+    def __init__(self, connection, orm_meta):
+        self.orm_meta = orm_meta
+        self.table = orm_meta.__table__
+        self.rows = max(connection.execute(_ROWS_SQL, table=self.table.name).scalar() or 0, 0)
+        self.distinct = dict((row.attname, row.n_distinct)
+                             for row in connection.execute(_DISTINCT_SQL, table=self.table.name))
+        self.indexes = [{'method': row.method, 'columns': list(row.columns),
+                         'definition': _normalize(row.definition)}
+                        for row in connection.execute(_INDEXES_SQL, table=self.table.name)]
+
+    def eq_selectivity(self, name):
+        n_distinct = self.distinct.get(name)
+        if not n_distinct:
+            return DEFAULT_EQ_SELECTIVITY
+        if n_distinct < 0:
+            # 负数表示不同值个数占行数的比例
+            n_distinct = -n_distinct * max(self.rows, 1)
+        return 1.0 / max(n_distinct, 1)
+
+    def covered(self, method, columns, elements):
+        """
+        已有索引是否已经能够支持建议的索引：普通列的btree要求索引的前缀列一致(等值列之间顺序无关)，
+        表达式以及GIN/GiST要求索引定义包含相同的列或表达式
+        """
+        for index in self.indexes:
+            if index['method'] != method:
+                continue
+            if method == 'btree' and elements == columns:
+                prefix = index['columns'][:len(columns)]
+                if len(prefix) == len(columns) and set(prefix[:-1]) == set(columns[:-1]) and \
+                        prefix[-1] == columns[-1]:
+                    return True
+            elif all(_normalize(element) in index['definition'] for element in elements):
+                return True
+        return False
+
+
+class _Candidate(object):
+
+    def __init__(self, info, method, columns, elements, reason):
+        self.info = info
+        self.method = method
+        self.columns = columns
+        self.elements = elements
+        self.reason = reason
+        self.uses = 0
+        self.selectivity = 1.0
+        self.benefit = 0.0
+        self.slow_queries = 0
+
+    def add(self, uses, selectivity):
+        self.uses += uses
+        self.selectivity = min(self.selectivity, selectivity)
+        # 收益按每次查询避免扫描的行数估算
+        self.benefit += uses * self.info.rows * (1 - selectivity)
+
+    def ddl(self):
+        table = self.info.table.name
+        name = 'ix_%s_%s' % (table, '_'.join(re.sub(r'\W+', '_', c).strip('_') for c in self.columns))
+        if self.method != 'btree':
+            name = '%s_%s' % (name, self.method)
+        return 'CREATE INDEX CONCURRENTLY %s ON %s USING %s (%s)' % (
+            name[:63], table, self.method, ', '.join(self.elements))
+
+    def to_dict(self):
+        return {'table': self.info.table.name, 'method': self.method, 'columns': self.columns,
+                'uses': self.uses, 'rows': int(self.info.rows), 'selectivity': self.selectivity,
+                'benefit': self.benefit, 'slow_queries': self.slow_queries, 'reason': self.reason,
+                'ddl': self.ddl()}
+
+
+class _Planner(object):
+    """
+    为一张表生成候选索引
+    """
+
+    def __init__(self, info):
+        self.info = info
+        self.candidates = {}
+
+    def candidate(self, method, columns, elements, reason):
+        key = (method, tuple(columns))
+        if key not in self.candidates:
+            self.candidates[key] = _Candidate(self.info, method, list(columns), list(elements), reason)
+        return self.candidates[key]
+
+    def _column(self, expression):
+        return self.info.table.c.get(expression.split('.')[0])
+
+    def _btree_element(self, expression):
+        column = self._column(expression)
+        if '.' not in expression:
+            return column.name
+        # JSONB路径按文本比较，使用表达式索引
+        return '(%s)' % _compile(filter_wrapper.column_from_expression(self.info.orm_meta, expression).astext,
+                                 self.info.table)
+
+    def add_shape(self, filters, orders, uses):
+        """
+        按一个过滤、排序组合生成候选：等值列(选择率低的在前) + 一个范围列或者排序列组成btree联合索引，
+        模糊匹配使用GIN(pg_trgm或者tsvector)，网络地址使用GiST(inet_ops)
+        """
+        eq_columns = []
+        range_columns = []
+        for expression, op in filters:
+            column = self._column(expression)
+            if column is None:
+                continue
+            visit_name = column.type.__visit_name__
+            if visit_name in NETWORK_TYPES and '.' not in expression:
+                self.candidate('gist', [expression], ['%s inet_ops' % column.name], 'network filter').add(
+                    uses, DEFAULT_MATCH_SELECTIVITY)
+            elif op in MATCH_OPS:
+                if isinstance(column.type, sqlalchemy.String) and '.' not in expression:
+                    self._add_match(expression, op, uses)
+            elif op in EQ_OPS and expression not in eq_columns:
+                eq_columns.append(expression)
+            elif op in RANGE_OPS and expression not in range_columns:
+                range_columns.append(expression)
+        # 选择率过高的等值列(如布尔列)放入索引没有意义
+        eq_columns = sorted([c for c in eq_columns if self.info.eq_selectivity(c) <= MAX_SELECTIVITY],
+                            key=self.info.eq_selectivity)
+        selectivity = 1.0
+        for expression in eq_columns:
+            selectivity *= self.info.eq_selectivity(expression)
+        columns = list(eq_columns)
+        reason = 'filter'
+        tail = [c for c in range_columns if c not in eq_columns][:1]
+        if tail:
+            selectivity *= DEFAULT_RANGE_SELECTIVITY
+        else:
+            # 排序列放在等值列之后，可以直接按索引顺序读取而不需要排序
+            tail = [c for c, _ in orders if c not in eq_columns and self._column(c) is not None][:1]
+            if tail and not columns:
+                selectivity = ORDER_SELECTIVITY
+                reason = 'order'
+        columns.extend(tail)
+        if columns:
+            self.candidate('btree', columns, [self._btree_element(c) for c in columns], reason).add(
+                uses, selectivity)
+
+    def _add_match(self, expression, op, uses):
+        orm_meta = self.info.orm_meta
+        column = self.info.table.c[expression]
+        if op == 'search' and expression in getattr(orm_meta, 'searchable', ()) and \
+                orm_meta.search_method == 'tsvector':
+            element = '(%s)' % _compile(filter_wrapper.search_vector(column), self.info.table)
+            self.candidate('gin', [expression], [element], 'full text search').add(uses, DEFAULT_MATCH_SELECTIVITY)
+        else:
+            # 需要pg_trgm扩展
+            self.candidate('gin', [expression], ['%s gin_trgm_ops' % column.name], 'pattern match').add(
+                uses, DEFAULT_MATCH_SELECTIVITY)
+
+    def add_hint(self, method, expression):
+        """SysRelationship声明的关联字段，按一次等值查询估算"""
+        column = self._column(expression)
+        if column is None or '.' in expression:
+            return
+        element = column.name
+        if method == 'gin' and isinstance(column.type, sqlalchemy.String):
+            element += ' gin_trgm_ops'
+        elif method == 'gist' and column.type.__visit_name__ in NETWORK_TYPES:
+            element += ' inet_ops'
+        self.candidate(method, [expression], [element], 'relationship').add(1, self.info.eq_selectivity(expression))
+
+    def suggestions(self):
+        """
+        去掉已有索引能够支持的候选，btree候选的列是另一个候选的前缀时合并到更长的候选中
+        """
+        candidates = [c for c in self.candidates.values()
+                      if not self.info.covered(c.method, [x.split('.')[0] for x in c.columns], c.elements)]
+        result = []
+        for candidate in candidates:
+            longer = [c for c in candidates if c is not candidate and c.method == candidate.method == 'btree' and
+                      len(c.elements) > len(candidate.elements) and
+                      set(c.elements[:len(candidate.elements)]) == set(candidate.elements)]
+            if longer:
+                longer[0].uses += candidate.uses
+                longer[0].benefit += candidate.benefit
+            else:
+                result.append(candidate)
+        return result
+
+
+def _relationship_hints(connection):
+    """
+    读取SysRelationship声明的关联关系，关联的目标字段需要索引，index为索引类型(默认btree)
+    :returns: [(Model, 字段, 索引类型), ...]
+    :rtype: list
+    """
+    try:
+        rows = connection.execute(sqlalchemy.select([models.SysRelationship.__table__])).fetchall()
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        LOG.warning('failed to read relationship index hints: %s', e)
+        return []
+    hints = []
+    for row in rows:
+        orm_meta = models.get_class_by_tablename(row.dst_resource) or models.get_class_by_name(row.dst_resource)
+        if orm_meta is not None and hasattr(orm_meta, '__table__'):
+            hints.append((orm_meta, row.dst_field, row.index or 'btree'))
+    return hints
+
+
+def _slow_tables(slow_samples):
+    counts = {}
+    for sample in slow_samples:
+        for table in set(re.findall(r'\b(?:FROM|JOIN)\s+"?(\w+)"?', sample['statement'], re.IGNORECASE)):
+            counts[table] = counts.get(table, 0) + 1
+    return counts
+
+
+def _usage_report(usage, shapes_limit=20):
+    report = {}
+    for orm_meta, value in usage.items():
+        report[orm_meta.__tablename__] = {
+            'queries': value['queries'],
+            'filters': [{'column': column, 'op': op, 'count': count}
+                        for (column, op), count in value['filters'].most_common()],
+            'orders': [{'column': column, 'count': count} for column, count in value['orders'].most_common()],
+            'shapes': [{'filters': ['%s__%s' % (column, op) if op else column for column, op in filters],
+                        'orders': ['%s%s' % ('-' if order == '-' else '', column) for column, order in orders],
+                        'count': count}
+                       for (filters, orders), count in value['shapes'].most_common(shapes_limit)]}
+    return report
+
+
+def suggest(connection, usage=None, slow_samples=None, min_rows=MIN_ROWS):
+    """
+    根据过滤、排序的使用统计、表统计信息、已有索引以及慢查询样本建议缺失的索引，按估算收益倒序
+    :param connection: 数据库连接
+    :type connection: Connection
+    :param usage: 使用统计，默认为当前进程的统计
+    :type usage: dict
+    :param slow_samples: 慢查询样本，默认为当前进程的样本
+    :type slow_samples: list
+    :param min_rows: 行数少于该值的表不建议索引
+    :type min_rows: int
+    :returns: [{'table', 'method', 'columns', 'uses', 'rows', 'selectivity', 'benefit', 'slow_queries',
+               'reason', 'ddl'}]
+    :rtype: list
+    """
+    usage = telemetry.usage() if usage is None else usage
+    slow_samples = telemetry.samples() if slow_samples is None else slow_samples
+    planners = {}
+
+    def _planner(orm_meta):
+        if orm_meta not in planners:
+            planners[orm_meta] = _Planner(_TableInfo(connection, orm_meta))
+        return planners[orm_meta]
+
+    for orm_meta, value in usage.items():
+        planner = _planner(orm_meta)
+        for (filters, orders), count in value['shapes'].items():
+            planner.add_shape(filters, orders, count)
+    for orm_meta, field, method in _relationship_hints(connection):
+        _planner(orm_meta).add_hint(method, field)
+    slow_tables = _slow_tables(slow_samples)
+    result = []
+    for planner in planners.values():
+        if planner.info.rows < min_rows:
+            continue
+        for candidate in planner.suggestions():
+            # 慢查询涉及的表收益加权
+            candidate.slow_queries = slow_tables.get(planner.info.table.name, 0)
+            candidate.benefit *= 1 + candidate.slow_queries
+            result.append(candidate.to_dict())
+    result.sort(key=lambda x: x['benefit'], reverse=True)
+    return result
+
+
+def report(engine, explain=False, min_rows=MIN_ROWS):
+    """
+    生成索引建议报告：使用统计、慢查询样本(可选EXPLAIN (ANALYZE, BUFFERS)执行计划)以及索引建议，
+    慢查询样本的参数值可能包含业务数据，只输出参数名
+    :param engine: 数据库engine
+    :type engine: Engine
+    :param explain: 是否获取慢查询的执行计划，执行计划需要重新执行慢查询
+    :type explain: bool
+    :param min_rows: 行数少于该值的表不建议索引
+    :type min_rows: int
+    :returns: {'usage': usage, 'slow_queries': samples, 'suggestions': suggestions}
+    :rtype: dict
+    """
+    usage = telemetry.usage()
+    slow_samples = telemetry.samples()
+    if explain:
+        for sample in slow_samples:
+            try:
+                sample['plan'] = telemetry.explain(engine, sample)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                sample['plan'] = None
+                sample['error'] = str(e.orig if isinstance(e, sqlalchemy.exc.DBAPIError) else e).strip()
+    for sample in slow_samples:
+        sample['parameters'] = dict.fromkeys(sample.get('parameters') or {}, REDACTED)
+    connection = engine.connect()
+    try:
+        suggestions = suggest(connection, usage, slow_samples, min_rows)
+    finally:
+        connection.close()
+    return {'usage': _usage_report(usage), 'slow_queries': slow_samples, 'suggestions': suggestions}
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/22 21:15
+# @File    : aio.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    asynchronous psycopg2 connections polled on the tornado IOLoop
+"""
+from __future__ import absolute_import
+
+import collections
+import logging
+import os
+import time
+
+import psycopg2
+import psycopg2.extensions
+import six
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from ..core import exception
+from ..core.i18n import _
+from ..db import pool
+from ..db import prepared
+from ..db import telemetry
+
+LOG = logging.getLogger(__name__)
+
+
+@gen.coroutine
+def wait(connection):
+    """
+    等待异步连接上的操作完成，等待期间IOLoop可以处理其他请求
+    :param connection: psycopg2异步连接
+    :type connection: connection
+    """
+    io_loop = IOLoop.current()
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            events = IOLoop.READ
+        elif state == psycopg2.extensions.POLL_WRITE:
+            events = IOLoop.WRITE
+        else:
+            raise psycopg2.OperationalError('poll() returned %s' % state)
+        future = Future()
+
+        def _ready(fd, ready_events, future=future):
+            io_loop.remove_handler(fd)
+            future.set_result(None)
+
+        io_loop.add_handler(connection.fileno(), _ready, events)
+        yield future
+
+
+class Row(tuple):
+    """
+    查询结果行，支持下标、列名下标以及属性访问，与SQLAlchemy的行对象用法一致
+    """
+    __slots__ = ()
+    _keys = {}
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._keys[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        if isinstance(key, six.string_types):
+            return tuple.__getitem__(self, self._keys[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return sorted(self._keys, key=self._keys.get)
+
+
+def _row_class(description):
+    keys = dict((column[0], idx) for idx, column in enumerate(description))
+    return type('Row', (Row,), {'__slots__': (), '_keys': keys})
+
+
+class AsyncPool(object):
+    """
+    异步连接池，每个worker进程的每个engine一个，连接数不超过上限，超过时等待其他请求归还连接
+    """
+
+    def __init__(self, engine, size):
+        self.engine = engine
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = []
+        self._waiters = collections.deque()
+        self._opened = 0
+
+    @gen.coroutine
+    def _connect(self):
+        args, kwargs = self.engine.dialect.create_connect_args(self.engine.url)
+        kwargs['async_'] = True
+        connection = self.engine.dialect.dbapi.connect(*args, **kwargs)
+        yield wait(connection)
+        raise gen.Return(connection)
+
+    @gen.coroutine
+    def acquire(self):
+        """
+        获取连接
+        :returns: psycopg2异步连接
+        :rtype: connection
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.closed:
+                raise gen.Return(connection)
+            self._opened -= 1
+        if self._opened < self.size:
+            self._opened += 1
+            try:
+                connection = yield self._connect()
+            except Exception:
+                self._opened -= 1
+                raise
+            raise gen.Return(connection)
+        future = Future()
+        self._waiters.append(future)
+        connection = yield future
+        if connection is None:
+            # 归还的连接已失效，由等待者重新建立
+            connection = yield self.acquire()
+        raise gen.Return(connection)
+
+    def release(self, connection):
+        """
+        归还连接，已关闭的连接直接丢弃
+        :param connection: psycopg2异步连接
+        :type connection: connection
+        """
+        if connection.closed:
+            self._opened -= 1
+            if self._waiters:
+                self._waiters.popleft().set_result(None)
+        elif self._waiters:
+            self._waiters.popleft().set_result(connection)
+        else:
+            self._idle.append(connection)
+
+    def reserved(self):
+        """
+        尚未建立但随时可能建立的连接数，自适应调整同步连接池时从数据库剩余连接数中扣除
+        """
+        return max(self.size - self._opened, 0)
+
+    def dispose(self):
+        """
+        关闭空闲连接，之后按需重新建立
+        """
+        while self._idle:
+            self._idle.pop().close()
+            self._opened -= 1
+
+    def stats(self):
+        return {'size': self.size, 'opened': self._opened, 'idle': len(self._idle), 'waiting': len(self._waiters)}
+
+
+def get_pool(engine=None):
+    """
+    获取当前进程engine对应的异步连接池，在fork后的子进程中首次使用时创建，连接数为配置的aio_pool_size；
+    异步连接池记录在engine连接池的统计(PoolStats)上，统计以及自适应调整时计入
+    :param engine: 数据库engine，默认为主库
+    :type engine: Engine
+    :returns: 异步连接池
+    :rtype: AsyncPool
+    """
+    engine = engine or pool.POOL.engine
+    stats = engine.pool.stats
+    async_pool = stats.async_pool
+    if async_pool is None or async_pool.pid != os.getpid():
+        async_pool = AsyncPool(engine, pool.POOL.aio_pool_size)
+        stats.async_pool = async_pool
+    return async_pool
+
+
+@gen.coroutine
+def fetchall(statement, queries=None, engine=None):
+    """
+    使用异步连接执行Core语句并获取全部结果
+    :param statement: Core语句
+    :type statement: Select
+    :param queries: 记录语句耗时的列表，用于统计每个请求的数据库查询
+    :type queries: list
+    :param engine: 数据库engine，默认为主库，读取时可以使用DBPool.read_engine选择的副本
+    :type engine: Engine
+    :returns: 结果行列表
+    :rtype: list
+    :raises: DBError
+    """
+    async_pool = get_pool(engine)
+    sql, params = prepared.compile_statement(statement, async_pool.engine.dialect)
+    try:
+        connection = yield async_pool.acquire()
+    except psycopg2.Error as e:
+        LOG.exception(e)
+        raise exception.DBError(msg=_('unknown db error'))
+    try:
+        cursor = connection.cursor()
+        started = time.time()
+        cursor.execute(sql, params)
+        yield wait(connection)
+        duration = time.time() - started
+        telemetry.record_statement(sql, params, duration)
+        if queries is not None:
+            queries.append(duration)
+        row_class = _row_class(cursor.description)
+        rows = [row_class(row) for row in cursor.fetchall()]
+        cursor.close()
+    except psycopg2.Error as e:
+        LOG.exception(e)
+        raise exception.DBError(msg=_('unknown db error'))
+    finally:
+        async_pool.release(connection)
+    raise gen.Return(rows)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/20 20:40
+# @File    : cache.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    primary key read cache, invalidated across workers by LISTEN/NOTIFY, the same notifications bump the table
+    versions used for ETag
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import logging
+import threading
+import time
+
+import six
+from tornado.ioloop import IOLoop
+
+from ..core import utils
+from ..db import versioning
+
+LOG = logging.getLogger(__name__)
+
+CHANNEL = 'ork_cache'
+# 监听连接断开后的重连间隔(秒)
+RECONNECT_INTERVAL = 5
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+_LISTENER = None
+
+
+def make_key(rid):
+    """
+    将主键值规范化为缓存key
+    :param rid: 主键值，单个值或者联合主键的值列表
+    :type rid: str/list
+    :returns: 缓存key
+    :rtype: tuple
+    """
+    if utils.is_list_type(rid):
+        return tuple(utils.ensure_unicode(v) if utils.is_string_type(v) else six.text_type(v) for v in rid)
+    return make_key([rid])
+
+
+class LRUCache(object):
+    """
+    带过期时间的LRU缓存，每个key可以保存多个变体(如字典以及JSON文本)，失效时一起删除
+    """
+
+    def __init__(self, name, size, ttl):
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效都会增加，用于丢弃查询期间发生失效的写入
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def token(self):
+        """
+        在查询数据库前获取，set时传入，期间有失效发生时放弃写入缓存
+        """
+        return self._generation
+
+    def get(self, key, variant=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expire_at, values = entry
+                if expire_at < time.time():
+                    del self._data[key]
+                    self.expirations += 1
+                elif variant in values:
+                    del self._data[key]
+                    self._data[key] = entry
+                    self.hits += 1
+                    return values[variant]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, variant=None, token=None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                entry = (time.time() + self.ttl, {})
+            entry[1][variant] = value
+            self._data[key] = entry
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        删除key对应的缓存，key为None时清空
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'capacity': self.size, 'ttl': self.ttl, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations,
+                    'invalidations': self.invalidations}
+
+
+def get_cache(name, size, ttl):
+    """
+    获取名称对应的缓存，不存在则创建
+    :param name: 缓存名称，一般为表名
+    :type name: str
+    :param size: 最大缓存数量
+    :type size: int
+    :param ttl: 过期时间(秒)
+    :type ttl: int
+    :returns: 缓存
+    :rtype: LRUCache
+    """
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                cache = LRUCache(name, size, ttl)
+                _CACHES[name] = cache
+    return cache
+
+
+def invalidate(name, key=None):
+    """
+    使本进程内的缓存失效
+    :param name: 缓存名称
+    :type name: str
+    :param key: 缓存key，None表示整个缓存
+    :type key: tuple
+    """
+    cache = _CACHES.get(name)
+    if cache is not None:
+        cache.invalidate(key)
+
+
+def invalidate_all():
+    for cache in list(_CACHES.values()):
+        cache.invalidate()
+
+
+def enabled():
+    """
+    缓存以及ETag是否可用：启动了跨进程监听时，只有监听连接正常才可用，否则可能错过其他进程、其他主机的变更通知
+    """
+    return _LISTENER is None or _LISTENER.listening
+
+
+def stats():
+    """
+    获取所有缓存的统计信息
+    :returns: {name: {'size': size, 'hits': hits, 'misses': misses, 'evictions': evictions, ...}}
+    :rtype: dict
+    """
+    return dict((name, cache.stats()) for name, cache in list(_CACHES.items()))
+
+
+def notify_payload(name, key=None, invalidate=True):
+    """
+    生成变更通知的内容，通知需要在写入数据的事务内发送，事务提交时才会投递；
+    收到通知的worker增加表的版本号，invalidate为True时同时使主键读缓存失效
+    """
+    return json.dumps([name, list(key) if key is not None else None, bool(invalidate)])
+
+
+def _handle_payload(payload):
+    try:
+        message = json.loads(payload)
+        name, key = message[0], message[1]
+        # 兼容不带失效标记的通知
+        should_invalidate = message[2] if len(message) > 2 else True
+    except (ValueError, TypeError, IndexError, KeyError):
+        LOG.warning('invalid cache notification: %s', payload)
+        return
+    versioning.bump_table(name)
+    if should_invalidate:
+        invalidate(name, tuple(key) if key is not None else None)
+
+
+class Listener(object):
+    """
+    在IOLoop上监听变更通知的专用连接，每个worker进程一个，需要在fork之后启动
+    """
+
+    def __init__(self, engine, io_loop=None):
+        self.engine = engine
+        self.io_loop = io_loop or IOLoop.current()
+        self.connection = None
+        self.listening = False
+
+    def start(self):
+        try:
+            args, kwargs = self.engine.dialect.create_connect_args(self.engine.url)
+            self.connection = self.engine.dialect.dbapi.connect(*args, **kwargs)
+            self.connection.autocommit = True
+            cursor = self.connection.cursor()
+            cursor.execute('LISTEN %s' % CHANNEL)
+            cursor.close()
+        except Exception as e:
+            LOG.warning('failed to listen cache notifications: %s', e)
+            self._reconnect()
+            return
+        self.io_loop.add_handler(self.connection.fileno(), self._on_readable, IOLoop.READ)
+        # 监听建立之前的变更通知可能已经错过
+        invalidate_all()
+        versioning.bump_all()
+        self.listening = True
+
+    def _on_readable(self, fd, events):
+        try:
+            self.connection.poll()
+        except Exception as e:
+            LOG.warning('cache notification connection lost: %s', e)
+            self.io_loop.remove_handler(fd)
+            self._reconnect()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            _handle_payload(notify.payload)
+
+    def _reconnect(self):
+        self.listening = False
+        invalidate_all()
+        versioning.bump_all()
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+        self.io_loop.call_later(RECONNECT_INTERVAL, self.start)
+
+    def stop(self):
+        if self.connection is not None:
+            self.io_loop.remove_handler(self.connection.fileno())
+            self.connection.close()
+            self.connection = None
+        self.listening = False
+
+
+def start_listener(engine, io_loop=None):
+    """
+    启动当前进程的失效通知监听，在fork之后、IOLoop启动之前调用
+    :param engine: 数据库engine
+    :type engine: Engine
+    """
+    global _LISTENER
+    _LISTENER = Listener(engine, io_loop=io_loop)
+    _LISTENER.start()
+    return _LISTENER
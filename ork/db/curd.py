@@ -6,40 +6,285 @@
 # Do have a faith in what you're doing.
 # Make your life a story worth telling.
 
+import base64
+import collections
 import copy
 import datetime
+import decimal
+import heapq
+import itertools
+import json
 import logging
+import threading
 from contextlib import contextmanager
 
+import six
+import sqlalchemy
 import sqlalchemy.exc
+from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql
+from tornado import gen
+from tornado.web import HTTPError
 
 from ..core import config
 from ..core import exception
+from ..core import executor
 from ..core import utils
 from ..core.i18n import _
+from ..db import aio
+from ..db import cache
 from ..db import filter_wrapper
 from ..db import pool
+from ..db import prepared
+from ..db import serializer
+from ..db import telemetry
+from ..db import versioning
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
 
+class ResultSet(list):
+    """
+    列表查询结果，在资源列表的基础上携带分页信息
+    """
+
+    def __init__(self, iterable=(), next_cursor=None, total=None):
+        super(ResultSet, self).__init__(iterable)
+        self.next_cursor = next_cursor
+        self.total = total
+
+
+class _SortKey(object):
+    """
+    跨分片归并的排序键，按排序方向逐列比较，None与PostgreSQL默认一致视为最大值(升序在后，降序在前)
+    """
+    __slots__ = ('values', 'directions')
+
+    def __init__(self, values, directions):
+        self.values = values
+        self.directions = directions
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __ne__(self, other):
+        return self.values != other.values
+
+    def __lt__(self, other):
+        for value, other_value, desc in zip(self.values, other.values, self.directions):
+            if value == other_value:
+                continue
+            if value is None or other_value is None:
+                less = other_value is None
+            else:
+                less = value < other_value
+            return not less if desc else less
+        return False
+
+
+# 按数据库列类型选择的过滤器，过滤器为单例
+_FILTER_HANDLERS = {
+    'INET': filter_wrapper.FilterNetwork(),
+    'CIDR': filter_wrapper.FilterNetwork(),
+    'small_integer': filter_wrapper.FilterNumber(),
+    'integer': filter_wrapper.FilterNumber(),
+    'big_integer': filter_wrapper.FilterNumber(),
+    'numeric': filter_wrapper.FilterNumber(),
+    'float': filter_wrapper.FilterNumber(),
+    'date': filter_wrapper.FilterDateTime(),
+    'datetime': filter_wrapper.FilterDateTime(),
+}
+_PLAN_CACHE_SIZE = 4096
+
+
+class _PlanCache(object):
+    """
+    有上限的LRU缓存，键来自请求参数(过滤、排序的列表达式)，
+    已满时淘汰最久未使用的项，常用的列不会因为任意参数把缓存占满而不再缓存
+    """
+
+    def __init__(self):
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > _PLAN_CACHE_SIZE:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_COLUMN_CACHE = _PlanCache()
+_FILTER_PLAN_CACHE = _PlanCache()
+_WRITE_STATEMENTS = {}
+# 列表查询按search过滤的相关度排序时，相关度在行对象以及游标排序键中的名称
+_RANK_KEY = '__rank'
+
+
+_AFTER_COMMIT_KEY = 'ork.after_commit'
+
+
+def _run_after_commit(session):
+    # 保存点的提交也会触发after_commit，只在最外层事务提交时执行
+    if session.transaction is not None and session.transaction.nested:
+        return
+    for callback in session.info.pop(_AFTER_COMMIT_KEY, None) or []:
+        callback()
+
+
+def _discard_after_commit(session, transaction):
+    # 最外层事务结束时提交回调已经执行，剩余的回调属于回滚的事务
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT_KEY, None)
+
+
+def _after_commit(session, callback):
+    """
+    在session最外层事务提交后执行callback，事务回滚时丢弃；监听器每个session只注册一次
+    :param session: 会话
+    :type session: Session
+    :param callback: 回调函数
+    :type callback: callable
+    """
+    if _AFTER_COMMIT_KEY + '.listening' not in session.info:
+        session.info[_AFTER_COMMIT_KEY + '.listening'] = True
+        sqlalchemy.event.listen(session, 'after_commit', _run_after_commit)
+        sqlalchemy.event.listen(session, 'after_transaction_end', _discard_after_commit)
+    session.info.setdefault(_AFTER_COMMIT_KEY, []).append(callback)
+
+
+class CoreQuery(object):
+    """
+    对Core select的包装，提供与ORM Query一致的filter/order_by等接口，
+    使过滤、排序DSL可以原样编译为Core语句，结果为行对象而不创建ORM对象
+    """
+
+    def __init__(self, session, statement, prepared=False):
+        self.session = session
+        self.statement = statement
+        self.prepared = prepared
+
+    def _clone(self, statement):
+        return CoreQuery(self.session, statement, prepared=self.prepared)
+
+    def _fetchall(self, statement):
+        if not self.prepared:
+            return self.session.execute(statement).fetchall()
+        connection = self.session.connection()
+        try:
+            return prepared.execute(connection, statement)
+        finally:
+            # 非事务的session每次获取的连接需要自行释放
+            if not self.session.is_active:
+                connection.close()
+
+    def filter(self, *criterion):
+        return self._clone(self.statement.where(sqlalchemy.and_(*criterion)))
+
+    def order_by(self, *clauses):
+        return self._clone(self.statement.order_by(*clauses))
+
+    def offset(self, offset):
+        return self._clone(self.statement.offset(offset))
+
+    def limit(self, limit):
+        return self._clone(self.statement.limit(limit))
+
+    def add_columns(self, *columns):
+        statement = self.statement
+        for column in columns:
+            statement = statement.column(column)
+        return self._clone(statement)
+
+    def all(self):
+        return self._fetchall(self.statement)
+
+    def one_or_none(self):
+        rows = self._fetchall(self.statement.limit(2))
+        if len(rows) > 1:
+            raise orm.exc.MultipleResultsFound('Multiple rows were found for one_or_none()')
+        return rows[0] if rows else None
+
+    def yield_per(self, count):
+        result = self.session.execute(self.statement.execution_options(stream_results=True))
+        try:
+            while True:
+                rows = result.fetchmany(count)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
+
+    def count_statement(self):
+        return sqlalchemy.select([sqlalchemy.func.count()]).select_from(self.statement.alias())
+
+    def count(self):
+        return self._fetchall(self.count_statement())[0][0]
+
+
 class ResourceBase(object):
     """
     资源操作基础类
     """
     orm_meta = None
 
+    # 读取引擎：orm使用ORM Query并创建Model对象；core使用Core select直接返回行，
+    # 属性中包含relationship等非列属性时自动回退到orm
+    _read_engine = 'orm'
+    # 是否使用服务端预编译语句，仅对core读取引擎生效，相同形态的查询在同一连接上只解析、生成执行计划一次
+    _prepared_statements = False
+    # 主键读缓存，大于0时启用，缓存get的结果；update/delete时本进程直接失效，其他worker经由LISTEN/NOTIFY失效，
+    # 关联表的变更只能等待过期
+    _cache_size = 0
+    _cache_ttl = 60
+    # 批量创建时每条INSERT语句的最大行数
+    _bulk_chunk_size = 1000
+    # 写入引擎：orm先查询再修改ORM对象；returning使用单条INSERT/UPDATE/DELETE ... RETURNING完成，
+    # update/软删除通过加锁的CTE获取修改前的数据，返回值与orm一致
+    _write_engine = 'orm'
+
     _primary_keys = 'id'
+    # upsert时判断资源是否已存在的列，需要有对应的唯一约束或唯一索引，None表示使用主键
+    _unique_keys = None
+    # 分片键，配置了分片(db.shards)时按分片键的值路由到分片数据库，过滤条件不包含分片键时在所有分片上执行
+    _shard_key = None
 
     _default_filter = {}
 
     _default_order = []
 
-    def __init__(self, session=None, transaction=None):
+    def __init__(self, session=None, transaction=None, read_primary=False, shard=None, route=None, queries=None):
         self._pool = None
         self._session = session
         self._transaction = transaction
+        # 读取是否固定使用主库，如客户端刚刚写入，需要读到自己的写入
+        self._read_primary = read_primary
+        # 绑定的分片序号，None表示按分片键路由
+        self._shard = shard
+        # 请求路由，用于按路由统计数据库连接的占用时间
+        self._route = route
+        # 记录语句耗时的列表，用于统计每个请求的数据库查询次数以及耗时
+        self._queries = queries
         if session is None and transaction is None:
             self._pool = pool.POOL
 
@@ -72,20 +317,32 @@ class ResourceBase(object):
         return copy.copy(self._primary_keys)
 
     @contextmanager
-    def get_session(self):
+    def get_session(self, readonly=False):
         """
         会话管理上下文， 如果资源初始化时指定使用外部会话，则返回的也是外部会话对象
+        :param readonly: 是否只读，只读会话使用数据库副本(配置了副本且未固定使用主库时)
+        :type readonly: bool
         """
         session = None
         if self._session is None and self._transaction is None:
             try:
                 old_session = self._session
-                session = self._pool.get_session()
+                if readonly and not self._read_primary:
+                    session = self._pool.get_read_session(shard=self._shard)
+                else:
+                    session = self._pool.get_session(shard=self._shard)
+                # scoped_session按线程区分会话，生成器(如iter_list)可能在其他线程中继续以及结束，记录创建时的会话
+                current = session()
+                if self._route is not None:
+                    session.info['route'] = self._route
+                if self._queries is not None:
+                    session.info['queries'] = self._queries
                 self._session = session
                 yield session
             finally:
                 self._session = old_session
                 if session:
+                    current.close()
                     session.remove()
         elif self._session:
             yield self._session
@@ -107,7 +364,11 @@ class ResourceBase(object):
         if self._transaction is None:
             try:
                 old_transaction = self._transaction
-                session = self._pool.transaction()
+                session = self._pool.transaction(shard=self._shard)
+                if self._route is not None:
+                    session.info['route'] = self._route
+                if self._queries is not None:
+                    session.info['queries'] = self._queries
                 # 设置默认的数据库会话，所有函数都使用此会话
                 self._transaction = session
                 yield session
@@ -125,54 +386,289 @@ class ResourceBase(object):
         else:
             yield self._transaction
 
+    def _mark_changed(self, session, rid=None, many=False):
+        """
+        标记资源数据已变更，在数据提交后增加表版本号(用于ETag)以及使主键读缓存失效，并经由LISTEN/NOTIFY
+        通知其他worker以及其他主机；处于事务中时在最外层事务提交后执行，回滚时丢弃，非事务session的flush即已提交
+        :param session: 当前使用的session
+        :type session: session
+        :param rid: 变更的资源主键，None表示不涉及已缓存的资源
+        :type rid: str/list
+        :param many: 是否为批量变更，批量变更时整个主键读缓存失效
+        :type many: bool
+        """
+        if isinstance(session, orm.scoped_session):
+            session = session()
+        name = self.orm_meta.__tablename__
+        invalidate = bool(self._cache_size and (rid is not None or many))
+        key = cache.make_key(rid) if invalidate and not many else None
+        notify = sqlalchemy.select([sqlalchemy.func.pg_notify(cache.CHANNEL,
+                                                              cache.notify_payload(name, key, invalidate))])
+        # 监听连接在主库上，分片上的写入提交后经由主库通知
+        on_primary = self._pool is not None and self._shard is not None
+        if not on_primary:
+            # 通知在事务提交时才会投递给其他worker，回滚则不会投递
+            session.execute(notify.execution_options(autocommit=True))
+
+        def _committed():
+            versioning.bump(self.orm_meta)
+            if invalidate:
+                cache.invalidate(name, key)
+            if on_primary:
+                try:
+                    self._pool.engine.execute(notify.execution_options(autocommit=True))
+                except sqlalchemy.exc.DBAPIError as e:
+                    LOG.warning('failed to notify change of %s: %s', name, e)
+
+        if session.transaction is None:
+            _committed()
+        else:
+            _after_commit(session, _committed)
+
+    def _get_cache(self):
+        """
+        获取主键读缓存，未启用、使用外部会话/事务或者跨进程失效通知不可用时返回None
+        """
+        if not self._cache_size or self._session is not None or self._transaction is not None:
+            return None
+        if self._shard_key is not None and self._pool is not None and self._pool.router is not None:
+            # 失效通知经由主库的LISTEN/NOTIFY，分片上的写入无法通知其他worker
+            return None
+        if not cache.enabled():
+            return None
+        return cache.get_cache(self.orm_meta.__tablename__, self._cache_size, self._cache_ttl)
+
+    def _sharded(self):
+        """
+        是否需要按分片键路由：声明了分片键、配置了分片，并且没有绑定分片、没有使用外部会话/事务
+        """
+        return (self._shard_key is not None and self._shard is None and self._session is None and
+                self._transaction is None and self._pool is not None and self._pool.router is not None)
+
+    def _on_shard(self, shard):
+        """获取绑定到指定分片的资源对象"""
+        resource = copy.copy(self)
+        resource._shard = shard
+        return resource
+
+    def _filter_shards(self, filters):
+        """
+        根据过滤条件中分片键的等值、in条件确定涉及的分片，无法确定时为全部分片，
+        in条件的字符串值与过滤器一样按逗号分隔为多个值
+        :returns: 分片序号列表
+        :rtype: list
+        """
+        router = self._pool.router
+        value = (filters or {}).get(self._shard_key)
+        if isinstance(value, dict):
+            value = value['eq'] if 'eq' in value else filter_wrapper.split_values(value.get('in'))
+        if value is None:
+            return list(range(router.size))
+        values = value if utils.is_list_type(value) else [value]
+        return sorted(set(router.shard_for(v) for v in values))
+
+    def _data_shard(self, resource):
+        """
+        根据资源数据中分片键的值确定分片，缺少分片键时抛出ValidationError
+        """
+        value = resource.get(self._shard_key) if isinstance(resource, dict) else None
+        if value is None or value == '':
+            raise exception.ValidationError(message=utils.format_kwstring(
+                _('shard key %(key)s is required'), key=self._shard_key))
+        return self._pool.router.shard_for(value)
+
+    def _locate(self, rid):
+        """
+        并行地在所有分片上按主键查找资源所在的分片
+        :returns: 分片序号，不存在时为None
+        :rtype: int
+        """
+        router = self._pool.router
+
+        def _exists(shard):
+            resource = self._on_shard(shard)
+            with resource.get_session() as session:
+                query = resource._get_select(session, resource._primary_key_names(), orders=[])
+                return bool(resource._apply_primary_key_filter(query, rid).limit(1).all())
+
+        shards = list(range(router.size))
+        for shard, exists in zip(shards, router.map(_exists, shards)):
+            if exists:
+                return shard
+        return None
+
+    def _sharded_list(self, shards, filters=None, orders=None, offset=None, limit=None, after=None, count=None,
+                      fields=None, as_json=False):
+        """
+        跨分片列表：每个分片按排序键(排序规则 + 主键)查询前offset + limit行并在分片线程中格式化，
+        再按排序键归并后截取，游标分页时每个分片使用同一个游标定位
+        """
+        with_total = count == 'exact' and not after
+        start = (offset or 0) if after is None else 0
+        shard_limit = None if limit is None else start + limit
+
+        def _fetch(shard):
+            resource = self._on_shard(shard)
+            with resource.get_session(readonly=True) as session:
+                # after为空字符串时是游标分页的第一页：按排序键排序并查询排序键的值
+                query, keys, projection = resource._list_query(
+                    session, filters=filters, orders=orders, limit=shard_limit,
+                    after='' if after is None else after, fields=fields)
+                if with_total:
+                    query = query.add_columns(sqlalchemy.func.count().over().label('__total'))
+                rows = query.all()
+                total = rows[0][-1] if with_total and rows else 0
+                records = [row[0] for row in rows] if (with_total or resource._ranked(keys)) and not projection \
+                    else rows
+                # 按search相关度排序时相关度是第一个排序键，各分片的相关度可以直接比较
+                directions = [desc for field, desc in keys]
+                sort_keys = [_SortKey(self._sort_values(row, record, keys), directions)
+                             for row, record in zip(rows, records)]
+                return sort_keys, resource._format_records(records, fields=projection, as_json=as_json), total
+
+        results = self._pool.router.map(_fetch, shards)
+        merged = heapq.merge(*[[(sort_key, shard, record) for sort_key, record in zip(sort_keys, records)]
+                               for shard, (sort_keys, records, total) in zip(shards, results)])
+        page = list(itertools.islice(merged, start, None if limit is None else start + limit))
+        output = ResultSet(record for sort_key, shard, record in page)
+        if with_total:
+            output.total = sum(total for sort_keys, records, total in results)
+        if after is not None and limit and len(page) == limit:
+            output.next_cursor = self._encode_cursor(page[-1][0].values)
+        return output
+
+    def _sharded_write_many(self, method, resources, chunk_size=None, **kwargs):
+        """
+        按分片键将批量写入的资源分组，并行地在各分片上执行(每个分片一个事务，分片之间不保证原子性)，
+        结果以及错误的位置还原为输入中的位置
+        :returns: ({输入位置: 结果}, 错误列表)
+        :rtype: tuple
+        """
+        errors = []
+        groups = {}
+        for index, resource in enumerate(resources):
+            try:
+                shard = self._data_shard(resource)
+            except HTTPError as e:
+                errors.append({'index': index, 'message': self._error_message(e)})
+                continue
+            groups.setdefault(shard, []).append(index)
+        shards = sorted(groups)
+
+        def _write(shard):
+            return getattr(self._on_shard(shard), method)([resources[index] for index in groups[shard]],
+                                                          chunk_size, **kwargs)
+
+        results = {}
+        for shard, (shard_results, shard_errors) in zip(shards, self._pool.router.map(_write, shards)):
+            indexes = groups[shard]
+            results.update((indexes[index], result) for index, result in shard_results.items())
+            errors.extend(dict(error, index=indexes[error['index']]) for error in shard_errors)
+        errors.sort(key=lambda error: error['index'])
+        return results, errors
+
     def _filter_hander_mapping(self):
-        handlers = {
-            'INET': filter_wrapper.FilterNetwork(),
-            'CIDR': filter_wrapper.FilterNetwork(),
-            'small_integer': filter_wrapper.FilterNumber(),
-            'integer': filter_wrapper.FilterNumber(),
-            'big_integer': filter_wrapper.FilterNumber(),
-            'numeric': filter_wrapper.FilterNumber(),
-            'float': filter_wrapper.FilterNumber(),
-            'date': filter_wrapper.FilterDateTime(),
-            'datetime': filter_wrapper.FilterDateTime(),
-        }
-        return handlers
+        return _FILTER_HANDLERS
 
     def _get_filter_handler(self, name):
         handlers = self._filter_hander_mapping()
         return handlers.get(name, filter_wrapper.Filter())
 
-    def _apply_filters(self, query, orm_meta, filters=None, orders=None):
-        def _extract_column_visit_name(column):
+    def _get_column(self, orm_meta, expression):
+        """
+        解析过滤、排序的列表达式(包括JSONB的a.b.c路径)，结果按(资源类, Model, 表达式)缓存
+        """
+        key = (self.__class__, orm_meta, expression)
+        column = _COLUMN_CACHE.get(key)
+        if column is None:
+            column = filter_wrapper.column_from_expression(orm_meta, expression)
+            # 表达式来自请求参数，不是Model属性的表达式不缓存
+            if column is not None:
+                _COLUMN_CACHE.set(key, column)
+        return column
+
+    def _get_filter_plan(self, orm_meta, expression, op):
+        """
+        获取过滤计划：(列, 过滤函数)，列不存在或者过滤器不支持op时过滤函数为None，
+        结果按(资源类, Model, 表达式, op)缓存，每个组合只解析一次列、过滤器以及操作函数，
+        列不存在或者op不支持的组合不缓存
+        """
+        key = (self.__class__, orm_meta, expression, op)
+        plan = _FILTER_PLAN_CACHE.get(key)
+        if plan is None:
+            func = None
+            column = self._get_column(orm_meta, expression)
+            if column is not None:
+                col_type = getattr(column, 'type', None)
+                handler = self._get_filter_handler(getattr(col_type, '__visit_name__', None) if col_type else None)
+                func = getattr(handler, 'op_%s' % self._search_op(orm_meta, expression, op) if op else 'op', None)
+            plan = (column, func)
+            if func is not None:
+                _FILTER_PLAN_CACHE.set(key, plan)
+        return plan
+
+    @staticmethod
+    def _search_op(orm_meta, expression, op):
+        """
+        search过滤按Model声明的检索方式选择过滤函数，未声明为可搜索的列退化为不使用索引的ilike
+        """
+        if op != 'search':
+            return op
+        if expression not in getattr(orm_meta, 'searchable', ()):
+            return 'ilike'
+        return 'tsearch' if orm_meta.search_method == 'tsvector' else 'search'
+
+    def _search_rank(self, orm_meta, filters):
+        """
+        search过滤的相关度表达式，多个search条件时相加，
+        没有search过滤或者检索方式没有相关度(如未声明为可搜索的列)时为None
+        :param orm_meta: ORM Model
+        :type orm_meta: ORM Model
+        :param filters: 过滤条件
+        :type filters: dict
+        :returns: 相关度表达式
+        :rtype: ColumnElement
+        """
+        rank = None
+        for name, value in (filters or {}).items():
+            if not isinstance(value, dict) or 'search' not in value:
+                continue
+            column = self._get_column(orm_meta, name)
+            if column is None:
+                continue
             col_type = getattr(column, 'type', None)
-            if col_type:
-                return getattr(col_type, '__visit_name__', None)
+            handler = self._get_filter_handler(getattr(col_type, '__visit_name__', None) if col_type else None)
+            func = getattr(handler, 'rank_%s' % self._search_op(orm_meta, name, 'search'), None)
+            term = func(column, value['search']) if func else None
+            if term is not None:
+                rank = term if rank is None else rank + term
+        if rank is None:
             return None
+        # similarity/ts_rank为real，转换为double precision后输出的值可以原样作为游标定位
+        return sqlalchemy.cast(rank, sqlalchemy.Float(precision=53))
 
-        def _handle_filter(handler, op, query, column, value):
-            if op:
-                func = getattr(handler, 'op_%s' % op, None)
-                if func:
-                    return func(query, column, value)
-            else:
-                func = getattr(handler, 'op', None)
-                if func:
-                    return func(query, column, value)
-            return query
-
+    def _apply_filters(self, query, orm_meta, filters=None, orders=None, rank=None):
         filters = filters or {}
         orders = orders or []
+        # 实际生效的过滤、排序，用于统计使用情况以及索引建议
+        used_filters = []
+        used_orders = []
         for name, value in filters.items():
-            column = filter_wrapper.column_from_expression(orm_meta, name)
-            if column is not None:
-                handler = self._get_filter_handler(_extract_column_visit_name(column))
-                if not isinstance(value, dict):
-                    # op is None
-                    query = _handle_filter(handler, None, query, column, value)
-                else:
-                    for operator, value in value.items():
-                        query = _handle_filter(handler, operator, query, column, value)
+            if not isinstance(value, dict):
+                # op is None
+                column, func = self._get_filter_plan(orm_meta, name, None)
+                if func is not None:
+                    query = func(query, column, value)
+                    used_filters.append((name, None))
+            else:
+                for operator, value in value.items():
+                    column, func = self._get_filter_plan(orm_meta, name, operator)
+                    if func is not None:
+                        query = func(query, column, value)
+                        used_filters.append((name, operator))
+        if rank is not None:
+            # 相关度优先，排序规则作为相关度相同时的次序
+            query = query.order_by(rank.desc())
         for field in orders:
             order = '+'
             if field.startswith('+'):
@@ -181,15 +677,18 @@ class ResourceBase(object):
             elif field.startswith('-'):
                 order = '-'
                 field = field[1:]
-            column = filter_wrapper.column_from_expression(orm_meta, field)
-            if column:
+            column = self._get_column(orm_meta, field)
+            if column is not None:
                 if order == '+':
                     query = query.order_by(column)
                 else:
                     query = query.order_by(column.desc())
+                used_orders.append((field, order))
+        telemetry.record_usage(orm_meta, used_filters, used_orders)
         return query
 
-    def _get_query(self, session, orm_meta=None, filters=None, orders=None, tables=None, ignore_default=False):
+    def _get_query(self, session, orm_meta=None, filters=None, orders=None, tables=None, ignore_default=False,
+                   rank=None):
         """获取一个query对象，这个对象已经应用了filter，可以确保查询的数据只包含我们感兴趣的数据，常用于过滤已被删除的数据
         :param session: session对象
         :type session: session
@@ -200,11 +699,25 @@ class ResourceBase(object):
         :type filters: dict
         :param orders: 排序['+field', '-field', 'field']，+表示递增，-表示递减，不设置默认递增
         :type orders: list
+        :param rank: 排在排序规则之前的相关度表达式(降序)
+        :type rank: ColumnElement
         :returns: query对象
         :rtype: query
         :raises: ValueError
         """
         orm_meta = orm_meta or self.orm_meta
+        filters, orders = self._merge_default(filters, orders, ignore_default)
+        tables = tables or []
+        tables = copy.copy(tables)
+        tables.insert(0, orm_meta)
+        if orm_meta is None:
+            raise exception.CriticalError(msg=utils.format_kwstring(
+                _('%(name)s.orm_meta can not be None'), name=self.__class__.__name__))
+        query = session.query(*tables)
+        query = self._apply_filters(query, orm_meta, filters, orders, rank=rank)
+        return query
+
+    def _merge_default(self, filters=None, orders=None, ignore_default=False):
         filters = filters or {}
         filters = copy.copy(filters)
         if not ignore_default:
@@ -214,38 +727,508 @@ class ResourceBase(object):
         else:
             orders = orders or []
         orders = copy.copy(orders)
-        tables = tables or []
-        tables = copy.copy(tables)
-        tables.insert(0, orm_meta)
-        if orm_meta is None:
+        return filters, orders
+
+    def _get_select(self, session, columns, filters=None, orders=None, ignore_default=False, rank=None):
+        """获取一个Core select查询，过滤、排序规则与_get_query一致，结果为行对象而不创建ORM对象
+        :param session: session对象
+        :type session: session
+        :param columns: 查询的属性名列表，必须是Model的列
+        :type columns: list
+        :param filters: 过滤条件
+        :type filters: dict
+        :param orders: 排序规则
+        :type orders: list
+        :param rank: 排在排序规则之前的相关度表达式(降序)
+        :type rank: ColumnElement
+        :returns: query对象
+        :rtype: CoreQuery
+        """
+        if self.orm_meta is None:
             raise exception.CriticalError(msg=utils.format_kwstring(
                 _('%(name)s.orm_meta can not be None'), name=self.__class__.__name__))
-        query = session.query(*tables)
-        query = self._apply_filters(query, orm_meta, filters, orders)
+        filters, orders = self._merge_default(filters, orders, ignore_default)
+        mapper = orm.class_mapper(self.orm_meta)
+        statement = sqlalchemy.select([mapper.column_attrs[column].columns[0].label(column) for column in columns])
+        query = CoreQuery(session, statement.select_from(self.orm_meta.__table__),
+                          prepared=self._prepared_statements)
+        query = self._apply_filters(query, self.orm_meta, filters, orders, rank=rank)
         return query
 
-    def list(self, filters=None, orders=None, offset=None, limit=None):
-        offset = offset or 0
-        with self.get_session() as session:
-            query = self._get_query(session, filters=filters, orders=orders)
-            if offset:
-                query = query.offset(offset)
-            if limit is not None:
-                query = query.limit(limit)
-            records = query
-            results = [rec.to_dict() for rec in records]
+    def _core_attributes(self, level=serializer.LIST, force=False):
+        """
+        Core读取引擎下需要查询的属性，若启用Core引擎且属性全部为Model的列则返回属性列表，否则返回None(使用ORM)
+        :param level: list/detail
+        :type level: str
+        :param force: 不论是否启用Core引擎，都返回属性列表(如异步读取)
+        :type force: bool
+        :returns: 属性列表
+        :rtype: list
+        """
+        if self._read_engine != 'core' and not force:
+            return None
+        attributes = self.get_serializer(level).attributes
+        columns = orm.class_mapper(self.orm_meta).column_attrs.keys()
+        if all(attr in columns for attr in attributes):
+            return attributes
+        return None
+
+    def get_serializer(self, level=serializer.LIST, attributes=None):
+        """
+        获取当前资源Model的预编译序列化器
+        :param level: list/detail/summary
+        :type level: str
+        :param attributes: 指定输出的属性列表
+        :type attributes: list
+        :returns: 序列化器
+        :rtype: Serializer
+        """
+        return serializer.get_serializer(self.orm_meta, level, attributes=attributes)
+
+    def _keyset_keys(self, orders):
+        """
+        游标分页的排序键：当前排序规则 + 主键(保证排序唯一)
+        :param orders: 排序规则
+        :type orders: list
+        :returns: [(field, desc), ...]
+        :rtype: list
+        """
+        keys = []
+        for field in orders:
+            desc = field.startswith('-')
+            if field.startswith('+') or field.startswith('-'):
+                field = field[1:]
+            if '.' in field or getattr(self.orm_meta, field, None) is None:
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('cursor pagination does not support order: %(field)s'), field=field))
+            if field not in [key[0] for key in keys]:
+                keys.append((field, desc))
+        primary_keys = self.primary_keys
+        if not utils.is_list_type(primary_keys):
+            primary_keys = [primary_keys]
+        for field in primary_keys:
+            if field not in [key[0] for key in keys]:
+                keys.append((field, False))
+        return keys
+
+    @staticmethod
+    def _encode_cursor(values):
+        def _default(value):
+            if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+                return value.isoformat()
+            return str(value)
+
+        data = json.dumps(values, default=_default, separators=(',', ':'))
+        return utils.ensure_unicode(base64.urlsafe_b64encode(utils.ensure_bytes(data))).rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor, length):
+        try:
+            data = base64.urlsafe_b64decode(utils.ensure_bytes(cursor + '=' * (-len(cursor) % 4)))
+            values = json.loads(utils.ensure_unicode(data))
+        except (TypeError, ValueError):
+            values = None
+        if not isinstance(values, list) or len(values) != length:
+            raise exception.ValidationError(message=_('invalid cursor'))
+        return values
+
+    def _apply_keyset(self, query, keys, cursor, rank=None):
+        """
+        根据游标对query进行定位(seek)，排序方向一致时使用行值比较(a, b) > (x, y)，
+        否则展开为(a > x) OR (a = x AND b > y)；排序键中的相关度使用rank表达式
+        """
+        values = self._decode_cursor(cursor, len(keys))
+        columns = [rank if field == _RANK_KEY else getattr(self.orm_meta, field) for field, desc in keys]
+        directions = set(desc for field, desc in keys)
+        if len(directions) == 1:
+            left = sqlalchemy.tuple_(*columns)
+            right = sqlalchemy.tuple_(*[sqlalchemy.literal(value) for value in values])
+            return query.filter(left < right if directions.pop() else left > right)
+        clauses = []
+        for idx, (field, desc) in enumerate(keys):
+            terms = [columns[i] == values[i] for i in range(idx)]
+            terms.append(columns[idx] < values[idx] if desc else columns[idx] > values[idx])
+            clauses.append(sqlalchemy.and_(*terms))
+        return query.filter(sqlalchemy.or_(*clauses))
+
+    def _validate_fields(self, fields):
+        """
+        校验列投影的字段，只允许Model的列
+        :param fields: 字段列表
+        :type fields: list
+        :returns: 字段列表
+        :rtype: list
+        """
+        columns = orm.class_mapper(self.orm_meta).column_attrs.keys()
+        invalid = [field for field in fields if field not in columns]
+        if invalid:
+            raise exception.ValidationError(message=utils.format_kwstring(
+                _('unknown fields: %(fields)s'), fields=', '.join(invalid)))
+        return list(fields)
+
+    def _list_query(self, session, filters=None, orders=None, offset=None, limit=None, after=None, fields=None,
+                    force_core=False):
+        """
+        构造列表查询，after不为None时使用游标分页(此时忽略offset)，
+        fields不为空或者使用Core读取引擎时只查询需要的列，返回行对象而不创建ORM对象；
+        有search过滤且未指定排序规则时按相关度降序、默认排序规则排序，游标分页时相关度作为第一个排序键一并查询
+        :returns: (query对象, 游标分页排序键, 输出的属性列表，None表示结果为ORM对象)
+        :rtype: tuple
+        """
+        rank = self._search_rank(self.orm_meta, filters) if orders is None else None
+        keys = None
+        if after is not None:
+            orders = self.default_order if orders is None else orders
+            keys = self._keyset_keys(orders)
+            orders = [('-' if desc else '+') + field for field, desc in keys]
+            if rank is not None:
+                keys.insert(0, (_RANK_KEY, True))
+            offset = None
+        core_attributes = self._core_attributes(force=force_core)
+        projection = self._validate_fields(fields) if fields else core_attributes
+        if projection:
+            # 游标分页需要排序键的值，额外查询但不输出
+            selected = list(projection)
+            selected.extend(field for field, desc in keys or [] if field not in selected and field != _RANK_KEY)
+        if core_attributes is not None:
+            query = self._get_select(session, selected, filters=filters, orders=orders, rank=rank)
+        else:
+            query = self._get_query(session, filters=filters, orders=orders, rank=rank)
+            if projection:
+                query = query.with_entities(*[getattr(self.orm_meta, field) for field in selected])
+            elif self.orm_meta.deferred_attributes:
+                query = query.options(*[orm.defer(attr) for attr in self.orm_meta.deferred_attributes])
+        if self._ranked(keys):
+            # ORM对象的查询增加列后行对象为(ORM对象, 相关度)
+            query = query.add_columns(rank.label(_RANK_KEY))
+        if keys and after:
+            query = self._apply_keyset(query, keys, after, rank=rank)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return query, keys, projection
+
+    @staticmethod
+    def _ranked(keys):
+        """
+        游标分页排序键中是否包含相关度，此时查询结果中额外有相关度列
+        """
+        return bool(keys) and keys[0][0] == _RANK_KEY
+
+    @staticmethod
+    def _sort_values(row, record, keys):
+        """
+        获取一行的排序键的值，相关度从行对象中获取，其余从资源(ORM对象或者行对象)中获取
+        """
+        return [getattr(row if field == _RANK_KEY else record, field) for field, desc in keys]
+
+    def list(self, filters=None, orders=None, offset=None, limit=None, after=None, count=None, fields=None,
+             as_json=False):
+        """
+        根据过滤条件，获取资源
+        :param filters: 过滤条件
+        :type filters: dict
+        :param orders: 排序规则
+        :type orders: list
+        :param offset: 起始偏移量
+        :type offset: int
+        :param limit: 数量限制
+        :type limit: int
+        :param after: 游标分页的游标，空字符串表示第一页，None表示不使用游标分页
+        :type after: str
+        :param count: 为exact时在同一条语句中使用窗口函数count(*) over()统计总数，结果保存在total中
+        :type count: str
+        :param fields: 列投影，只查询并返回指定的列
+        :type fields: list
+        :param as_json: 是否直接返回序列化后的JSON文本
+        :type as_json: bool
+        :returns: 资源列表，游标分页时next_cursor为下一页游标
+        :rtype: ResultSet
+        """
+        if self._sharded():
+            shards = self._filter_shards(filters)
+            if len(shards) == 1:
+                return self._on_shard(shards[0]).list(filters, orders, offset, limit, after, count, fields, as_json)
+            return self._sharded_list(shards, filters, orders, offset, limit, after, count, fields, as_json)
+        with self.get_session(readonly=True) as session:
+            query, keys, projection = self._list_query(session, filters=filters, orders=orders, offset=offset,
+                                                       limit=limit, after=after, fields=fields)
+            # 游标定位后的窗口统计只包含游标之后的数据，此时不使用窗口统计
+            with_total = count == 'exact' and not after
+            if with_total:
+                query = query.add_columns(sqlalchemy.func.count().over().label('__total'))
+            return self._list_results(query.all(), keys, projection, offset=offset, limit=limit,
+                                      with_total=with_total, as_json=as_json)
+
+    def _list_results(self, rows, keys, projection, offset=None, limit=None, with_total=False, as_json=False):
+        """
+        将列表查询的行转换为ResultSet，设置总数以及下一页游标
+        """
+        total = None
+        # 列投影时直接使用行对象，多出的__total、__rank列不会被输出
+        if (with_total or self._ranked(keys)) and not projection:
+            records = [row[0] for row in rows]
+        else:
+            records = rows
+        if with_total:
+            if rows:
+                total = rows[0][-1]
+            elif not offset and limit != 0:
+                total = 0
+        results = ResultSet(self._format_records(records, fields=projection, as_json=as_json))
+        results.total = total
+        if keys and limit and len(records) == limit:
+            results.next_cursor = self._encode_cursor(self._sort_values(rows[-1], records[-1], keys))
         return results
 
+    def _column_attributes(self, level=serializer.LIST):
+        """
+        获取输出的属性列表，用于只能查询列的场景(异步读取、导出)，属性不全是列时抛出CriticalError
+        """
+        attributes = self._core_attributes(level, force=True)
+        if attributes is None:
+            raise exception.CriticalError(msg=utils.format_kwstring(
+                _('%(name)s attributes must all be columns'), name=self.__class__.__name__))
+        return attributes
+
+    def _async_engine(self, readonly=False):
+        """
+        异步读取使用的engine，只读时与get_session(readonly=True)一致地选择副本
+        """
+        db_pool = self._pool or pool.POOL
+        if readonly and not self._read_primary:
+            return db_pool.read_engine()
+        return db_pool.engine
+
+    @gen.coroutine
+    def alist(self, filters=None, orders=None, offset=None, limit=None, after=None, count=None, fields=None,
+              as_json=False):
+        """
+        list的异步版本，参数以及返回值与list一致，查询在异步连接上执行，等待期间不阻塞IOLoop，
+        要求Model输出的属性全部为列
+        :returns: 资源列表，游标分页时next_cursor为下一页游标
+        :rtype: ResultSet
+        """
+        if self._sharded():
+            # 分片资源在线程中执行
+            results = yield executor.get_executor().submit(self.list, filters, orders, offset, limit, after, count,
+                                                           fields, as_json)
+            raise gen.Return(results)
+        self._column_attributes()
+        query, keys, projection = self._list_query(None, filters=filters, orders=orders, offset=offset,
+                                                   limit=limit, after=after, fields=fields, force_core=True)
+        with_total = count == 'exact' and not after
+        if with_total:
+            query = query.add_columns(sqlalchemy.func.count().over().label('__total'))
+        rows = yield aio.fetchall(query.statement, queries=self._queries, engine=self._async_engine(readonly=True))
+        raise gen.Return(self._list_results(rows, keys, projection, offset=offset, limit=limit,
+                                            with_total=with_total, as_json=as_json))
+
+    @gen.coroutine
+    def acount(self, filters=None, offset=None, limit=None):
+        """
+        count的异步版本
+        :returns: 符合条件的资源数量
+        :rtype: int
+        """
+        if self._sharded():
+            total = yield executor.get_executor().submit(self.count, filters, offset, limit)
+            raise gen.Return(total)
+        query = self._get_select(None, self._column_attributes(), filters=filters, orders=[])
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        rows = yield aio.fetchall(query.count_statement(), queries=self._queries,
+                                  engine=self._async_engine(readonly=True))
+        raise gen.Return(rows[0][0])
+
+    @gen.coroutine
+    def aget(self, rid, as_json=False):
+        """
+        get的异步版本，同样使用主键读缓存
+        :returns: 资源详情
+        :rtype: dict
+        """
+        if self._sharded():
+            result = yield executor.get_executor().submit(self.get, rid, as_json)
+            raise gen.Return(result)
+        read_cache = self._get_cache()
+        if read_cache is not None:
+            key = cache.make_key(rid)
+            result = read_cache.get(key, as_json)
+            if result is not None:
+                raise gen.Return(result if as_json else copy.deepcopy(result))
+            token = read_cache.token()
+        attributes = self._column_attributes(serializer.DETAIL)
+        query = self._apply_primary_key_filter(self._get_select(None, attributes), rid)
+        # 与get一致，启用缓存时读取主库
+        rows = yield aio.fetchall(query.statement.limit(2), queries=self._queries,
+                                  engine=self._async_engine(readonly=read_cache is None))
+        if not rows:
+            raise exception.NotFoundError('%s not found!' % rid)
+        if len(rows) > 1:
+            raise orm.exc.MultipleResultsFound('Multiple rows were found for one_or_none()')
+        result = self._format_records(rows, fields=attributes, as_json=as_json, level=serializer.DETAIL)[0]
+        if read_cache is not None:
+            read_cache.set(key, result if as_json else copy.deepcopy(result), as_json, token=token)
+        raise gen.Return(result)
+
+    def _format_records(self, records, fields=None, as_json=False, level=serializer.LIST):
+        """
+        将ORM对象或只包含部分列的行对象转换为字典或者JSON文本
+        """
+        if fields:
+            if as_json:
+                dumps = self.get_serializer(attributes=fields).dumps_row
+                return [dumps(row) for row in records]
+            return [dict((field, getattr(row, field)) for field in fields) for row in records]
+        if as_json:
+            dumps = self.get_serializer(level).dumps
+            return [dumps(rec) for rec in records]
+        if level == serializer.DETAIL:
+            return [rec.to_detail_dict() for rec in records]
+        return [rec.to_dict() for rec in records]
+
+    def iter_list(self, filters=None, orders=None, offset=None, limit=None, after=None, fields=None,
+                  chunk_size=500, as_json=False):
+        """
+        根据过滤条件，以服务端游标逐批获取资源，内存占用与结果集大小无关
+        :param filters: 过滤条件
+        :type filters: dict
+        :param orders: 排序规则
+        :type orders: list
+        :param offset: 起始偏移量
+        :type offset: int
+        :param limit: 数量限制
+        :type limit: int
+        :param after: 游标分页的游标，空字符串表示第一页，None表示不使用游标分页
+        :type after: str
+        :param fields: 列投影，只查询并返回指定的列
+        :type fields: list
+        :param chunk_size: 每批从数据库游标中读取的行数
+        :type chunk_size: int
+        :param as_json: 是否直接返回序列化后的JSON文本
+        :type as_json: bool
+        :returns: 资源生成器，调用方未迭代完时需要close以释放会话
+        :rtype: generator
+        """
+        if self._sharded():
+            shards = self._filter_shards(filters)
+            if len(shards) == 1:
+                results = self._on_shard(shards[0]).iter_list(filters, orders, offset, limit, after, fields,
+                                                              chunk_size, as_json)
+            else:
+                results = self._sharded_iter(shards, filters, orders, offset, limit, after, fields, chunk_size,
+                                             as_json)
+            try:
+                for result in results:
+                    yield result
+            finally:
+                results.close()
+            return
+        with self.get_session(readonly=True) as session:
+            query, keys, projection = self._list_query(session, filters=filters, orders=orders, offset=offset,
+                                                       limit=limit, after=after, fields=fields)
+            # yield_per会启用stream_results，psycopg2下使用服务端游标
+            split = self._ranked(keys) and not projection
+            chunk = []
+            for rec in query.yield_per(chunk_size):
+                chunk.append(rec[0] if split else rec)
+                if len(chunk) >= chunk_size:
+                    for result in self._format_records(chunk, fields=projection, as_json=as_json):
+                        yield result
+                    chunk = []
+            for result in self._format_records(chunk, fields=projection, as_json=as_json):
+                yield result
+
+    def _sharded_iter(self, shards, filters, orders, offset, limit, after, fields, chunk_size, as_json):
+        """
+        跨分片逐批获取：每个分片一个服务端游标，按排序键归并，只在需要下一行时从对应分片读取
+        """
+        start = (offset or 0) if after is None else 0
+        shard_limit = None if limit is None else start + limit
+
+        def _rows(shard):
+            resource = self._on_shard(shard)
+
+            def _format(chunk, keys, projection):
+                directions = [desc for field, desc in keys]
+                recs = [row[0] for row in chunk] if resource._ranked(keys) and not projection else chunk
+                records = resource._format_records(recs, fields=projection, as_json=as_json)
+                return [(_SortKey(self._sort_values(row, rec, keys), directions), shard, record)
+                        for row, rec, record in zip(chunk, recs, records)]
+
+            with resource.get_session(readonly=True) as session:
+                query, keys, projection = resource._list_query(session, filters=filters, orders=orders,
+                                                               limit=shard_limit, after='' if after is None else after,
+                                                               fields=fields)
+                chunk = []
+                for rec in query.yield_per(chunk_size):
+                    chunk.append(rec)
+                    if len(chunk) >= chunk_size:
+                        for item in _format(chunk, keys, projection):
+                            yield item
+                        chunk = []
+                for item in _format(chunk, keys, projection):
+                    yield item
+
+        shard_rows = [_rows(shard) for shard in shards]
+        try:
+            merged = heapq.merge(*shard_rows)
+            for sort_key, shard, record in itertools.islice(merged, start, None if limit is None else start + limit):
+                yield record
+        finally:
+            for rows in shard_rows:
+                rows.close()
+
     def count(self, filters=None, offset=None, limit=None):
+        if self._sharded():
+            total = sum(self._pool.router.map(lambda shard: self._on_shard(shard).count(filters),
+                                              self._filter_shards(filters)))
+            total = max(total - (offset or 0), 0)
+            return total if limit is None else min(total, limit)
         offset = offset or 0
-        with self.get_session() as session:
-            query = self._get_query(session, filters=filters, orders=[])
+        with self.get_session(readonly=True) as session:
+            attributes = self._core_attributes()
+            if attributes is not None:
+                query = self._get_select(session, attributes, filters=filters, orders=[])
+            else:
+                query = self._get_query(session, filters=filters, orders=[])
             if offset:
                 query = query.offset(offset)
             if limit is not None:
                 query = query.limit(limit)
             return query.count()
 
+    def estimate_count(self, filters=None):
+        """
+        估算符合条件的资源数量，无过滤条件时使用pg_class.reltuples，否则使用查询计划的估算行数
+        :param filters: 过滤条件
+        :type filters: dict
+        :returns: 估算的资源数量
+        :rtype: int
+        """
+        if self._sharded():
+            return sum(self._pool.router.map(lambda shard: self._on_shard(shard).estimate_count(filters),
+                                             self._filter_shards(filters)))
+        with self.get_session(readonly=True) as session:
+            query = self._get_query(session, filters=filters, orders=[])
+            if not filters and not self._default_filter:
+                reltuples = session.execute(
+                    sqlalchemy.text('SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)'),
+                    {'name': self.orm_meta.__table__.name}).scalar()
+                # 从未analyze过的表reltuples为-1(PG14+)或0，回退到查询计划
+                if reltuples is not None and reltuples > 0:
+                    return int(reltuples)
+            connection = session.connection()
+            compiled = query.statement.compile(dialect=connection.dialect)
+            plan = connection.execute('EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params).scalar()
+            if utils.is_string_type(plan):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
     def _apply_primary_key_filter(self, query, rid):
         keys = self.primary_keys
         if utils.is_list_type(keys) and utils.is_list_type(rid):
@@ -266,26 +1249,115 @@ class ResourceBase(object):
                 _('primary key not match! require: %(keys)s'), keys=keys))
         return query
 
-    def get(self, rid):
+    def get(self, rid, as_json=False):
         """
         :param rid:
+        :param as_json: 是否直接返回序列化后的JSON文本
         :return:
         """
+        if self._sharded():
+            return self._sharded_get(rid, as_json)
         result = None
-        with self.get_session() as session:
-            query = self._get_query(session)
+        read_cache = self._get_cache()
+        if read_cache is not None:
+            key = cache.make_key(rid)
+            result = read_cache.get(key, as_json)
+            if result is not None:
+                return result if as_json else copy.deepcopy(result)
+            token = read_cache.token()
+        # 缓存的失效通知来自主库，从有延迟的副本读取可能把失效前的数据写回缓存，启用缓存时读取主库
+        with self.get_session(readonly=read_cache is None) as session:
+            attributes = self._core_attributes(serializer.DETAIL)
+            if attributes is not None:
+                query = self._get_select(session, attributes)
+            else:
+                query = self._get_query(session)
             query = self._apply_primary_key_filter(query, rid)
             rec_tuples = query.one_or_none()
             if rec_tuples:
-                result = rec_tuples.to_detail_dict()
+                result = self._format_records([rec_tuples], fields=attributes, as_json=as_json,
+                                              level=serializer.DETAIL)[0]
             else:
                 raise exception.NotFoundError('%s not found!' % rid)
+        if read_cache is not None:
+            read_cache.set(key, result if as_json else copy.deepcopy(result), as_json, token=token)
         return result
 
+    def _sharded_get(self, rid, as_json=False):
+        """主键不包含分片键，并行地在所有分片上查询"""
+
+        def _get(shard):
+            try:
+                return self._on_shard(shard).get(rid, as_json=as_json)
+            except HTTPError as e:
+                if e.status_code == exception.NotFoundError.code:
+                    return None
+                raise
+
+        for result in self._pool.router.map(_get, list(range(self._pool.router.size))):
+            if result is not None:
+                return result
+        raise exception.NotFoundError('%s not found!' % rid)
+
+    @staticmethod
+    def _copy_sql(cursor, statement, dialect, export_format):
+        """
+        生成COPY (SELECT ...) TO STDOUT语句，COPY不支持绑定参数，参数由驱动转义后内联
+        """
+        sql, params = prepared.compile_statement(statement, dialect)
+        query = utils.ensure_unicode(cursor.mogrify(sql, params))
+        if export_format == 'ndjson':
+            # 使用JSON中不会出现的控制字符作为CSV的分隔符以及引号，使row_to_json的输出原样写出
+            return ("COPY (SELECT row_to_json(export) FROM (%s) export) TO STDOUT "
+                    "WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')" % query)
+        return 'COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)' % query
+
+    def export(self, stream, filters=None, orders=None, offset=None, limit=None, fields=None, export_format='csv'):
+        """
+        使用COPY导出符合条件的资源，过滤、排序规则与list一致，数据由数据库直接输出，不创建ORM对象以及Python对象，
+        输出为数据库的文本格式(如时间类型为ISO 8601格式)
+        :param stream: 输出对象，需要有write方法
+        :type stream: file
+        :param fields: 导出的字段，默认为列表输出的属性，必须是Model的列
+        :type fields: list
+        :param export_format: csv(带表头)/ndjson(每行一个JSON对象)
+        :type export_format: str
+        """
+        if export_format not in ('csv', 'ndjson'):
+            raise exception.ValidationError(message=utils.format_kwstring(
+                _('export format must be one of csv, ndjson, not %(format)s'), format=export_format))
+        if self._sharded():
+            # COPY的输出无法跨分片排序以及分页，只支持单个分片
+            shards = self._filter_shards(filters)
+            if len(shards) != 1:
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('export requires a single %(key)s'), key=self._shard_key))
+            return self._on_shard(shards[0]).export(stream, filters, orders, offset, limit, fields, export_format)
+        attributes = self._validate_fields(fields) if fields else self._column_attributes()
+        query = self._get_select(None, attributes, filters=filters, orders=orders)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.get_session(readonly=True) as session:
+            connection = session.connection()
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(self._copy_sql(cursor, query.statement, connection.dialect, export_format), stream)
+            finally:
+                cursor.close()
+                # 非事务的session每次获取的连接需要自行释放
+                if not session.is_active:
+                    connection.close()
+
     def _before_create(self, resource):
         pass
 
     def create(self, resource):
+        if self._sharded():
+            return self._on_shard(self._data_shard(resource)).create(resource)
+        if self._write_engine == 'returning':
+            return self._create_returning(resource)
         with self.get_session() as session:
             self._before_create(resource)
             orm_fields = resource
@@ -293,14 +1365,594 @@ class ResourceBase(object):
                 item = self.orm_meta(**orm_fields)
                 session.add(item)
                 session.flush()
+                self._mark_changed(session)
                 return item.to_dict()
             except sqlalchemy.exc.IntegrityError as e:
-                print(e)
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                LOG.exception(e)
+                raise exception.DBError(msg=_('unknown db error'))
+
+    @staticmethod
+    def _error_message(error):
+        if isinstance(error, HTTPError):
+            return error.reason or error.log_message
+        if isinstance(error, sqlalchemy.exc.DBAPIError):
+            return utils.ensure_unicode(str(error.orig)).strip().split('\n')[0]
+        return str(error)
+
+    def _column_values(self, resource):
+        """
+        经过Model的字段校验，返回资源对应的列值
+        """
+        if not isinstance(resource, dict):
+            raise exception.ValidationError(message=_('resource must be a json object'))
+        # 构造Model对象以触发与create一致的字段校验
+        item = self.orm_meta(**resource)
+        state = item.__dict__
+        columns = orm.class_mapper(self.orm_meta).column_attrs
+        return dict((prop.columns[0].key, state[prop.key]) for prop in columns if prop.key in state)
+
+    def _prepare_bulk_row(self, resource):
+        """
+        执行_before_create以及Model的字段校验，返回待插入的列值
+        """
+        if not isinstance(resource, dict):
+            raise exception.ValidationError(message=_('resource must be a json object'))
+        self._before_create(resource)
+        return self._column_values(resource)
+
+    def _returning(self, statement, *extra):
+        columns = orm.class_mapper(self.orm_meta).column_attrs
+        return statement.returning(*([prop.columns[0] for prop in columns] + list(extra)))
+
+    def _returning_dicts(self, rows, prefix=None):
+        """
+        将RETURNING的行转换为to_dict级别的字典，prefix不为None时按"前缀+属性名"的列名取值
+        """
+        output = set(self.get_serializer().attributes)
+        attributes = [(prop.key, prop.columns[0] if prefix is None else prefix + prop.key)
+                      for prop in orm.class_mapper(self.orm_meta).column_attrs if prop.key in output]
+        return [dict((key, row[column]) for key, column in attributes) for row in rows]
+
+    def _insert_rows(self, session, rows):
+        statement = self._returning(self.orm_meta.__table__.insert().values(rows))
+        return self._returning_dicts(session.execute(statement).fetchall())
+
+    def _coerce_text_values(self, resource):
+        """
+        将文本格式(如CSV)的值按列类型转换，空文本为NULL
+        """
+        if not isinstance(resource, dict):
+            raise exception.ValidationError(message=_('resource must be a json object'))
+        columns = orm.class_mapper(self.orm_meta).column_attrs
+        values = {}
+        for key, text in resource.items():
+            if key not in columns:
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('unknown fields: %(fields)s'), fields=key))
+            if text is None or text == '':
+                values[key] = None
+                continue
+            try:
+                python_type = columns[key].columns[0].type.python_type
+            except NotImplementedError:
+                python_type = None
+            try:
+                if python_type is bool:
+                    values[key] = utils.bool_from_string(text, strict=True)
+                elif python_type in six.integer_types or python_type in (float, decimal.Decimal):
+                    values[key] = python_type(text)
+                elif python_type in (dict, list):
+                    values[key] = json.loads(text)
+                else:
+                    values[key] = text
+            except (ValueError, decimal.InvalidOperation):
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('[%(field)s] invalid value: %(value)s'), field=key, value=text))
+        return values
+
+    def _prepare_text_row(self, resource):
+        return self._prepare_bulk_row(self._coerce_text_values(resource))
+
+    def create_many(self, resources, chunk_size=None, text_values=False):
+        """
+        批量创建资源，每行都会执行_before_create以及字段校验，按列组合分组后使用多行INSERT ... RETURNING分块插入，
+        某个分块插入失败时逐行重试，失败的行记录错误而不会中止整个批次
+        :param resources: 资源列表
+        :type resources: list
+        :param chunk_size: 每条INSERT语句的最大行数，默认为_bulk_chunk_size
+        :type chunk_size: int
+        :param text_values: 资源的值是否为文本(如CSV导入)，是则按列类型转换，空文本为NULL
+        :type text_values: bool
+        :returns: (创建成功的资源列表(to_dict级别，保持输入顺序), 错误列表[{'index': 输入位置, 'message': 错误信息}])
+        :rtype: tuple
+        """
+        if self._sharded():
+            created, errors = self._sharded_write_many('_create_many', resources, chunk_size, text_values=text_values)
+        else:
+            created, errors = self._create_many(resources, chunk_size, text_values=text_values)
+        return [created[index] for index in sorted(created)], errors
+
+    def _create_many(self, resources, chunk_size=None, text_values=False):
+        """
+        create_many的实现
+        :returns: ({输入位置: 创建的资源}, 错误列表)
+        :rtype: tuple
+        """
+        chunk_size = chunk_size or self._bulk_chunk_size
+        errors = []
+        prepare = self._prepare_text_row if text_values else self._prepare_bulk_row
+        groups = self._group_rows(resources, prepare, errors)
+        created = {}
+        with self.transaction() as session:
+            self._write_chunks(session, groups, chunk_size, self._insert_rows, created, errors)
+            if created:
+                self._mark_changed(session)
+        errors.sort(key=lambda error: error['index'])
+        return created, errors
+
+    def _group_rows(self, resources, prepare, errors):
+        """
+        逐行准备待写入的列值，按列组合分组(多行VALUES要求每行的列相同)，准备失败的行记录到errors
+        :returns: {列组合: [(输入位置, 列值)]}
+        :rtype: dict
+        """
+        groups = {}
+        for index, resource in enumerate(resources):
+            try:
+                values = prepare(resource)
+            except HTTPError as e:
+                errors.append({'index': index, 'message': self._error_message(e)})
+                continue
+            groups.setdefault(tuple(sorted(values.keys())), []).append((index, values))
+        return groups
+
+    def _write_chunks(self, session, groups, chunk_size, write, results, errors):
+        """
+        分块执行批量写入，每个分块使用一个savepoint，分块失败时逐行重试，失败的行记录到errors
+        :param write: 写入函数write(session, rows)，返回与rows一一对应的结果
+        :type write: callable
+        :param results: 输出，{输入位置: 结果}
+        :type results: dict
+        """
+        for group in groups.values():
+            for start in range(0, len(group), chunk_size):
+                chunk = group[start:start + chunk_size]
+                try:
+                    with session.begin_nested():
+                        outputs = write(session, [values for index, values in chunk])
+                    results.update(zip([index for index, values in chunk], outputs))
+                except sqlalchemy.exc.DBAPIError:
+                    # 分块失败，逐行重试以定位失败的行
+                    for index, values in chunk:
+                        try:
+                            with session.begin_nested():
+                                results[index] = write(session, [values])[0]
+                        except sqlalchemy.exc.DBAPIError as e:
+                            errors.append({'index': index, 'message': self._error_message(e)})
+
+    def _conflict_keys(self):
+        """
+        upsert判断资源是否已存在的列，_unique_keys未声明时使用主键，需要有对应的唯一约束或唯一索引
+        """
+        return list(self._unique_keys or self._primary_key_names())
+
+    def _prepare_upsert_row(self, resource):
+        """
+        准备upsert的列值，只在冲突键或者主键缺少时执行_before_create(生成主键)，
+        已提供的冲突键以及主键不会被覆盖，生成的主键只用于插入，冲突时不会更新已存在行的主键
+        """
+        if not isinstance(resource, dict):
+            raise exception.ValidationError(message=_('resource must be a json object'))
+        keys = self._conflict_keys()
+        given = dict((key, resource[key]) for key in set(keys + self._primary_key_names())
+                     if resource.get(key) is not None)
+        if len(given) < len(set(keys + self._primary_key_names())):
+            self._before_create(resource)
+            resource.update(given)
+        values = self._column_values(resource)
+        for key in keys:
+            if values.get(key) is None:
+                raise exception.FieldRequired(attribute=key)
+        return values
+
+    def _upsert_rows(self, session, rows):
+        """
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING，xmax为0的行是新插入的行
+        :returns: [(操作'create'/'update', to_dict级别的资源)]
+        :rtype: list
+        """
+        keys = self._conflict_keys()
+        statement = postgresql.insert(self.orm_meta.__table__).values(rows)
+        # 主键不随upsert改变；只提供了冲突键时仍然需要DO UPDATE才能返回已存在的行
+        primary_keys = self._primary_key_names()
+        updates = [column for column in sorted(rows[0]) if column not in keys and column not in primary_keys] or keys
+        statement = statement.on_conflict_do_update(
+            index_elements=keys, set_=dict((column, statement.excluded[column]) for column in updates))
+        inserted = sqlalchemy.literal_column('xmax = 0').label('__inserted')
+        records = session.execute(self._returning(statement, inserted)).fetchall()
+        return [('create' if record['__inserted'] else 'update', result)
+                for record, result in zip(records, self._returning_dicts(records))]
+
+    def create_or_update(self, resource):
+        """
+        创建资源，冲突键(_unique_keys或主键)已存在时更新提供的字段，一次往返完成
+        :param resource: 资源的内容
+        :type resource: dict
+        :returns: (操作'create'/'update', 创建或更新后的资源信息)
+        :rtype: tuple
+        """
+        if self._sharded():
+            return self._on_shard(self._data_shard(resource)).create_or_update(resource)
+        values = self._prepare_upsert_row(resource)
+        with self.transaction() as session:
+            try:
+                operation, result = self._upsert_rows(session, [values])[0]
+            except sqlalchemy.exc.IntegrityError as e:
+                raise exception.ConflictError(msg=self._error_message(e))
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                LOG.exception(e)
+                raise exception.DBError(msg=_('unknown db error'))
+            if operation == 'update':
+                self._mark_changed(session, [result[key] for key in self._primary_key_names()])
+            else:
+                self._mark_changed(session)
+        return operation, result
+
+    def upsert_many(self, resources, chunk_size=None):
+        """
+        批量创建或更新资源，与create_many一样分块执行，失败的行记录错误而不会中止整个批次
+        :param resources: 资源列表
+        :type resources: list
+        :param chunk_size: 每条INSERT语句的最大行数，默认为_bulk_chunk_size
+        :type chunk_size: int
+        :returns: (结果列表[{'index': 输入位置, 'operation': 'create'/'update', 'data': 资源}](保持输入顺序),
+                   错误列表[{'index': 输入位置, 'message': 错误信息}])
+        :rtype: tuple
+        """
+        if self._sharded():
+            results, errors = self._sharded_write_many('_upsert_many', resources, chunk_size)
+        else:
+            results, errors = self._upsert_many(resources, chunk_size)
+        return [{'index': index, 'operation': results[index][0], 'data': results[index][1]}
+                for index in sorted(results)], errors
+
+    def _upsert_many(self, resources, chunk_size=None):
+        """
+        upsert_many的实现
+        :returns: ({输入位置: (操作, 资源)}, 错误列表)
+        :rtype: tuple
+        """
+        chunk_size = chunk_size or self._bulk_chunk_size
+        errors = []
+        groups = self._group_rows(resources, self._prepare_upsert_row, errors)
+        results = {}
+        with self.transaction() as session:
+            self._write_chunks(session, groups, chunk_size, self._upsert_rows, results, errors)
+            if results:
+                self._mark_changed(session, many=any(operation == 'update' for operation, result in results.values()))
+        errors.sort(key=lambda error: error['index'])
+        return results, errors
+
+    def _primary_key_names(self):
+        keys = self.primary_keys
+        if not utils.is_list_type(keys):
+            keys = [keys]
+        return list(keys)
+
+    def _bulk_target(self, session, filters, chunk_size=None, last=None):
+        """
+        构造批量更新、删除的目标条件：主键 IN (按过滤条件查询主键)，
+        分块时按主键排序，只取last之后的chunk_size行
+        """
+        keys = self._primary_key_names()
+        columns = [self.orm_meta.__table__.c[key] for key in keys]
+        query = self._get_select(session, keys, filters=filters,
+                                 orders=['+' + key for key in keys] if chunk_size else [])
+        if last is not None:
+            if len(columns) == 1:
+                query = query.filter(columns[0] > last[0])
+            else:
+                query = query.filter(sqlalchemy.tuple_(*columns) > sqlalchemy.tuple_(*last))
+        if chunk_size:
+            query = query.limit(chunk_size)
+        if len(columns) == 1:
+            return columns[0].in_(query.statement)
+        return sqlalchemy.tuple_(*columns).in_(query.statement)
+
+    def _check_bulk_filters(self, filters):
+        """
+        校验批量更新、删除的过滤条件：不能为空，每个列以及操作符都必须有效，并且都会生成WHERE条件，
+        否则该条件会被忽略，错误的过滤条件将作用于整个表
+        :param filters: 过滤条件
+        :type filters: dict
+        :raises: ValidationError
+        """
+        if not filters:
+            raise exception.ValidationError(message=_('at least one filter is required for bulk operation'))
+        empty = sqlalchemy.select([sqlalchemy.literal_column('1')])
+        for name, value in filters.items():
+            terms = list(value.items()) if isinstance(value, dict) else [(None, value)]
+            if not terms:
+                raise exception.ValidationError(message=utils.format_kwstring(_('invalid filter: %(name)s'), name=name))
+            for operator, term in terms:
+                column, func = self._get_filter_plan(self.orm_meta, name, operator)
+                # 如tsearch没有可检索的词时不生成条件
+                if func is None or func(CoreQuery(None, empty), column, term).statement._whereclause is None:
+                    raise exception.ValidationError(message=utils.format_kwstring(
+                        _('invalid filter: %(name)s'), name=name if operator is None else '%s__%s' % (name, operator)))
+
+    def _bulk_execute(self, make_statement, filters, chunk_size=None):
+        """
+        执行批量更新、删除，每次一条语句；指定chunk_size时按主键范围分块执行，
+        每块使用独立事务(使用外部事务时除外)，避免长时间持有大量行锁
+        :returns: RETURNING的行
+        :rtype: list
+        """
+        self._check_bulk_filters(filters)
+        keys = self._primary_key_names()
+        results = []
+        last = None
+        while True:
+            with self.transaction() as session:
+                target = self._bulk_target(session, filters, chunk_size=chunk_size, last=last)
+                rows = session.execute(make_statement(target)).fetchall()
+                if rows:
+                    self._mark_changed(session, many=True)
+            results.extend(rows)
+            if not chunk_size or len(rows) < chunk_size:
+                break
+            # RETURNING的顺序不保证与主键顺序一致
+            last = max(tuple(row[key] for key in keys) for row in rows)
+        return results
+
+    def update_many(self, filters, resource, chunk_size=None):
+        """
+        按过滤条件批量更新资源，编译为UPDATE ... WHERE ... RETURNING
+        :param filters: 过滤条件，不能为空
+        :type filters: dict
+        :param resource: 更新的字段以及值
+        :type resource: dict
+        :param chunk_size: 按主键范围分块，每块最多更新的行数，None表示一条语句更新全部
+        :type chunk_size: int
+        :returns: (更新的数量, 更新后的资源列表)
+        :rtype: tuple
+        """
+        if self._sharded():
+            self._check_bulk_filters(filters)
+            if self._shard_key in (resource or {}):
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('shard key %(key)s can not be updated'), key=self._shard_key))
+            return self._merge_counts(self._pool.router.map(
+                lambda shard: self._on_shard(shard).update_many(filters, resource, chunk_size),
+                self._filter_shards(filters)))
+        values = self._column_values(resource)
+        if not values:
+            raise exception.ValidationError(message=_('nothing to update'))
+        table = self.orm_meta.__table__
+        try:
+            rows = self._bulk_execute(lambda target: self._returning(table.update().where(target).values(values)),
+                                      filters, chunk_size=chunk_size)
+        except sqlalchemy.exc.DBAPIError as e:
+            LOG.exception(e)
+            raise exception.DBError(msg=self._error_message(e))
+        return len(rows), self._returning_dicts(rows)
+
+    def delete_many(self, filters, chunk_size=None):
+        """
+        按过滤条件批量删除资源，Model存在removed列时为软删除(设置removed为当前时间)，
+        编译为一条UPDATE/DELETE ... WHERE ... RETURNING
+        :param filters: 过滤条件，不能为空
+        :type filters: dict
+        :param chunk_size: 按主键范围分块，每块最多删除的行数，None表示一条语句删除全部
+        :type chunk_size: int
+        :returns: (删除的数量, 删除的资源列表)
+        :rtype: tuple
+        """
+        if self._sharded():
+            self._check_bulk_filters(filters)
+            return self._merge_counts(self._pool.router.map(
+                lambda shard: self._on_shard(shard).delete_many(filters, chunk_size), self._filter_shards(filters)))
+        table = self.orm_meta.__table__
+        if getattr(self.orm_meta, 'removed', None) is not None:
+            def make_statement(target):
+                return self._returning(table.update().where(target).values(removed=datetime.datetime.now()))
+        else:
+            def make_statement(target):
+                return self._returning(table.delete().where(target))
+        try:
+            rows = self._bulk_execute(make_statement, filters, chunk_size=chunk_size)
+        except sqlalchemy.exc.DBAPIError as e:
+            LOG.exception(e)
+            raise exception.DBError(msg=self._error_message(e))
+        return len(rows), self._returning_dicts(rows)
+
+    @staticmethod
+    def _merge_counts(results):
+        """合并各分片的(数量, 资源列表)"""
+        return sum(count for count, records in results), [record for count, records in results for record in records]
+
+    @staticmethod
+    def _begin(session):
+        """
+        开始写入事务，外部会话已处于事务中时使用SAVEPOINT，语句失败时只回滚到SAVEPOINT，外部事务可以继续
+        """
+        if isinstance(session, orm.scoped_session):
+            session = session()
+        if session.transaction is not None:
+            return session.begin_nested()
+        return session.begin()
+
+    def _create_returning(self, resource):
+        with self.get_session() as session:
+            self._before_create(resource)
+            values = self._column_values(resource)
+            keys = tuple(sorted(values))
+            table = self.orm_meta.__table__
+
+            def build():
+                return self._returning(table.insert().values(dict(
+                    (key, sqlalchemy.bindparam('__v_' + key, type_=table.c[key].type)) for key in keys)))
+
+            try:
+                with self._begin(session):
+                    row = self._execute_write(session, 'insert', keys, build,
+                                              dict(('__v_' + key, values[key]) for key in keys))
+                    self._mark_changed(session)
+                return self._returning_dicts([row])[0]
+            except sqlalchemy.exc.IntegrityError as e:
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                LOG.exception(e)
+                raise exception.DBError(msg=_('unknown db error'))
+
+    def _rid_params(self, rid):
+        """
+        将主键值转换为绑定参数，使写入语句与主键值无关，可以缓存编译结果
+        :returns: (可以传给_apply_primary_key_filter的绑定参数, 参数值)
+        :rtype: tuple
+        """
+        keys = self._primary_key_names()
+        values = list(rid) if utils.is_list_type(rid) else [rid]
+        if len(values) != len(keys):
+            raise exception.CriticalError(msg=utils.format_kwstring(
+                _('primary key length not match! require: %(length_require)d, input: %(length_input)d'),
+                length_require=len(keys), length_input=len(values)))
+        binds = [sqlalchemy.bindparam('__pk_%d' % idx) for idx in range(len(keys))]
+        params = dict(('__pk_%d' % idx, value) for idx, value in enumerate(values))
+        return (binds if len(binds) > 1 else binds[0]), params
+
+    def _execute_write(self, session, kind, keys, build, params):
+        """
+        执行写入语句，语句按(资源类, 类型, 列, 默认过滤条件)只构造、编译一次，之后只绑定参数执行
+        :param kind: 语句类型
+        :type kind: str
+        :param keys: 写入的列
+        :type keys: tuple
+        :param build: 构造语句的函数
+        :type build: function
+        :param params: 绑定参数值
+        :type params: dict
+        :returns: RETURNING的第一行
+        :rtype: RowProxy
+        """
+        connection = session.connection()
+        cache_key = (self.__class__, kind, keys, repr(self.default_filter))
+        compiled = _WRITE_STATEMENTS.get(cache_key)
+        if compiled is None:
+            compiled = build().compile(dialect=connection.dialect)
+            if len(_WRITE_STATEMENTS) < _PLAN_CACHE_SIZE:
+                _WRITE_STATEMENTS[cache_key] = compiled
+        return connection.execute(compiled, params).first()
+
+    def _before_image(self, session, rid, lock=True):
+        """
+        按主键(以及默认过滤条件)选择目标行的CTE，加锁以保证获取的是实际被修改的行版本
+        """
+        keys = [prop.key for prop in orm.class_mapper(self.orm_meta).column_attrs]
+        query = self._get_select(session, keys, orders=[])
+        query = self._apply_primary_key_filter(query, rid)
+        statement = query.statement
+        if lock:
+            statement = statement.with_for_update()
+        return statement.cte('before_image')
+
+    def _update_returning(self, session, rid, values):
+        """
+        单条语句更新并返回修改前、后的数据：
+        WITH before_image AS (SELECT ... FOR UPDATE) UPDATE ... FROM before_image ... RETURNING before_image.*, table.*
+        :returns: (修改前的资源, 修改后的资源)，资源不存在时为(None, None)
+        :rtype: tuple
+        """
+        table = self.orm_meta.__table__
+        columns = orm.class_mapper(self.orm_meta).column_attrs
+        rid_binds, params = self._rid_params(rid)
+        keys = tuple(sorted(values))
+        params.update(('__v_' + key, values[key]) for key in keys)
+
+        def build_select():
+            return sqlalchemy.select([self._before_image(session, rid_binds, lock=False)])
+
+        def build_update():
+            before = self._before_image(session, rid_binds)
+            condition = sqlalchemy.and_(*[table.c[key] == before.c[key] for key in self._primary_key_names()])
+            return table.update().where(condition).values(dict(
+                (key, sqlalchemy.bindparam('__v_' + key, type_=table.c[key].type)) for key in keys)).returning(
+                *([before.c[prop.key].label('__before_' + prop.key) for prop in columns] +
+                  [prop.columns[0].label('__after_' + prop.key) for prop in columns]))
+
+        if not values:
+            row = self._execute_write(session, 'select', keys, build_select, params)
+            if row is None:
+                return None, None
+            record = self._returning_dicts([row], prefix='')[0]
+            return record, copy.deepcopy(record)
+        row = self._execute_write(session, 'update', keys, build_update, params)
+        if row is None:
+            return None, None
+        return self._returning_dicts([row], prefix='__before_')[0], self._returning_dicts([row], prefix='__after_')[0]
+
+    def _update_with_returning(self, rid, resource):
+        values = self._column_values(resource or {})
+        with self.get_session() as session:
+            try:
+                with self._begin(session):
+                    before_update, after_update = self._update_returning(session, rid, values)
+                    if before_update is not None and values:
+                        self._mark_changed(session, rid)
+                if before_update is None:
+                    raise exception.NotFoundError(rid=str(rid))
+                return before_update, after_update
+            except sqlalchemy.exc.IntegrityError as e:
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                LOG.exception(e)
+                raise exception.DBError(msg=_('unknown db error'))
+
+    def _delete_with_returning(self, rid):
+        table = self.orm_meta.__table__
+        with self.get_session() as session:
+            try:
+                with self._begin(session):
+                    if getattr(self.orm_meta, 'removed', None) is not None:
+                        resource, after = self._update_returning(session, rid, {'removed': datetime.datetime.now()})
+                    else:
+                        rid_binds, params = self._rid_params(rid)
+
+                        def build():
+                            target = self._before_image(session, rid_binds, lock=False)
+                            condition = sqlalchemy.and_(*[table.c[key] == target.c[key]
+                                                          for key in self._primary_key_names()])
+                            return self._returning(table.delete().where(condition))
+
+                        row = self._execute_write(session, 'delete', (), build, params)
+                        resource = self._returning_dicts([row])[0] if row is not None else None
+                    count = 0 if resource is None else 1
+                    if count:
+                        self._mark_changed(session, rid)
+                return count, [resource]
+            except sqlalchemy.exc.IntegrityError as e:
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
             except sqlalchemy.exc.SQLAlchemyError as e:
                 LOG.exception(e)
                 raise exception.DBError(msg=_('unknown db error'))
 
     def update(self, rid, resource):
+        if self._sharded():
+            shard = self._locate(rid)
+            if shard is None:
+                raise exception.NotFoundError(rid=str(rid))
+            if resource and self._shard_key in resource and self._data_shard(resource) != shard:
+                raise exception.ValidationError(message=utils.format_kwstring(
+                    _('shard key %(key)s can not move a resource to another shard'), key=self._shard_key))
+            return self._on_shard(shard).update(rid, resource)
+        if self._write_engine == 'returning':
+            return self._update_with_returning(rid, resource)
         with self.transaction() as session:
             try:
                 query = self._get_query(session)
@@ -315,14 +1967,23 @@ class ResourceBase(object):
                         record.update(orm_fields)
                     session.flush()
                     after_update = record.to_dict()
+                    self._mark_changed(session, rid)
                 return before_update, after_update
             except sqlalchemy.exc.IntegrityError as e:
-                print(e)
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
             except sqlalchemy.exc.SQLAlchemyError as e:
                 LOG.exception(e)
                 raise exception.DBError(msg=_('unknown db error'))
 
     def delete(self, rid):
+        if self._sharded():
+            shard = self._locate(rid)
+            if shard is None:
+                return 0, [None]
+            return self._on_shard(shard).delete(rid)
+        if self._write_engine == 'returning':
+            return self._delete_with_returning(rid)
         with self.transaction() as session:
             try:
                 query = self._get_query(session, orders=[])
@@ -338,9 +1999,12 @@ class ResourceBase(object):
                 else:
                     count = query.delete()
                 session.flush()
+                if count:
+                    self._mark_changed(session, rid)
                 return count, [resource]
             except sqlalchemy.exc.IntegrityError as e:
-                print(e)
+                LOG.exception(e)
+                raise exception.ConflictError(msg=self._error_message(e))
             except sqlalchemy.exc.SQLAlchemyError as e:
                 LOG.exception(e)
                 raise exception.DBError(msg=_('unknown db error'))
\ No newline at end of file
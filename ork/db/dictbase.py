@@ -103,10 +103,17 @@ class DictBase(ModelBase):
     attributes = []
     detail_attributes = []
     summary_attributes = []
+    # 大字段(如JSONB)，列表查询时默认不加载，list/summary级别也不输出，除非显式指定
+    deferred_attributes = []
+    # 可搜索的列，支持name__search=过滤，建表时创建对应的索引；
+    # search_method为trigram时使用pg_trgm的GIN索引，支持任意子串，tsvector时使用全文检索表达式索引，按词前缀匹配
+    searchable = []
+    search_method = 'trigram'
 
     def list_columns(self):
         """默认list级别的属性列表，自身作为主资源时的属性值，默认不带有relationship"""
-        return self.attributes or [key for key, value in self]
+        columns = self.attributes or [key for key, value in self._iter_undeferred()]
+        return [column for column in columns if column not in self.deferred_attributes]
 
     def get_columns(self):
         """默认get级别的详细属性列表，即自身作为主资源且尽量详细时的属性值，默认带有relationship"""
@@ -114,7 +121,15 @@ class DictBase(ModelBase):
 
     def sum_columns(self):
         """默认summary级别的属性列表，即被其他资源引用时能展示的属性值，默认不带有relationship"""
-        return self.summary_attributes or [key for key, value in self]
+        columns = self.summary_attributes or [key for key, value in self._iter_undeferred()]
+        return [column for column in columns if column not in self.deferred_attributes]
+
+    def _iter_undeferred(self):
+        """枚举列:值，跳过延迟加载的列，避免为了获取列名而触发加载"""
+        columns = [column for column in dict(object_mapper(self).columns).keys()
+                   if column not in self.deferred_attributes]
+        columns.extend(self._extra_keys)
+        return ModelIterator(self, iter(columns))
 
     def _convert_flat_dict(self, data, prefix=None, separator='.'):
         flat_data = {}
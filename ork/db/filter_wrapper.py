@@ -10,6 +10,8 @@ from __future__ import absolute_import
 
 import re
 
+import six
+import sqlalchemy
 from sqlalchemy.sql.expression import BinaryExpression
 from sqlalchemy.sql.sqltypes import _type_map
 
@@ -18,6 +20,26 @@ from ..core import utils
 RE_CIDR = re.compile(r'^(\d{1,3}\.){0,3}\d{1,3}/\d{1,2}$')
 RE_IP = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
 RE_CIDR_LIKE = re.compile(r'^(\d{1,3}|\d{1,3}\.\d{1,3}|\d{1,3}\.\d{1,3}\.\d{1,3})(\.)?(/\d{1,2})?$')
+RE_LIKE_ESCAPE = re.compile(r'([\\%_])')
+RE_WORD = re.compile(r'\w+', re.UNICODE)
+# 全文检索使用的配置，simple不做词干提取，适合名称类的列
+TSVECTOR_CONFIG = 'simple'
+
+
+def _search_config():
+    # 配置需要是常量才能匹配表达式索引，不能使用绑定参数
+    return sqlalchemy.text("'%s'::regconfig" % TSVECTOR_CONFIG)
+
+
+def search_vector(column):
+    """
+    全文检索的tsvector表达式，过滤条件与索引必须使用相同的表达式
+    :param column: 列
+    :type column: Column
+    :returns: to_tsvector表达式
+    :rtype: Function
+    """
+    return sqlalchemy.func.to_tsvector(_search_config(), column)
 
 
 def merge(filters, filters_to_merge):
@@ -72,6 +94,19 @@ def column_from_expression(table, expression):
     return column
 
 
+def split_values(value):
+    """
+    in、nin条件的值：字符串按逗号分隔为多个值(如city_id__in=c1,c2)，其他值不变
+    :param value: 条件值
+    :type value: any
+    :returns: 值列表或者原值
+    :rtype: list
+    """
+    if isinstance(value, six.string_types) and ',' in value:
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return value
+
+
 def cast(column, value):
     """
     将python类型值转换为SQLAlchemy类型值
@@ -89,6 +124,17 @@ def cast(column, value):
 
 
 class Filter(object):
+    """
+    过滤器无状态，每个过滤器类只创建一个实例
+    """
+    _instances = {}
+
+    def __new__(cls, *args, **kwargs):
+        instance = Filter._instances.get(cls)
+        if instance is None:
+            instance = Filter._instances.setdefault(cls, super(Filter, cls).__new__(cls))
+        return instance
+
     def make_empty_query(self, query, column):
         query = query.filter(column == None)
         query = query.filter(column != None)
@@ -106,6 +152,7 @@ class Filter(object):
         return query
 
     def op_in(self, query, column, value):
+        value = split_values(value)
         if utils.is_list_type(value):
             if isinstance(column, BinaryExpression):
                 column = cast(column, value[0])
@@ -117,6 +164,7 @@ class Filter(object):
         return query
 
     def op_nin(self, query, column, value):
+        value = split_values(value)
         if utils.is_list_type(value):
             if isinstance(column, BinaryExpression):
                 column = cast(column, value[0])
@@ -199,6 +247,49 @@ class Filter(object):
         query = query.filter(column.ilike('%%%s' % value))
         return query
 
+    def op_search(self, query, column, value):
+        """
+        子串搜索(不区分大小写)，使用pg_trgm的GIN索引，相关度见rank_search
+        """
+        value = utils.ensure_unicode(value)
+        pattern = '%%%s%%' % RE_LIKE_ESCAPE.sub(r'\\\1', value)
+        return query.filter(column.ilike(pattern, escape='\\'))
+
+    def rank_search(self, column, value):
+        """
+        op_search的相关度：相似度，只用于列表查询的排序，不影响过滤以及统计
+        :returns: 相关度表达式
+        :rtype: Function
+        """
+        return sqlalchemy.func.similarity(column, utils.ensure_unicode(value))
+
+    @staticmethod
+    def _tsquery(value):
+        words = RE_WORD.findall(utils.ensure_unicode(value))
+        if not words:
+            return None
+        return sqlalchemy.func.to_tsquery(_search_config(), ' & '.join("'%s':*" % word for word in words))
+
+    def op_tsearch(self, query, column, value):
+        """
+        全文检索，每个词按前缀匹配，使用to_tsvector表达式的GIN索引，相关度见rank_tsearch
+        """
+        tsquery = self._tsquery(value)
+        if tsquery is None:
+            return query
+        return query.filter(search_vector(column).op('@@')(tsquery))
+
+    def rank_tsearch(self, column, value):
+        """
+        op_tsearch的相关度：ts_rank，没有可检索的词时为None
+        :returns: 相关度表达式
+        :rtype: Function
+        """
+        tsquery = self._tsquery(value)
+        if tsquery is None:
+            return None
+        return sqlalchemy.func.ts_rank(search_vector(column), tsquery)
+
 
 class FilterNetwork(Filter):
     """
@@ -279,7 +370,7 @@ class FilterNetwork(Filter):
         return query
 
     def op_in(self, query, column, value):
-        value = self.validate_cidr(value)
+        value = self.validate_cidr(split_values(value))
         if not value:
             return self.make_empty_query(query, column)
         if utils.is_list_type(value):
@@ -296,7 +387,7 @@ class FilterNetwork(Filter):
         return query
 
     def op_nin(self, query, column, value):
-        value = self.validate_cidr(value)
+        value = self.validate_cidr(split_values(value))
         if not value:
             return self.make_empty_query(query, column)
         if utils.is_list_type(value):
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/27 10:20
+# @File    : instrument.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    connection pool statistics (per worker) and adaptive checkout limit
+"""
+from __future__ import absolute_import
+
+import collections
+import logging
+import threading
+import time
+
+import sqlalchemy.exc
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+LOG = logging.getLogger(__name__)
+
+# 每个连接池保留的不同路由数，超过时计入OTHER_ROUTE
+MAX_ROUTES = 128
+OTHER_ROUTE = 'other'
+UNKNOWN_ROUTE = 'unknown'
+
+
+class RouteSession(Session):
+    """
+    会话获取连接时把会话的路由(info['route'])以及记录语句耗时的列表(info['queries'])记录到连接上，
+    归还连接时按路由统计占用时间，语句执行后把耗时追加到列表中；
+    autocommit会话不经过SessionTransaction，after_begin事件不会触发，因此在获取连接处记录
+    """
+
+    def _connection_for_bind(self, engine, execution_options=None, **kw):
+        connection = super(RouteSession, self)._connection_for_bind(engine, execution_options, **kw)
+        info = self.info
+        if info:
+            if 'route' in info:
+                connection.info['route'] = info['route']
+            if 'queries' in info:
+                connection.info['queries'] = info['queries']
+        return connection
+
+
+class PoolStats(object):
+    """
+    连接池统计：检出等待时间、超时、占用数/溢出数峰值、按请求路由的连接占用时间，
+    占用时间以及新建连接由连接池事件记录，等待时间由InstrumentedQueuePool记录
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.peak_checkedout = 0
+        self.peak_overflow = 0
+        self.routes = {}
+        # 同一engine上的异步连接池(aio.AsyncPool)，不经过QueuePool，单独统计
+        self.async_pool = None
+        # 自适应调整使用的统计窗口
+        self._window = [0, 0.0, 0, 0]
+
+    def install(self):
+        event.listen(self.engine, 'connect', self._on_connect)
+        event.listen(self.engine, 'checkout', self._on_checkout)
+        event.listen(self.engine, 'checkin', self._on_checkin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    @staticmethod
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checkout_at'] = time.time()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        info = connection_record.info
+        info.pop('queries', None)
+        checkout_at = info.pop('checkout_at', None)
+        route = info.pop('route', None) or UNKNOWN_ROUTE
+        if checkout_at is None:
+            return
+        hold_time = time.time() - checkout_at
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                if len(self.routes) >= MAX_ROUTES:
+                    route = OTHER_ROUTE
+                stats = self.routes.setdefault(route, {'checkouts': 0, 'hold_time_total': 0.0,
+                                                       'hold_time_max': 0.0})
+            stats['checkouts'] += 1
+            stats['hold_time_total'] += hold_time
+            stats['hold_time_max'] = max(stats['hold_time_max'], hold_time)
+
+    def record_checkout(self, wait_time, checkedout, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            if wait_time > self.wait_time_max:
+                self.wait_time_max = wait_time
+            if checkedout > self.peak_checkedout:
+                self.peak_checkedout = checkedout
+            if overflow > self.peak_overflow:
+                self.peak_overflow = overflow
+            window = self._window
+            window[0] += 1
+            window[1] += wait_time
+            if checkedout > window[3]:
+                window[3] = checkedout
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+            self._window[2] += 1
+
+    def window(self):
+        """
+        获取并重置统计窗口
+        :returns: (检出次数, 等待时间合计, 超时次数, 占用数峰值)
+        :rtype: tuple
+        """
+        with self._lock:
+            window = tuple(self._window)
+            self._window = [0, 0.0, 0, self.engine.pool.checkedout()]
+        return window
+
+    def async_reserved(self):
+        """
+        异步连接池尚未建立但随时可能建立的连接数
+        """
+        return self.async_pool.reserved() if self.async_pool is not None else 0
+
+    def stats(self):
+        pool = self.engine.pool
+        async_stats = self.async_pool.stats() if self.async_pool is not None else None
+        with self._lock:
+            result = {'name': self.engine.url.__to_string__(hide_password=True), 'size': pool.size(),
+                      'max_overflow': pool._max_overflow, 'limit': getattr(pool, 'limit', None),
+                      'checkedout': pool.checkedout(), 'idle': pool.checkedin(),
+                      'overflow': max(pool.overflow(), 0), 'peak_checkedout': self.peak_checkedout,
+                      'peak_overflow': self.peak_overflow, 'checkouts': self.checkouts, 'connects': self.connects,
+                      'timeouts': self.timeouts, 'wait_time_total': self.wait_time_total,
+                      'wait_time_max': self.wait_time_max, 'async': async_stats,
+                      'routes': dict((route, dict(value)) for route, value in self.routes.items())}
+        return result
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    记录检出等待时间、占用数以及超时的QueuePool(连接池事件不包含等待开始的时间点)；
+    limit不为None时同时检出的连接数不超过limit，用于自适应地调整有效并发数，
+    超过时按先后顺序等待其他连接归还(归还的名额直接交给最早的等待者，避免归还后立即再次检出的线程
+    一直占用名额)，最多等待pool_timeout秒；limit需要在使用连接池之前设置
+    """
+
+    def __init__(self, creator, **kw):
+        super(InstrumentedQueuePool, self).__init__(creator, **kw)
+        self.stats = None
+        self.limit = None
+        self._slots = threading.Lock()
+        self._waiters = collections.deque()
+        self._in_use = 0
+
+    def recreate(self):
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.stats = self.stats
+        pool.limit = self.limit
+        return pool
+
+    def set_limit(self, limit):
+        with self._slots:
+            self.limit = limit
+            while self._waiters and self._in_use < limit:
+                self._in_use += 1
+                self._waiters.popleft().set()
+
+    def _acquire_slot(self, started):
+        with self._slots:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(self._timeout - (time.time() - started)):
+            return
+        with self._slots:
+            # 超时的同时被分配了名额
+            if waiter.is_set():
+                return
+            self._waiters.remove(waiter)
+        raise sqlalchemy.exc.TimeoutError('QueuePool limit of %d reached, connection timed out, timeout %d' %
+                                          (self.limit, self._timeout))
+
+    def _release_slot(self):
+        with self._slots:
+            if self._waiters and self._in_use <= self.limit:
+                # 名额直接交给最早的等待者，占用数不变
+                self._waiters.popleft().set()
+            else:
+                self._in_use -= 1
+
+    def _do_get(self):
+        started = time.time()
+        limited = self.limit is not None
+        try:
+            if limited:
+                self._acquire_slot(started)
+            try:
+                record = super(InstrumentedQueuePool, self)._do_get()
+            except Exception:
+                if limited:
+                    self._release_slot()
+                raise
+        except sqlalchemy.exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.record_timeout()
+            raise
+        if self.stats is not None:
+            # 等待时间包含连接池中没有空闲连接时新建连接的时间
+            overflow = self._overflow
+            self.stats.record_checkout(time.time() - started, self._pool.maxsize - self._pool.qsize() + overflow,
+                                       max(overflow, 0))
+        return record
+
+    def _do_return_conn(self, conn):
+        try:
+            super(InstrumentedQueuePool, self)._do_return_conn(conn)
+        finally:
+            if self.limit is not None:
+                self._release_slot()
+
+
+# 数据库服务端剩余可用的连接数(不含超级用户保留的连接)，查询使用的连接本身不计入
+_HEADROOM_SQL = """
+SELECT current_setting('max_connections')::int - current_setting('superuser_reserved_connections')::int
+       - (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'client backend') + 1
+"""
+
+
+class AdaptiveLimit(object):
+    """
+    按检出等待时间与数据库剩余连接数调整连接池的limit：
+    等待超过目标或出现超时且剩余连接充足时增加(不超过剩余连接按worker数平分的份额)，
+    剩余连接不足reserve时每个worker都减少，空闲时逐个减少，limit始终在[min_size, max_size]之内
+    """
+
+    def __init__(self, min_size, max_size, workers=1, target_wait=0.005, reserve=5):
+        self.min_size = max(min_size, 1)
+        self.max_size = max(max_size, self.min_size)
+        self.workers = max(workers, 1)
+        self.target_wait = target_wait
+        self.reserve = reserve
+
+    @staticmethod
+    def headroom(engine):
+        """
+        查询数据库剩余可用的连接数，使用连接池之外的连接，连接池占满(正需要扩大)时也可以查询
+        :returns: 剩余连接数
+        :rtype: int
+        """
+        args, kwargs = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.dbapi.connect(*args, **kwargs)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(_HEADROOM_SQL)
+            return int(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def next_limit(self, limit, window, headroom):
+        """
+        计算新的limit
+        :param limit: 当前limit
+        :type limit: int
+        :param window: 统计窗口(检出次数, 等待时间合计, 超时次数, 占用数峰值)
+        :type window: tuple
+        :param headroom: 数据库剩余可用的连接数
+        :type headroom: int
+        :returns: 新的limit
+        :rtype: int
+        """
+        checkouts, wait_total, timeouts, peak = window
+        mean_wait = wait_total / checkouts if checkouts else 0.0
+        if headroom <= self.reserve:
+            limit -= 1
+        elif timeouts or mean_wait > self.target_wait:
+            share = (headroom - self.reserve) // self.workers
+            if share > 0:
+                limit += min(share, max(limit // 4, 1))
+        elif peak < limit - 1:
+            limit -= 1
+        return min(max(limit, self.min_size), self.max_size)
+
+    def adjust(self, engine):
+        """
+        根据上一个统计窗口调整engine连接池的limit
+        :returns: 调整后的limit
+        :rtype: int
+        """
+        pool = engine.pool
+        window = pool.stats.window()
+        try:
+            # 异步连接池已建立的连接已计入数据库的连接数，尚未建立的部分需要预留
+            headroom = self.headroom(engine) - pool.stats.async_reserved()
+        except engine.dialect.dbapi.Error as e:
+            LOG.warning('failed to get database connection headroom: %s', e)
+            return pool.limit
+        limit = self.next_limit(pool.limit, window, headroom)
+        if limit != pool.limit:
+            LOG.info('connection limit of %s: %d -> %d (checkouts %d, wait %.3fs, timeouts %d, headroom %d)',
+                     engine.url.__to_string__(hide_password=True), pool.limit, limit, window[0], window[1],
+                     window[2], headroom)
+            pool.set_limit(limit)
+        return limit
@@ -11,14 +11,18 @@ from __future__ import absolute_import
 from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
 from sqlalchemy import Column
+from sqlalchemy import DDL
 from sqlalchemy import DateTime
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
+from sqlalchemy import event
 from sqlalchemy import text
 from sqlalchemy.dialects.postgresql.json import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 
 from ..db.dictbase import DictBase
+from ..db.filter_wrapper import search_vector
 from ..db.validator import Validate
 from ..db.validator import declarative_constructor
 
@@ -27,6 +31,32 @@ Validate(Base)
 metadata = Base.metadata
 
 
+@event.listens_for(Base, 'instrument_class', propagate=True)
+def _add_search_indexes(mapper, cls):
+    """
+    为Model声明的可搜索列创建检索索引
+    """
+    table = getattr(cls, '__table__', None)
+    if table is None:
+        return
+    for name in getattr(cls, 'searchable', None) or []:
+        if cls.search_method == 'tsvector':
+            Index('ix_%s_%s_tsv' % (table.name, name), search_vector(table.c[name]), postgresql_using='gin')
+        else:
+            Index('ix_%s_%s_trgm' % (table.name, name), table.c[name], postgresql_using='gin',
+                  postgresql_ops={name: 'gin_trgm_ops'})
+
+
+def _uses_trigram(ddl, target, bind, **kwargs):
+    return any(cls.search_method == 'trigram' and getattr(cls, 'searchable', None)
+               for cls in Base._decl_class_registry.values() if hasattr(cls, '__table__'))
+
+
+# trigram索引依赖pg_trgm扩展
+event.listen(metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql', callable_=_uses_trigram))
+
+
 def get_names():
     """
     获取所有Model类名
@@ -86,6 +116,7 @@ class City(Base, DictBase):
     __tablename__ = 'city'
 
     attributes = ['uuid', 'id', 'name']
+    searchable = ['name']
 
     uuid = Column(String(63), primary_key=True)
     id = Column(String(63), nullable=False)
@@ -96,12 +127,16 @@ class Line(Base, DictBase):
     __tablename__ = 'line'
 
     attributes = ['uuid', 'id', 'name', 'city_id']
+    searchable = ['name']
 
     uuid = Column(String(63), primary_key=True)
     id = Column(Integer, nullable=False)
     name = Column(String(255), nullable=False)
     city_id = Column(String(63), nullable=False)
 
+    # 线路编号在城市内唯一，包含分片键，在每个分片上同样成立
+    __table_args__ = (Index('ux_line_city_id_id', 'city_id', 'id', unique=True),)
+
 
 class SysRelationship(Base, DictBase):
     """动态关系模型"""
@@ -126,6 +161,7 @@ class SysRelationship(Base, DictBase):
 class SysOperationLog(Base, DictBase):
     __tablename__ = 'sys_operation_log'
     attributes = ['resource', 'tenant_uuid', 'user_name', 'operation', 'operate_time', 'data_before', 'data_after']
+    deferred_attributes = ['data_before', 'data_after']
 
     id = Column(BigInteger, primary_key=True, server_default=text("nextval('sys_operation_log_id_seq'::regclass)"))
     resource = Column(String(127), index=True, nullable=False)
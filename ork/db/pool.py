@@ -8,12 +8,160 @@
 
 from __future__ import absolute_import
 
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+
+import six
 import sqlalchemy
+import sqlalchemy.exc
+from concurrent import futures
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 
 from ..core.config import CONF
 from ..core import decorators as deco
+from ..core import utils
+from ..db import instrument
+from ..db import prepared
+from ..db import telemetry
+
+
+LOG = logging.getLogger(__name__)
+
+# 副本的复制延迟(秒)，主库或者已回放全部WAL的副本为0
+_LAG_SQL = sqlalchemy.text("""
+SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+""")
+_PING_SQL = sqlalchemy.text('SELECT 1')
+
+
+def _record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    """
+    检出时丢弃从父进程继承的连接：只解除引用而不关闭，关闭会终止父进程以及其他worker共享的后端连接，
+    DisconnectionError使连接池重新建立连接
+    """
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise sqlalchemy.exc.DisconnectionError(
+            'connection record belongs to pid %s, attempting to check out in pid %s' %
+            (connection_record.info['pid'], pid))
+
+
+def _record_idle(dbapi_connection, connection_record):
+    # 健康检查跳过的连接保留原来的空闲起始时间
+    if not connection_record.info.pop('ping_skipped', False):
+        connection_record.info['idle_since'] = time.time()
+
+
+class Replica(object):
+    """
+    只读副本，复制延迟由后台线程每check_interval秒检查一次，请求只读取检查的结果；
+    检查失败、连接断开或者延迟超过阈值时不参与读取，直到下一次检查恢复
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.session_maker = sessionmaker(bind=engine, autocommit=True, class_=instrument.RouteSession)
+        self.healthy = True
+        self.lag = None
+        self.checked_at = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+        sqlalchemy.event.listen(engine, 'handle_error', self._handle_error)
+
+    @property
+    def name(self):
+        return self.engine.url.__to_string__(hide_password=True)
+
+    @property
+    def load(self):
+        """当前进程中正在使用的连接数"""
+        return self.engine.pool.checkedout()
+
+    def _handle_error(self, context):
+        if context.is_disconnect:
+            self.healthy = False
+
+    def check(self):
+        """
+        检查复制延迟，其他线程正在检查时直接返回；在后台线程中执行，副本不可用时最多等待连接超时
+        """
+        if not self._lock.acquire(False):
+            return
+        try:
+            self.checked_at = time.time()
+            connection = self.engine.connect()
+            try:
+                self.lag = float(connection.execute(_LAG_SQL).scalar())
+            finally:
+                connection.close()
+            self.healthy = True
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            LOG.warning('replica %s is unavailable: %s', self.name, e)
+            self.healthy = False
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'name': self.name, 'healthy': self.healthy, 'lag': self.lag, 'load': self.load, 'reads': self.reads}
+
+
+class ShardRouter(object):
+    """
+    分片路由，按分片键的值(crc32取模)映射到分片数据库，分片数量变化时需要迁移数据
+    """
+
+    def __init__(self, engines, workers):
+        self.engines = engines
+        self.session_makers = [sessionmaker(bind=engine, autocommit=True, class_=instrument.RouteSession)
+                               for engine in engines]
+        self.workers = workers
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self.engines)
+
+    def shard_for(self, value):
+        """
+        获取分片键的值所在的分片，数字与其文本形式(如CSV导入的值)映射到同一个分片
+        :param value: 分片键的值
+        :type value: any
+        :returns: 分片序号
+        :rtype: int
+        """
+        return (zlib.crc32(utils.ensure_bytes(six.text_type(value))) & 0xffffffff) % len(self.engines)
+
+    def map(self, func, shards):
+        """
+        并行地在多个分片上执行func(shard)，按shards的顺序返回结果，任一分片失败时抛出其异常
+        :param func: 执行函数
+        :type func: callable
+        :param shards: 分片序号列表
+        :type shards: list
+        :returns: 结果列表
+        :rtype: list
+        """
+        if len(shards) <= 1:
+            return [func(shard) for shard in shards]
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = futures.ThreadPoolExecutor(max_workers=self.workers)
+                    self._executor_pid = os.getpid()
+        return [future.result() for future in [self._executor.submit(func, shard) for shard in shards]]
 
 
 @deco.singleton
@@ -21,32 +169,342 @@ class DBPool(object):
 
     def __init__(self, param=None, connecter='psycopg2'):
         self._pool = None
+        self._replicas = []
+        # 副本允许的最大复制延迟(秒)
+        self.max_lag = 5
+        # 副本复制延迟的检查间隔(秒)
+        self.check_interval = 5
+        # 客户端写入后多少秒内的读取使用主库，0表示不启用
+        self.read_your_writes = 0
+        # 分片路由，配置了分片(shards)时有效，只用于声明了分片键的资源
+        self.router = None
+        # 创建engine的进程，fork之后的worker需要重新创建
+        self.pid = None
+        # worker接受请求之前每个engine预先建立的连接数
+        self.warmup_size = 0
+        # 后台连接存活检查的间隔(秒)，0表示不检查
+        self.health_check_interval = 0
+        # 后台检查只检查空闲超过多少秒的连接，期间归还过的连接不检查
+        self.check_idle = 0
+        # 自适应调整连接池有效并发数，未启用时为None
+        self.adaptive = None
+        # 自适应调整的间隔(秒)
+        self.adaptive_interval = 5
+        # 每个engine的异步连接池的连接数，在同步连接池(pool_size + max_overflow)之外
+        self.aio_pool_size = 10
+        self._param = None
+        self._connecter = connecter
+        # 后台线程的停止事件，{名称: Event}
+        self._background = {}
         if param:
             self.reflesh(param=param, connecter=connecter)
 
-    def get_session(self):
+    @property
+    def engine(self):
         if self._pool:
-            session = scoped_session(self._pool)
+            return self._pool.kw['bind']
+        raise ValueError('database pool is not initialized')
+
+    @property
+    def replicas(self):
+        return list(self._replicas)
+
+    def engines(self):
+        """
+        获取当前进程的全部engine：主库、副本以及分片
+        :returns: engine列表
+        :rtype: list
+        """
+        engines = [self.engine] if self._pool else []
+        engines.extend(replica.engine for replica in self._replicas)
+        if self.router is not None:
+            engines.extend(self.router.engines)
+        return engines
+
+    def _session_maker(self, shard=None):
+        if shard is not None:
+            return self.router.session_makers[shard]
+        return self._pool
+
+    def get_session(self, shard=None):
+        maker = self._session_maker(shard)
+        if maker:
+            session = scoped_session(maker)
             return session
         raise ValueError('failed to get session')
 
-    def transaction(self):
-        if self._pool:
-            session = scoped_session(self._pool)
+    def get_read_session(self, shard=None):
+        """
+        获取只读会话，配置了副本时使用延迟未超过阈值的副本中正在使用连接数最少的一个，
+        没有可用副本时使用主库；指定分片时使用分片数据库
+        """
+        if shard is not None:
+            return self.get_session(shard)
+        replica = self._choose_replica()
+        if replica is None:
+            return self.get_session()
+        return scoped_session(replica.session_maker)
+
+    def read_engine(self):
+        """
+        获取只读查询使用的engine，副本的选择与get_read_session一致，没有可用副本时为主库
+        :returns: engine
+        :rtype: Engine
+        """
+        replica = self._choose_replica()
+        if replica is None:
+            return self.engine
+        return replica.engine
+
+    def _choose_replica(self):
+        # 只读取后台线程检查的结果，尚未检查过的副本不参与读取
+        candidates = []
+        for replica in self._replicas:
+            if replica.healthy and replica.lag is not None and replica.lag <= self.max_lag:
+                candidates.append(replica)
+        if not candidates:
+            return None
+        least = min(replica.load for replica in candidates)
+        replica = random.choice([replica for replica in candidates if replica.load == least])
+        replica.reads += 1
+        return replica
+
+    def transaction(self, shard=None):
+        maker = self._session_maker(shard)
+        if maker:
+            session = scoped_session(maker)
             session.begin()
             return session
         raise ValueError('failed to get session')
 
-    def refresh(self, param, connecter='psycopg2'):
-        connection = param['connection']
-        self._pool = sessionmaker(bind=sqlalchemy.create_engine(
+    def replica_stats(self):
+        """
+        获取副本状态
+        :returns: [{'name': url, 'healthy': healthy, 'lag': seconds, 'load': checkedout, 'reads': reads}]
+        :rtype: list
+        """
+        return [replica.stats() for replica in self._replicas]
+
+    def pool_stats(self):
+        """
+        获取当前worker进程各engine的连接池统计
+        :returns: [{'name': url, 'size': size, 'limit': limit, 'checkedout': n, 'wait_time_total': seconds,
+                   'timeouts': n, 'routes': {route: {'checkouts': n, 'hold_time_total': seconds}}, ...}]
+        :rtype: list
+        """
+        return [engine.pool.stats.stats() for engine in self.engines()]
+
+    @staticmethod
+    def _create_engine(connection, param):
+        engine = sqlalchemy.create_engine(
             connection,
+            poolclass=instrument.InstrumentedQueuePool,
             pool_size=param.get('pool_size', 10),
             pool_recycle=param.get('pool_recycle', 600),
             pool_timeout=param.get('pool_timeout', 15),
-            max_overflow=param.get('max_overflow', 10)),
-            autocommit=True)
+            max_overflow=param.get('max_overflow', 10))
+        sqlalchemy.event.listen(engine, 'connect', _record_pid)
+        sqlalchemy.event.listen(engine, 'checkout', _check_pid)
+        sqlalchemy.event.listen(engine, 'checkin', _record_idle)
+        engine.pool.stats = instrument.PoolStats(engine)
+        engine.pool.stats.install()
+        telemetry.install(engine)
+        return engine
+
+    @staticmethod
+    def _ping(engine, size):
+        """
+        同时检出size个连接(不超过连接池中可用的数量)并执行SELECT 1后归还，空闲连接不足时新建连接；
+        已断开的连接由SQLAlchemy作废整个连接池，此时重试一次以重新建立连接；
+        检出期间请求无法使用这些连接，只在worker接受请求之前预热时调用
+        :returns: 检查的连接数
+        :rtype: int
+        """
+        size = min(size, max(engine.pool.size() - engine.pool.checkedout(), 0))
+        for attempt in range(2):
+            connections = []
+            try:
+                for _ in range(size):
+                    connection = engine.connect()
+                    connections.append(connection)
+                    connection.scalar(_PING_SQL)
+                return len(connections)
+            except sqlalchemy.exc.DBAPIError as e:
+                if attempt or not e.connection_invalidated:
+                    LOG.warning('database %s is unavailable: %s', engine.url.__to_string__(hide_password=True), e)
+                    return 0
+            finally:
+                for connection in connections:
+                    connection.close()
+        return 0
+
+    @staticmethod
+    def _ping_idle(engine, idle_time):
+        """
+        逐个检出连接池中的空闲连接，空闲超过idle_time秒的执行SELECT 1后归还，同时最多占用一个连接；
+        连接池按先进先出检出，归还的连接排在最后，因此每个空闲连接检出一次；
+        已断开的连接由SQLAlchemy作废，之后检出时重新建立连接
+        :returns: 检查的连接数
+        :rtype: int
+        """
+        checked = 0
+        for _ in range(engine.pool.checkedin()):
+            try:
+                with engine.connect() as connection:
+                    info = connection.connection.info
+                    if time.time() - info.get('idle_since', 0) < idle_time:
+                        info['ping_skipped'] = True
+                        continue
+                    connection.scalar(_PING_SQL)
+                    checked += 1
+            except sqlalchemy.exc.DBAPIError as e:
+                if not e.connection_invalidated:
+                    LOG.warning('database %s is unavailable: %s', engine.url.__to_string__(hide_password=True), e)
+                    return checked
+            except sqlalchemy.exc.TimeoutError:
+                # 连接池已被请求占满
+                return checked
+        return checked
+
+    def warmup(self, size=None):
+        """
+        为每个engine预先建立连接，在worker接受请求之前调用，避免部署后的首批请求承担建立连接的延迟
+        :param size: 每个engine的连接数，默认为配置的warmup_size
+        :type size: int
+        :returns: 建立的连接总数
+        :rtype: int
+        """
+        size = self.warmup_size if size is None else size
+        if size <= 0:
+            return 0
+        return sum(self._ping(engine, size) for engine in self.engines())
+
+    def check(self):
+        """
+        逐个检查每个engine中空闲超过check_idle秒的连接，使请求不会检出已断开的连接
+        :returns: 检查的连接总数
+        :rtype: int
+        """
+        return sum(self._ping_idle(engine, self.check_idle) for engine in self.engines())
+
+    def check_replicas(self):
+        """
+        检查全部副本的复制延迟
+        """
+        for replica in self._replicas:
+            replica.check()
+
+    def adapt(self):
+        """
+        按上一个统计窗口的检出等待时间与数据库剩余连接数调整各engine连接池的有效并发数
+        :returns: 调整后的limit列表
+        :rtype: list
+        """
+        if self.adaptive is None:
+            return []
+        return [self.adaptive.adjust(engine) for engine in self.engines()]
+
+    def _start_background(self, name, interval, func, immediate=False):
+        if not interval or interval <= 0 or name in self._background:
+            return
+        stopped = threading.Event()
+
+        def _call():
+            try:
+                func()
+            except Exception as e:
+                LOG.exception('database %s failed: %s', name, e)
+
+        def _run():
+            if immediate:
+                _call()
+            while not stopped.wait(interval):
+                _call()
+
+        thread = threading.Thread(target=_run, name='ork-db-%s' % name)
+        thread.daemon = True
+        thread.start()
+        self._background[name] = stopped
+
+    def start_health_check(self, interval=None):
+        """
+        启动当前进程的后台连接存活检查线程，配置了副本时同时启动复制延迟检查线程(启动后立即检查一次)，
+        启用了自适应时同时启动调整线程，需要在fork之后调用
+        :param interval: 检查间隔(秒)，默认为配置的health_check_interval
+        :type interval: float
+        """
+        self._start_background('health-check', self.health_check_interval if interval is None else interval,
+                               self.check)
+        if self._replicas:
+            self._start_background('replica-lag', self.check_interval, self.check_replicas, immediate=True)
+        if self.adaptive is not None:
+            self._start_background('adaptive-limit', self.adaptive_interval, self.adapt)
+
+    def stop_health_check(self):
+        for stopped in self._background.values():
+            stopped.set()
+        self._background = {}
+
+    def dispose(self):
+        """
+        关闭当前进程的全部连接，在fork之前调用，子进程不会继承已打开的连接
+        """
+        self.stop_health_check()
+        for engine in self.engines():
+            engine.dispose()
+            if engine.pool.stats.async_pool is not None:
+                engine.pool.stats.async_pool.dispose()
+
+    def after_fork(self):
+        """
+        在fork之后的worker中按原有参数重新创建engine，已在当前进程中创建时不做处理
+        :returns: 是否重新创建
+        :rtype: bool
+        """
+        if self._param is None or self.pid == os.getpid():
+            return False
+        # 线程不会被fork继承，父进程的后台线程在子进程中不存在
+        self._background = {}
+        return self.refresh(self._param, self._connecter)
+
+    def refresh(self, param, connecter='psycopg2'):
+        self._param = param
+        self._connecter = connecter
+        self.pid = os.getpid()
+        self.warmup_size = param.get('pool_warmup', self.warmup_size)
+        self.health_check_interval = param.get('pool_check_interval', self.health_check_interval)
+        self.check_idle = param.get('pool_check_idle', self.health_check_interval)
+        self.aio_pool_size = param.get('aio_pool_size', param.get('pool_size', 10))
+        connection = param['connection']
+        prepared.CACHE_SIZE = param.get('prepared_cache_size', prepared.CACHE_SIZE)
+        self._pool = sessionmaker(bind=self._create_engine(connection, param), autocommit=True,
+                                  class_=instrument.RouteSession)
+        # 副本可以是连接字符串或者{'connection': 连接字符串}
+        self._replicas = [Replica(self._create_engine(
+            replica['connection'] if isinstance(replica, dict) else replica, param))
+            for replica in param.get('replicas') or []]
+        self.max_lag = param.get('replica_max_lag', self.max_lag)
+        self.check_interval = param.get('replica_check_interval', self.check_interval)
+        self.read_your_writes = param.get('read_your_writes', self.read_your_writes)
+        shards = param.get('shards') or []
+        # 每个阻塞线程的一次扇出最多同时使用每个分片的一个连接
+        self.router = ShardRouter([self._create_engine(shard, param) for shard in shards],
+                                  len(shards) * (param.get('pool_size', 10) + param.get('max_overflow', 10))
+                                  ) if shards else None
+        self.adaptive = None
+        if param.get('pool_adaptive'):
+            pool_size = param.get('pool_size', 10)
+            self.adaptive = instrument.AdaptiveLimit(
+                min_size=param.get('pool_adaptive_min', 1),
+                max_size=param.get('pool_adaptive_max') or pool_size + max(param.get('max_overflow', 10), 0),
+                workers=param.get('workers', 1),
+                target_wait=param.get('pool_adaptive_target_wait', 0.005),
+                reserve=param.get('pool_adaptive_reserve', 5))
+            self.adaptive_interval = param.get('pool_adaptive_interval', self.adaptive_interval)
+            # 从pool_size开始，在[min, max]之内调整
+            for engine in self.engines():
+                engine.pool.set_limit(min(max(pool_size, self.adaptive.min_size), self.adaptive.max_size))
         return True
 
 
-POOL = DBPool()
\ No newline at end of file
+POOL = DBPool()
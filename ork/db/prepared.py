@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/18 10:20
+# @File    : prepared.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    server side prepared statements keyed by query shape
+"""
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from ..core import utils
+from ..db import telemetry
+
+LOG = logging.getLogger(__name__)
+
+# 每个数据库连接最多缓存的预编译语句数量，由DBPool.refresh根据配置设置
+CACHE_SIZE = 64
+
+_INFO_KEY = 'ork.prepared'
+_PARAM_REGEX = re.compile(r'%\(([^)]+)\)s')
+_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+_LOCK = threading.Lock()
+
+
+def _incr(name):
+    with _LOCK:
+        _STATS[name] += 1
+
+
+def stats():
+    """
+    获取预编译语句缓存统计
+    :returns: {'hits': hits, 'misses': misses, 'evictions': evictions, 'size': size}
+    :rtype: dict
+    """
+    with _LOCK:
+        result = dict(_STATS)
+    result['size'] = CACHE_SIZE
+    return result
+
+
+def reset_stats():
+    with _LOCK:
+        for key in _STATS:
+            _STATS[key] = 0
+
+
+def compile_statement(statement, dialect):
+    """
+    将Core语句编译为SQL文本以及已经经过类型处理的参数
+    :param statement: Core语句
+    :type statement: Select
+    :param dialect: 数据库方言
+    :type dialect: Dialect
+    :returns: (sql, params)，sql为pyformat参数风格
+    :rtype: tuple
+    """
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    processors = compiled._bind_processors
+    for key, value in params.items():
+        if key in processors and value is not None:
+            params[key] = processors[key](value)
+    return compiled.string, params
+
+
+def _to_positional(sql):
+    """
+    将pyformat参数(%(name)s)转换为PostgreSQL的$n参数，同名参数使用同一个位置
+    :returns: (sql, 参数名列表)
+    :rtype: tuple
+    """
+    names = []
+
+    def _replace(matches):
+        name = matches.group(1)
+        if name not in names:
+            names.append(name)
+        return '$%d' % (names.index(name) + 1)
+
+    sql = _PARAM_REGEX.sub(_replace, sql)
+    # 不再经过驱动的参数格式化，还原转义的%
+    return sql.replace('%%', '%'), names
+
+
+def _statement_name(sql):
+    return 'ork_%s' % hashlib.md5(utils.ensure_bytes(sql)).hexdigest()[:20]
+
+
+def _connection_cache(connection):
+    # info随DBAPI连接存在，连接被回收或者失效重连时会被清空，与服务端的预编译语句生命周期一致
+    info = connection.connection.info
+    cache = info.get(_INFO_KEY)
+    if cache is None:
+        cache = collections.OrderedDict()
+        info[_INFO_KEY] = cache
+    return cache
+
+
+def _prepare(connection, sql):
+    """
+    确保当前连接上存在sql对应的预编译语句，返回语句名称以及参数名列表
+    """
+    cache = _connection_cache(connection)
+    entry = cache.get(sql)
+    if entry is not None:
+        # LRU: 命中的语句移到末尾
+        del cache[sql]
+        cache[sql] = entry
+        _incr('hits')
+        return entry
+    _incr('misses')
+    name = _statement_name(sql)
+    positional_sql, names = _to_positional(sql)
+    cursor = connection.connection.cursor()
+    try:
+        while len(cache) >= CACHE_SIZE:
+            evict_sql, (evict_name, _) = cache.popitem(last=False)
+            cursor.execute('DEALLOCATE %s' % evict_name)
+            _incr('evictions')
+        cursor.execute('PREPARE %s AS %s' % (name, positional_sql))
+    finally:
+        cursor.close()
+    entry = (name, names)
+    cache[sql] = entry
+    return entry
+
+
+def execute(connection, statement):
+    """
+    使用预编译语句执行Core语句，SQL文本相同(即资源、过滤的列与操作符、排序、是否分页一致)的查询
+    在同一个连接上只解析以及生成执行计划一次
+    :param connection: 数据库连接
+    :type connection: Connection
+    :param statement: Core语句
+    :type statement: Select
+    :returns: 结果行列表
+    :rtype: list
+    """
+    if CACHE_SIZE <= 0:
+        return connection.execute(statement).fetchall()
+    sql, params = compile_statement(statement, connection.dialect)
+    name, names = _prepare(connection, sql)
+    started = time.time()
+    rows = _execute(connection, name, names, params).fetchall()
+    # EXECUTE语句无法在其他连接上EXPLAIN，以原始SQL记录慢查询
+    telemetry.record_statement(sql, params, time.time() - started)
+    return rows
+
+
+def _execute(connection, name, names, params):
+    if not names:
+        return connection.execute('EXECUTE %s' % name)
+    values = dict(('p%d' % idx, params[param]) for idx, param in enumerate(names))
+    placeholders = ', '.join('%%(p%d)s' % idx for idx in range(len(names)))
+    return connection.execute('EXECUTE %s (%s)' % (name, placeholders), values)
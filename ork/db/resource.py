@@ -18,5 +18,5 @@ LOG = logging.getLogger(__name__)
 
 class SysOperationLog(ResourceBase):
     orm_meta = models.SysOperationLog
-    _default_order = ('+uuid',)
-    _primary_keys = 'uuid'
\ No newline at end of file
+    _default_order = ('+id',)
+    _primary_keys = 'id'
\ No newline at end of file
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/16 21:40
+# @File    : serializer.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    per-model precompiled json serializer
+"""
+from __future__ import absolute_import
+
+import datetime
+import operator
+import threading
+
+from json.encoder import encode_basestring_ascii
+from sqlalchemy import Boolean
+from sqlalchemy import Date
+from sqlalchemy import DateTime
+from sqlalchemy import Enum
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy.orm import class_mapper
+
+from ..core import utils
+
+LIST = 'list'
+DETAIL = 'detail'
+SUMMARY = 'summary'
+
+_ENCODER = utils.ComplexEncoder(separators=(',', ':'))
+_SERIALIZERS = {}
+_LOCK = threading.Lock()
+
+
+def _format_datetime(value):
+    # 与ComplexEncoder保持一致的输出格式：去掉微秒，带时区的值保留UTC偏移
+    return value.replace(microsecond=0).isoformat(' ')
+
+
+def _encode_string(value):
+    return encode_basestring_ascii(value)
+
+
+def _encode_integer(value):
+    return '%d' % value
+
+
+def _encode_boolean(value):
+    return 'true' if value else 'false'
+
+
+def _encode_datetime(value):
+    return '"%s"' % _format_datetime(value)
+
+
+def _encode_date(value):
+    return '"%s"' % value.isoformat()
+
+
+def _encode_any(value):
+    return _ENCODER.encode(value)
+
+
+def _enum_encoder(enum_class):
+    # 使用Python枚举类的Enum列读出的是枚举成员，输出其value
+    def _encode(value):
+        if isinstance(value, enum_class):
+            value = value.value
+        return _encode_any(value)
+
+    return _encode
+
+
+def dumps(value):
+    """
+    将任意python对象编码为紧凑的JSON文本，支持日期、日期+时间类型
+    :param value: 待编码对象
+    :type value: any
+    :returns: JSON文本
+    :rtype: str
+    """
+    return _ENCODER.encode(value)
+
+
+def jsonable(value):
+    """
+    将对象中的日期、日期+时间转换为字符串，使其可以直接被json编码或写入JSONB列，
+    用于替代json.loads(json.dumps(value, cls=ComplexEncoder))
+    :param value: 待转换对象
+    :type value: any
+    :returns: 转换后的对象
+    :rtype: any
+    """
+    if isinstance(value, dict):
+        return dict((k, jsonable(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return _format_datetime(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _column_encoder(column_type):
+    # Enum是String的子类，需要先判断
+    if isinstance(column_type, Enum) and column_type.enum_class is not None:
+        return _enum_encoder(column_type.enum_class)
+    if isinstance(column_type, String):
+        return _encode_string
+    if isinstance(column_type, Boolean):
+        return _encode_boolean
+    if isinstance(column_type, Integer):
+        return _encode_integer
+    if isinstance(column_type, DateTime):
+        return _encode_datetime
+    if isinstance(column_type, Date):
+        return _encode_date
+    return _encode_any
+
+
+def _relationship_encoder(level):
+    def _encode(value):
+        # 延迟导入，避免与dictbase循环引用
+        from ..db.dictbase import DictBase
+        if isinstance(value, DictBase):
+            return get_serializer(type(value), level).dumps(value)
+        if isinstance(value, (list, tuple, set)):
+            return '[' + ','.join(_encode(v) for v in value) + ']'
+        return _encode_any(value)
+
+    return _encode
+
+
+def _default_attributes(model):
+    mapper = class_mapper(model)
+    attrs = list(mapper.columns.keys())
+    extra_keys = getattr(model, '_extra_keys', None)
+    # _extra_keys默认为property，只有被声明为列表时才能在类级别获取
+    if utils.is_list_type(extra_keys):
+        attrs.extend(extra_keys)
+    return attrs
+
+
+def _level_attributes(model, level):
+    if level == DETAIL:
+        return model.detail_attributes or _default_attributes(model)
+    if level == SUMMARY:
+        attrs = model.summary_attributes or _default_attributes(model)
+    else:
+        attrs = model.attributes or _default_attributes(model)
+    # 延迟加载的列默认不出现在list/summary级别中
+    deferred = model.deferred_attributes
+    return [attr for attr in attrs if attr not in deferred]
+
+
+class Serializer(object):
+    """
+    由Model的属性列表以及列类型预先生成的序列化器，直接由行的值生成JSON文本，
+    不再经过to_dict以及json.dumps/json.loads的来回转换
+    """
+
+    def __init__(self, model, level=LIST, attributes=None):
+        self.model = model
+        self.level = level
+        mapper = class_mapper(model)
+        columns = dict((prop.key, prop.columns[0]) for prop in mapper.column_attrs)
+        relationships = set(mapper.relationships.keys())
+        # 自身作为主资源时，关联资源使用更低一级的属性
+        nested_level = LIST if level == DETAIL else SUMMARY
+        self.attributes = list(attributes if attributes is not None else _level_attributes(model, level))
+        self._fields = []
+        for attr in self.attributes:
+            if attr in columns:
+                encoder = _column_encoder(columns[attr].type)
+            elif attr in relationships:
+                encoder = _relationship_encoder(nested_level)
+            else:
+                encoder = _encode_any
+            self._fields.append(('%s:' % encode_basestring_ascii(attr), attr, operator.attrgetter(attr), encoder))
+
+    def dumps(self, record):
+        """
+        序列化ORM对象
+        :param record: ORM对象
+        :type record: DictBase
+        :returns: JSON文本
+        :rtype: str
+        """
+        # 已加载的列值直接从实例__dict__中读取，跳过属性描述符；未加载的(过期、延迟加载)仍走getattr
+        state = record.__dict__
+        parts = []
+        for prefix, attr, getter, encoder in self._fields:
+            value = state[attr] if attr in state else getter(record)
+            parts.append(prefix + ('null' if value is None else encoder(value)))
+        return '{' + ','.join(parts) + '}'
+
+    def dumps_row(self, row):
+        """
+        序列化按属性访问列值的行对象(如投影查询返回的命名元组)
+        :param row: 行对象
+        :type row: tuple
+        :returns: JSON文本
+        :rtype: str
+        """
+        parts = []
+        for prefix, _, getter, encoder in self._fields:
+            value = getter(row)
+            parts.append(prefix + ('null' if value is None else encoder(value)))
+        return '{' + ','.join(parts) + '}'
+
+    def dumps_mapping(self, row):
+        """
+        序列化字典/行对象，key为Model的属性名
+        :param row: 字典或者支持按key访问的行对象
+        :type row: dict
+        :returns: JSON文本
+        :rtype: str
+        """
+        parts = []
+        for prefix, attr, _, encoder in self._fields:
+            value = row[attr]
+            parts.append(prefix + ('null' if value is None else encoder(value)))
+        return '{' + ','.join(parts) + '}'
+
+
+def get_serializer(model, level=LIST, attributes=None):
+    """
+    获取Model对应级别的序列化器，每个Model每个级别(或者每组指定属性)只生成一次
+    :param model: Model类
+    :type model: class
+    :param level: list/detail/summary，分别对应to_dict/to_detail_dict/to_summary_dict
+    :type level: str
+    :param attributes: 指定输出的属性列表，用于列投影，指定时忽略level
+    :type attributes: list
+    :returns: 序列化器
+    :rtype: Serializer
+    """
+    if attributes is not None:
+        attributes = tuple(attributes)
+    key = (model, level, attributes)
+    serializer = _SERIALIZERS.get(key)
+    if serializer is None:
+        with _LOCK:
+            serializer = _SERIALIZERS.get(key)
+            if serializer is None:
+                serializer = Serializer(model, level, attributes=attributes)
+                _SERIALIZERS[key] = serializer
+    return serializer
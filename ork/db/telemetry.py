@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/25 15:30
+# @File    : telemetry.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    per resource filter/order usage counters and slow statement samples
+"""
+from __future__ import absolute_import
+
+import collections
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+LOG = logging.getLogger(__name__)
+
+# 是否统计过滤、排序的使用情况
+ENABLED = True
+# 慢查询阈值(秒)，<=0时不采样
+SLOW_THRESHOLD = 0.5
+# 保留的慢查询样本数(按SQL文本去重)，超过时淘汰耗时最短的样本
+MAX_SAMPLES = 20
+# 每个资源保留的不同查询组合数，避免被任意参数组合撑大
+MAX_SHAPES = 256
+# EXPLAIN ANALYZE会真实执行语句，限制其最长执行时间(毫秒)
+EXPLAIN_TIMEOUT = 30000
+
+_INFO_KEY = 'ork.telemetry'
+_LOCK = threading.Lock()
+_USAGE = {}
+_SAMPLES = {}
+_SELECT = re.compile(r'\s*select\b', re.IGNORECASE)
+
+
+def setup(enabled=None, slow_threshold=None, max_samples=None):
+    """
+    设置统计参数
+    :param enabled: 是否统计过滤、排序的使用情况
+    :type enabled: bool
+    :param slow_threshold: 慢查询阈值(秒)
+    :type slow_threshold: float
+    :param max_samples: 保留的慢查询样本数
+    :type max_samples: int
+    """
+    global ENABLED, SLOW_THRESHOLD, MAX_SAMPLES
+    if enabled is not None:
+        ENABLED = enabled
+    if slow_threshold is not None:
+        SLOW_THRESHOLD = slow_threshold
+    if max_samples is not None:
+        MAX_SAMPLES = max_samples
+
+
+def _new_usage():
+    return {'queries': 0, 'shapes': {}, 'filters': collections.Counter(), 'orders': collections.Counter()}
+
+
+def record_usage(orm_meta, filters, orders):
+    """
+    记录一次查询使用的过滤、排序组合，查询路径上只做一次计数，按列的统计在读取时汇总
+    :param orm_meta: ORM Model
+    :type orm_meta: class
+    :param filters: [(表达式, op), ...]，op为None表示默认的等于/in
+    :type filters: list
+    :param orders: [(表达式, '+'/'-'), ...]
+    :type orders: list
+    """
+    if not ENABLED:
+        return
+    shape = (tuple(filters), tuple(orders))
+    with _LOCK:
+        usage = _USAGE.get(orm_meta)
+        if usage is None:
+            usage = _USAGE[orm_meta] = _new_usage()
+        usage['queries'] += 1
+        shapes = usage['shapes']
+        if shape in shapes:
+            shapes[shape] += 1
+        elif len(shapes) < MAX_SHAPES:
+            shapes[shape] = 1
+        else:
+            # 组合数超过上限后只按列计数
+            usage['filters'].update(filters)
+            usage['orders'].update(field for field, _ in orders)
+
+
+def usage():
+    """
+    获取过滤、排序的使用统计的快照，过滤条件顺序不同的组合视为同一组合
+    :returns: {Model: {'queries': n, 'filters': Counter, 'orders': Counter, 'shapes': Counter}}
+    :rtype: dict
+    """
+    with _LOCK:
+        snapshot = [(orm_meta, value['queries'], list(value['shapes'].items()),
+                     collections.Counter(value['filters']), collections.Counter(value['orders']))
+                    for orm_meta, value in _USAGE.items()]
+    result = {}
+    for orm_meta, queries, shapes, filters, orders in snapshot:
+        merged = collections.Counter()
+        for (shape_filters, shape_orders), count in shapes:
+            merged[(tuple(sorted(shape_filters, key=lambda x: (x[0], x[1] or ''))), shape_orders)] += count
+            for item in shape_filters:
+                filters[item] += count
+            for field, _ in shape_orders:
+                orders[field] += count
+        result[orm_meta] = {'queries': queries, 'filters': filters, 'orders': orders, 'shapes': merged}
+    return result
+
+
+def _explainable(statement):
+    # 只采样普通的SELECT，WITH中可以包含写入(如WITH ... UPDATE ... RETURNING)，EXPLAIN ANALYZE会真实执行
+    return _SELECT.match(statement) is not None
+
+
+def record_statement(statement, parameters, duration):
+    """
+    记录一次语句执行，耗时超过阈值的查询语句作为慢查询样本保存，同一SQL文本只保留一个样本
+    :param statement: SQL文本(pyformat参数风格)
+    :type statement: str
+    :param parameters: 参数
+    :type parameters: dict
+    :param duration: 耗时(秒)
+    :type duration: float
+    """
+    if SLOW_THRESHOLD <= 0 or duration < SLOW_THRESHOLD or not _explainable(statement):
+        return
+    with _LOCK:
+        sample = _SAMPLES.get(statement)
+        if sample is None:
+            if len(_SAMPLES) >= MAX_SAMPLES:
+                fastest = min(_SAMPLES, key=lambda x: _SAMPLES[x]['max_duration'])
+                if _SAMPLES[fastest]['max_duration'] >= duration:
+                    return
+                del _SAMPLES[fastest]
+            sample = _SAMPLES[statement] = {'statement': statement, 'count': 0, 'total_duration': 0.0,
+                                            'max_duration': 0.0}
+        sample['count'] += 1
+        sample['total_duration'] += duration
+        if duration >= sample['max_duration']:
+            # 保留最慢一次的参数，EXPLAIN时复现该次执行
+            sample['max_duration'] = duration
+            sample['parameters'] = parameters
+            sample['last_seen'] = time.time()
+
+
+def samples():
+    """
+    获取慢查询样本，按最大耗时倒序
+    :returns: [{'statement': sql, 'parameters': params, 'count': n, 'total_duration': s, 'max_duration': s}]
+    :rtype: list
+    """
+    with _LOCK:
+        result = [dict(sample) for sample in _SAMPLES.values()]
+    result.sort(key=lambda x: x['max_duration'], reverse=True)
+    return result
+
+
+def explain(engine, sample):
+    """
+    使用EXPLAIN (ANALYZE, BUFFERS)获取慢查询样本的执行计划，在只读并且回滚的事务中执行
+    :param engine: 数据库engine
+    :type engine: Engine
+    :param sample: 慢查询样本
+    :type sample: dict
+    :returns: 执行计划文本
+    :rtype: str
+    """
+    connection = engine.connect()
+    try:
+        transaction = connection.begin()
+        try:
+            # 语句中的函数等可能写入，只读事务中执行时直接报错
+            connection.execute('SET TRANSACTION READ ONLY')
+            connection.execute('SET LOCAL statement_timeout = %d' % EXPLAIN_TIMEOUT)
+            result = connection.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sample['statement'],
+                                        sample.get('parameters') or {})
+            return '\n'.join(row[0] for row in result)
+        finally:
+            transaction.rollback()
+    finally:
+        connection.close()
+
+
+def reset():
+    """清空使用统计以及慢查询样本"""
+    with _LOCK:
+        _USAGE.clear()
+        _SAMPLES.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_INFO_KEY, []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get(_INFO_KEY)
+    if not started:
+        return
+    duration = time.time() - started.pop()
+    queries = conn.info.get('queries')
+    if queries is not None:
+        # 会话记录到连接上的当前请求的语句耗时列表
+        queries.append(duration)
+    if not executemany and isinstance(parameters, dict):
+        record_statement(statement, parameters, duration)
+
+
+def _handle_error(context):
+    started = context.connection.info.get(_INFO_KEY) if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def install(engine):
+    """
+    在engine上注册慢查询采样，耗时只在语句执行前后各记录一次时间
+    :param engine: 数据库engine
+    :type engine: Engine
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/19 15:05
+# @File    : versioning.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    per-table version counters shared by forked workers, used for ETag
+
+    the counters live in shared memory and are only visible to the workers of one host, every committed write
+    is also published on the cache NOTIFY channel and each worker bumps the counters when it receives one, so
+    writes made on other hosts change the ETag as well; the EPOCH is per host, ETags issued by one host never
+    match on another host
+"""
+from __future__ import absolute_import
+
+import ctypes
+import hashlib
+import json
+import multiprocessing
+import zlib
+
+from sqlalchemy.orm import class_mapper
+
+from ..core import utils
+
+# 版本计数器在模块导入时(即fork之前)分配在共享内存中，所有worker进程可见，
+# 表名按hash映射到槽位，冲突只会导致多余的失效，不会导致返回过期数据
+_SLOTS = 1024
+_VERSIONS = multiprocessing.Array(ctypes.c_ulonglong, _SLOTS)
+# 进程组启动标识，重启后计数器归零，旧的ETag不再有效
+EPOCH = utils.generate_uuid(dashed=False)
+_TABLES = {}
+
+
+def _slot(table):
+    return (zlib.crc32(utils.ensure_bytes(table)) & 0xffffffff) % _SLOTS
+
+
+def tables(model):
+    """
+    获取Model输出时依赖的表：自身以及直接关联的表
+    :param model: Model类
+    :type model: class
+    :returns: 表名列表
+    :rtype: list
+    """
+    names = _TABLES.get(model)
+    if names is None:
+        mapper = class_mapper(model)
+        names = [table.name for table in mapper.tables]
+        for relationship in mapper.relationships:
+            for table in relationship.mapper.tables:
+                if table.name not in names:
+                    names.append(table.name)
+        _TABLES[model] = names
+    return names
+
+
+def bump_table(name):
+    """
+    增加表的版本号，本机的写入在提交后调用，其他主机的写入在收到变更通知时调用
+    :param name: 表名
+    :type name: str
+    """
+    slot = _slot(name)
+    with _VERSIONS.get_lock():
+        _VERSIONS[slot] += 1
+
+
+def bump(model):
+    """
+    增加Model对应表的版本号，在数据变更提交后调用
+    :param model: Model类
+    :type model: class
+    """
+    bump_table(class_mapper(model).local_table.name)
+
+
+def bump_all():
+    """
+    增加所有表的版本号，变更通知可能丢失时(如监听连接断开重连)调用，使之前的ETag全部失效
+    """
+    with _VERSIONS.get_lock():
+        for slot in range(_SLOTS):
+            _VERSIONS[slot] += 1
+
+
+def version(model):
+    """
+    获取Model(以及其关联表)的版本号
+    :param model: Model类
+    :type model: class
+    :returns: 版本号列表
+    :rtype: list
+    """
+    return [_VERSIONS[_slot(table)] for table in tables(model)]
+
+
+def etag(model, *parts):
+    """
+    由表版本号以及请求的规范化参数生成强ETag
+    :param model: Model类
+    :type model: class
+    :param parts: 影响输出内容的参数，如路径、过滤条件，需要可以被json编码
+    :type parts: list
+    :returns: ETag
+    :rtype: str
+    """
+    content = json.dumps([EPOCH, version(model), parts], sort_keys=True, cls=utils.ComplexEncoder)
+    return '"%s"' % hashlib.md5(utils.ensure_bytes(content)).hexdigest()
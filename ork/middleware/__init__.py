@@ -8,8 +8,14 @@
 
 from __future__ import absolute_import
 
+from ..core.config import CONF
 from ..middleware.httpauth import HTTPAuthorization
+from ..middleware.metrics import Metrics
 
 
 def get_middleware():
-    return [HTTPAuthorization()]
\ No newline at end of file
+    middleware = [HTTPAuthorization()]
+    conf = CONF.get('metrics')
+    if conf is None or conf.get('enabled', True):
+        middleware.append(Metrics())
+    return middleware
\ No newline at end of file
@@ -15,3 +15,7 @@ class MiddleWare(object):
 
     def process_response(self, handler):
         pass
+
+    def process_close(self, handler):
+        """WebSocket连接关闭"""
+        pass
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/28 15:02
+# @File    : metrics.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+from tornado.websocket import WebSocketHandler
+
+from ..core import executor
+from ..core import metrics
+from ..db import cache
+from ..db import pool
+from ..db import prepared
+from .base_middleware import MiddleWare
+
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+IN_FLIGHT = metrics.gauge('ork_http_requests_in_flight', 'HTTP requests being processed.', ('method', 'route'))
+DURATION = metrics.histogram('ork_http_request_duration_seconds', 'HTTP request latency.',
+                             ('method', 'route', 'status'))
+RESPONSE_SIZE = metrics.histogram('ork_http_response_size_bytes', 'HTTP response body size.', ('method', 'route'),
+                                  buckets=SIZE_BUCKETS)
+DB_QUERIES = metrics.histogram('ork_http_request_db_queries', 'Database statements executed per HTTP request.',
+                               ('method', 'route'), buckets=QUERY_BUCKETS)
+DB_TIME = metrics.histogram('ork_http_request_db_seconds', 'Database statement time per HTTP request.',
+                            ('method', 'route'))
+WS_CONNECTIONS = metrics.gauge('ork_websocket_connections', 'Open WebSocket connections.', ('route',))
+WS_OPENED = metrics.counter('ork_websocket_connections_total', 'WebSocket connections opened.', ('route',))
+
+
+class Metrics(MiddleWare):
+    """
+    请求指标：按路由(控制器)以及状态码统计的延迟、处理中的请求数、响应大小、每个请求的数据库查询次数以及耗时，
+    WebSocket连接数；指标按worker进程记录，由core.metrics在抓取时合并
+    """
+
+    def process_request(self, handler):
+        labels = (handler.request.method, type(handler).__name__)
+        IN_FLIGHT.inc(labels)
+        handler._metrics_labels = labels
+
+    def process_response(self, handler):
+        route = type(handler).__name__
+        if isinstance(handler, WebSocketHandler):
+            # 握手成功时以101响应结束
+            if handler.get_status() == 101:
+                WS_CONNECTIONS.inc((route,))
+                WS_OPENED.inc((route,))
+                handler._metrics_websocket = True
+            return
+        method = handler.request.method
+        labels = getattr(handler, '_metrics_labels', None)
+        if labels is not None:
+            IN_FLIGHT.dec(labels)
+            handler._metrics_labels = None
+        else:
+            # prepare之前结束的请求(如不支持的请求方法)没有计入处理中
+            labels = (method, route)
+        DURATION.observe((method, route, str(handler.get_status())), handler.request.request_time())
+        RESPONSE_SIZE.observe(labels, handler.response_size())
+        queries = getattr(handler, 'db_queries', None) or ()
+        DB_QUERIES.observe(labels, len(queries))
+        DB_TIME.observe(labels, sum(queries))
+
+    def process_close(self, handler):
+        if getattr(handler, '_metrics_websocket', False):
+            WS_CONNECTIONS.dec((type(handler).__name__,))
+            handler._metrics_websocket = False
+
+
+def collect_database():
+    """
+    输出当前进程已有的统计：连接池(主库、副本、分片，包括各自的异步连接池)、副本延迟、阻塞线程池、主键读缓存、预编译语句缓存
+    """
+    pools = pool.POOL.pool_stats()
+    connections = []
+    routes = []
+    for stats in pools:
+        db = stats['name']
+        connections.extend([((db, 'checkedout'), stats['checkedout']), ((db, 'idle'), stats['idle']),
+                            ((db, 'overflow'), stats['overflow'])])
+        routes.extend(((db, route), value) for route, value in stats['routes'].items())
+    replicas = pool.POOL.replica_stats()
+    executor_stats = executor.stats()
+    caches = sorted(cache.stats().items())
+    prepared_stats = prepared.stats()
+    families = {
+        'ork_db_pool_connections': metrics.family(
+            'gauge', 'Database pool connections by state.', ('db', 'state'), connections),
+        'ork_db_pool_limit': metrics.family(
+            'gauge', 'Adaptive checkout limit of the database pool.', ('db',),
+            [((stats['name'],), stats['limit']) for stats in pools if stats['limit'] is not None]),
+        'ork_db_pool_checkouts_total': metrics.family(
+            'counter', 'Database pool checkouts.', ('db',),
+            [((stats['name'],), stats['checkouts']) for stats in pools]),
+        'ork_db_pool_wait_seconds_total': metrics.family(
+            'counter', 'Time spent waiting for a database pool checkout.', ('db',),
+            [((stats['name'],), stats['wait_time_total']) for stats in pools]),
+        'ork_db_pool_timeouts_total': metrics.family(
+            'counter', 'Database pool checkout timeouts.', ('db',),
+            [((stats['name'],), stats['timeouts']) for stats in pools]),
+        'ork_db_pool_connects_total': metrics.family(
+            'counter', 'Database connections opened.', ('db',),
+            [((stats['name'],), stats['connects']) for stats in pools]),
+        'ork_db_pool_route_checkouts_total': metrics.family(
+            'counter', 'Database pool checkouts by request route.', ('db', 'route'),
+            [(labels, value['checkouts']) for labels, value in routes]),
+        'ork_db_pool_hold_seconds_total': metrics.family(
+            'counter', 'Time database connections were held by request route.', ('db', 'route'),
+            [(labels, value['hold_time_total']) for labels, value in routes]),
+        'ork_db_replica_healthy': metrics.family(
+            'gauge', 'Whether the read replica is used.', ('replica',),
+            [((replica['name'],), int(replica['healthy'])) for replica in replicas]),
+        'ork_db_replica_lag_seconds': metrics.family(
+            'gauge', 'Replication lag of the read replica.', ('replica',),
+            [((replica['name'],), replica['lag']) for replica in replicas if replica['lag'] is not None]),
+        'ork_db_replica_reads_total': metrics.family(
+            'counter', 'Reads routed to the read replica.', ('replica',),
+            [((replica['name'],), replica['reads']) for replica in replicas]),
+        'ork_executor_tasks': metrics.family(
+            'gauge', 'Blocking executor tasks by state.', ('state',),
+            [(('active',), executor_stats['active']), (('queued',), executor_stats['queued'])]),
+        'ork_executor_tasks_total': metrics.family(
+            'counter', 'Blocking executor tasks by result.', ('result',),
+            [(('completed',), executor_stats['completed']), (('rejected',), executor_stats['rejected'])]),
+        'ork_executor_wait_seconds_total': metrics.family(
+            'counter', 'Time blocking tasks waited in the executor queue.', (),
+            [((), executor_stats['wait_time_total'])]),
+        'ork_cache_entries': metrics.family(
+            'gauge', 'Primary key read cache entries.', ('cache',),
+            [((name,), stats['size']) for name, stats in caches]),
+        'ork_cache_requests_total': metrics.family(
+            'counter', 'Primary key read cache lookups by result.', ('cache', 'result'),
+            [((name, result), stats[key]) for name, stats in caches for result, key in (('hit', 'hits'),
+                                                                                        ('miss', 'misses'))]),
+        'ork_cache_removals_total': metrics.family(
+            'counter', 'Primary key read cache removals by reason.', ('cache', 'reason'),
+            [((name, reason), stats[key]) for name, stats in caches
+             for reason, key in (('eviction', 'evictions'), ('expiration', 'expirations'),
+                                 ('invalidation', 'invalidations'))]),
+        'ork_prepared_statements_total': metrics.family(
+            'counter', 'Prepared statement cache lookups by result.', ('result',),
+            [(('hit',), prepared_stats['hits']), (('miss',), prepared_stats['misses']),
+             (('eviction',), prepared_stats['evictions'])]),
+        'ork_aio_pool_connections': metrics.family(
+            'gauge', 'Async database pool connections by state.', ('db', 'state'),
+            [((stats['name'], state), stats['async'][state]) for stats in pools if stats['async'] is not None
+             for state in ('opened', 'idle', 'waiting')]),
+    }
+    return families
+
+
+metrics.register_collector(collect_database)
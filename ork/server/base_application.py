@@ -13,9 +13,12 @@ import sys
 
 import tornado.options
 import tornado.web
+from tornado import process
 
 from ..core import config
+from ..core import executor
 from ..db import pool
+from ..db import telemetry
 from ..middleware import get_middleware
 
 CONF = config.CONF
@@ -30,7 +33,35 @@ def initialize_database():
                              'pool_size': CONF.db.pool_size,
                              'pool_recycle': CONF.db.pool_recycle,
                              'pool_timeout': CONF.db.pool_timeout,
-                             'max_overflow': CONF.db.max_overflow}, connecter='psycopg2')
+                             'max_overflow': CONF.db.max_overflow,
+                             # 异步读取的连接池，每个worker的每个engine最多建立的连接数，在同步连接池之外
+                             'aio_pool_size': CONF.db.get('aio_pool_size', CONF.db.pool_size),
+                             'prepared_cache_size': CONF.db.get('prepared_cache_size', 64),
+                             'replicas': CONF.db.get('replicas', []),
+                             'replica_max_lag': CONF.db.get('replica_max_lag', 5),
+                             'replica_check_interval': CONF.db.get('replica_check_interval', 5),
+                             'read_your_writes': CONF.db.get('read_your_writes', 0),
+                             'shards': CONF.db.get('shards', []),
+                             'pool_warmup': CONF.db.get('pool_warmup', 0),
+                             'pool_check_interval': CONF.db.get('pool_check_interval', 0),
+                             'pool_check_idle': CONF.db.get('pool_check_idle', CONF.db.get('pool_check_interval', 0)),
+                             'pool_adaptive': CONF.db.get('pool_adaptive', False),
+                             'pool_adaptive_min': CONF.db.get('pool_adaptive_min', 1),
+                             'pool_adaptive_max': CONF.db.get('pool_adaptive_max', None),
+                             'pool_adaptive_interval': CONF.db.get('pool_adaptive_interval', 5),
+                             'pool_adaptive_target_wait': CONF.db.get('pool_adaptive_target_wait', 0.005),
+                             'pool_adaptive_reserve': CONF.db.get('pool_adaptive_reserve', 5),
+                             # 自适应调整时各worker平分数据库剩余的连接数
+                             'workers': CONF.num_processes or process.cpu_count()}, connecter='psycopg2')
+    # 阻塞调用的线程数与同步连接池一致，更多的线程只会在pool_timeout上等待；
+    # 异步读取不占用线程，每个worker的连接数上限为pool_size + max_overflow + aio_pool_size
+    executor.setup(max_workers=CONF.db.pool_size + CONF.db.max_overflow,
+                   max_queue=CONF.db.get('executor_queue_size', 32),
+                   retry_after=CONF.db.get('retry_after', 1),
+                   enabled=CONF.db.get('blocking_executor', True))
+    telemetry.setup(enabled=CONF.db.get('filter_telemetry', True),
+                    slow_threshold=CONF.db.get('slow_query_threshold', 0.5),
+                    max_samples=CONF.db.get('slow_query_samples', 20))
 
 
 def initialize_logger():
@@ -15,7 +15,10 @@ from tornado import process
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 
+from ..core import metrics
 from ..core.config import CONF
+from ..db import cache
+from ..db import pool
 from ..server.base_application import application
 
 
@@ -31,8 +34,21 @@ def run():
     address = CONF.server.address
     num_processes = CONF.num_processes
     sockets = netutil.bind_sockets(port=port, address=address)
+    # 各worker的指标写到同一个目录，抓取时合并
+    metrics_conf = CONF.get('metrics')
+    if metrics_conf is not None and metrics_conf.get('enabled', True):
+        metrics.setup(metrics_conf.get('path'), metrics_conf.get('interval', 5))
+    # 连接不能在进程之间共享：fork之前关闭父进程中已打开的连接，fork之后每个worker创建自己的engine
+    pool.POOL.dispose()
     if platform.system() == "Linux":
         process.fork_processes(num_processes=num_processes)
+    pool.POOL.after_fork()
+    # 接受请求之前预先建立连接，并在后台定期检查连接是否存活
+    pool.POOL.warmup()
+    pool.POOL.start_health_check()
+    metrics.start()
+    # 每个worker监听主键读缓存的失效通知
+    cache.start_listener(pool.POOL.engine)
     server = HTTPServer(application, xheaders=True)
     server.add_sockets(sockets)
     print("server serving on % s:% s" % (address, port))
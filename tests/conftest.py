@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 10:05
+# @File    : conftest.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+"""
+    test fixtures, database tests use the PostgreSQL database in ORK_TEST_DB and are skipped when it is unreachable
+"""
+from __future__ import absolute_import
+
+import asyncio
+import json
+
+import pytest
+import sqlalchemy.exc
+import tornado.web
+from tornado import httpclient
+from tornado import netutil
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+
+from tests import support
+from ork.db import pool
+
+
+def connect_or_skip(url):
+    try:
+        return support.connect(url)
+    except sqlalchemy.exc.DBAPIError as e:
+        pytest.skip('database %s is unavailable: %s' % (support.safe_url(url), e.orig))
+
+
+@pytest.fixture(scope='session')
+def engine():
+    engine = connect_or_skip(support.TEST_DB)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """
+    空的Model表以及按默认参数初始化的连接池
+    """
+    support.create_schema(engine)
+    support.refresh_pool()
+    yield engine
+    pool.POOL.dispose()
+
+
+@pytest.fixture
+def shards(db):
+    """
+    配置了分片(support.shard_urls)的连接池，各分片上是空的Model表
+    """
+    engines = [connect_or_skip(url) for url in support.shard_urls()]
+    for engine in engines:
+        support.create_schema(engine)
+    support.refresh_pool(shards=support.shard_urls())
+    yield engines
+    pool.POOL.dispose()
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def lines(db):
+    """
+    5个城市，50条线路：line-0000 ~ line-0049，id为0 ~ 49，city_id为c0 ~ c4轮流
+    """
+    support.seed(db)
+    return db
+
+
+class Client(object):
+    """
+    在当前线程的IOLoop上启动应用，同步地发送请求
+    """
+
+    def __init__(self, io_loop, port):
+        self.io_loop = io_loop
+        self.port = port
+        self.http = httpclient.AsyncHTTPClient()
+
+    def fetch(self, path, method='GET', body=None, headers=None, **kwargs):
+        if body is not None and not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        request = httpclient.HTTPRequest('http://127.0.0.1:%d%s' % (self.port, path), method=method, body=body,
+                                         headers=headers, allow_nonstandard_methods=True, **kwargs)
+        return self.io_loop.run_sync(lambda: self.http.fetch(request, raise_error=False))
+
+
+@pytest.fixture
+def io_loop():
+    """
+    当前线程新的IOLoop，用于执行协程以及启动应用
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    io_loop = IOLoop.current()
+    yield io_loop
+    io_loop.close(all_fds=True)
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def client(db, io_loop):
+    from ork.apps.traffic import route
+    from ork.middleware import get_middleware
+
+    class Application(tornado.web.Application):
+        def __init__(self):
+            self.middleware = get_middleware()
+            self.handlers = []
+            route.add_routes(self)
+            super(Application, self).__init__(handlers=self.handlers)
+
+        def add_route(self, uri_template, resource):
+            self.handlers.append((uri_template, resource))
+
+    sockets = netutil.bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(Application())
+    server.add_sockets(sockets)
+    yield Client(io_loop, sockets[0].getsockname()[1])
+    server.stop()
+    io_loop.run_sync(server.close_all_connections)
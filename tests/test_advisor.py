@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 16:00
+# @File    : test_advisor.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+import sqlalchemy.exc
+
+from ork.core import config
+from ork.db import advisor
+from ork.db import pool
+from ork.db import telemetry
+
+
+@pytest.fixture
+def samples(monkeypatch):
+    monkeypatch.setattr(telemetry, 'SLOW_THRESHOLD', 0.001)
+    telemetry.reset()
+    yield
+    telemetry.reset()
+
+
+@pytest.fixture
+def index_advice(monkeypatch):
+    monkeypatch.setitem(config.CONF._config._opts['db'], 'index_advice', True)
+
+
+@pytest.mark.parametrize('statement, explainable', [
+    ('SELECT * FROM line', True),
+    ('  select\n* from line', True),
+    ('WITH t AS (SELECT 1) SELECT * FROM t', False),
+    ('WITH t AS (UPDATE line SET name = name RETURNING uuid) SELECT * FROM t', False),
+    ('UPDATE line SET name = name', False),
+    ('SELECTED', False),
+])
+def test_only_plain_select_is_sampled(samples, statement, explainable):
+    telemetry.record_statement(statement, {}, 1)
+    assert bool(telemetry.samples()) is explainable
+
+
+def test_explain_runs_read_only(lines, samples):
+    sample = {'statement': 'SELECT nextval(%(name)s)', 'parameters': {'name': 'relationship_id_seq'}}
+    with pytest.raises(sqlalchemy.exc.DBAPIError) as e:
+        telemetry.explain(lines, sample)
+    assert 'read-only' in str(e.value)
+
+
+def test_report_redacts_parameters(lines, samples):
+    telemetry.record_statement('SELECT * FROM line WHERE name = %(name)s', {'name': 'secret'}, 1)
+    report = advisor.report(lines, explain=True)
+    sample = report['slow_queries'][0]
+    assert sample['parameters'] == {'name': advisor.REDACTED}
+    assert sample['plan']
+    assert 'secret' not in json.dumps(sample['parameters'])
+    # 进程中的样本保留参数，用于之后的EXPLAIN
+    assert telemetry.samples()[0]['parameters'] == {'name': 'secret'}
+
+
+def test_route_is_disabled_by_default(client):
+    assert client.fetch('/admin/index-advice').code == 404
+
+
+def test_route_when_enabled(index_advice, client):
+    response = client.fetch('/admin/index-advice?min_rows=0')
+    assert response.code == 200
+    assert set(json.loads(response.body)) == {'usage', 'slow_queries', 'suggestions'}
+    assert pool.POOL.engine.pool.checkedout() == 0
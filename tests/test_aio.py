@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 18:00
+# @File    : test_aio.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+import sqlalchemy
+from tornado import gen
+from tornado.web import HTTPError
+
+from tests import support
+from ork.apps.traffic import resource
+from ork.db import aio
+from ork.db import instrument
+from ork.db import pool
+
+
+def test_results_match_sync(lines, io_loop):
+    line = resource.Line()
+    kwargs = dict(filters={'city_id': 'c1'}, orders=['-id'], limit=4, count='exact')
+    results = io_loop.run_sync(lambda: line.alist(**kwargs))
+    expected = line.list(**kwargs)
+    assert list(results) == list(expected)
+    assert results.total == expected.total == 10
+    assert io_loop.run_sync(lambda: line.acount(filters={'id': {'lt': 10}})) == 10
+    assert io_loop.run_sync(lambda: line.aget('line-0004')) == line.get('line-0004')
+    with pytest.raises(HTTPError) as e:
+        io_loop.run_sync(lambda: line.aget('line-9999'))
+    assert e.value.status_code == 404
+
+
+def test_pool_size_and_stats(lines, io_loop):
+    support.refresh_pool(aio_pool_size=2)
+
+    @gen.coroutine
+    def _concurrent():
+        results = yield [resource.Line().alist(filters={'id': i}) for i in range(10)]
+        raise gen.Return(results)
+
+    results = io_loop.run_sync(_concurrent)
+    assert [[line['id'] for line in lines] for lines in results] == [[i] for i in range(10)]
+    stats = pool.POOL.pool_stats()[0]['async']
+    assert stats == {'size': 2, 'opened': 2, 'idle': 2, 'waiting': 0}
+    # 异步连接不经过同步连接池
+    assert pool.POOL.pool_stats()[0]['checkouts'] == 0
+
+
+def test_reads_use_replica(lines, io_loop):
+    support.refresh_pool(replicas=[support.TEST_DB])
+    pool.POOL.check_replicas()
+    replica = pool.POOL.replicas[0]
+    io_loop.run_sync(lambda: resource.Line().alist(limit=1))
+    assert replica.engine.pool.stats.async_pool.stats()['opened'] == 1
+    assert pool.POOL.engine.pool.stats.async_pool is None
+    # 固定读取主库时不使用副本
+    io_loop.run_sync(lambda: resource.Line(read_primary=True).alist(limit=1))
+    assert pool.POOL.engine.pool.stats.async_pool.stats()['opened'] == 1
+
+
+def test_errors_are_wrapped(lines, io_loop):
+    statement = sqlalchemy.select([sqlalchemy.column('id')]).select_from(sqlalchemy.table('no_such_table'))
+    with pytest.raises(HTTPError) as e:
+        io_loop.run_sync(lambda: aio.fetchall(statement))
+    assert e.value.status_code == 400
+    # 出错的连接归还后仍可以使用
+    assert io_loop.run_sync(lambda: aio.fetchall(sqlalchemy.select([sqlalchemy.literal(1)])))[0][0] == 1
+    assert aio.get_pool().stats()['opened'] == 1
+
+
+def test_async_connections_are_reserved_in_headroom(lines, io_loop, monkeypatch):
+    support.refresh_pool(aio_pool_size=3)
+    engine = pool.POOL.engine
+    engine.pool.set_limit(4)
+    limiter = instrument.AdaptiveLimit(min_size=1, max_size=10, reserve=5)
+    monkeypatch.setattr(instrument.AdaptiveLimit, 'headroom', staticmethod(lambda engine: 7))
+    # 异步连接池未使用时不预留：出现超时且剩余连接充足，增加limit
+    engine.pool.stats.record_timeout()
+    assert limiter.adjust(engine) == 5
+    aio.get_pool(engine)
+    engine.pool.set_limit(4)
+    engine.pool.stats.record_timeout()
+    # 异步连接池随时可能建立3个连接，剩余7 - 3 <= reserve，减少limit
+    assert limiter.adjust(engine) == 3
+    io_loop.run_sync(lambda: aio.fetchall(sqlalchemy.select([sqlalchemy.literal(1)])))
+    assert engine.pool.stats.async_reserved() == 2
+
+
+def test_line_routes_read_async(lines, client):
+    expected = resource.Line().list(filters={'city_id': 'c2'}, orders=['id'], limit=3, count='exact')
+    response = client.fetch('/lines?city_id=c2&__orders=id&__limit=3')
+    assert json.loads(response.body) == {'count': 10, 'data': list(expected)}
+    response = client.fetch('/line/line-0007')
+    assert json.loads(response.body)['id'] == 7
+    assert client.fetch('/line/line-9999').code == 404
+    # 列表、统计以及详情都在异步连接上执行，不经过同步连接池
+    stats = pool.POOL.pool_stats()[0]
+    assert stats['checkouts'] == 1
+    assert stats['async']['opened'] >= 1
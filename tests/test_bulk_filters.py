@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 17:00
+# @File    : test_bulk_filters.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+
+INVALID_FILTERS = [
+    {},
+    {'cty_id': 'c1'},
+    {'city_id': {'bogus': 'c1'}},
+    {'city_id': {}},
+    {'city_id': 'c1', 'name': {'tsearch': '!!!'}},
+]
+
+
+@pytest.mark.parametrize('filters', INVALID_FILTERS)
+def test_invalid_filters_are_rejected(lines, filters):
+    with pytest.raises(HTTPError) as e:
+        resource.Line().update_many(filters, {'name': 'renamed'})
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPError) as e:
+        resource.Line().delete_many(filters)
+    assert e.value.status_code == 400
+    assert resource.Line().count() == 50
+    assert resource.Line().count(filters={'name': 'renamed'}) == 0
+
+
+def test_valid_filters(lines):
+    count, refs = resource.Line().update_many({'city_id': 'c1', 'id': {'lt': 20}}, {'name': 'renamed'})
+    assert count == 4
+    assert sorted(ref['id'] for ref in refs) == [1, 6, 11, 16]
+    count, refs = resource.Line().delete_many({'name': {'starts': 'renamed'}}, chunk_size=3)
+    assert count == 4
+    assert resource.Line().count() == 46
+
+
+def test_invalid_filter_over_http(client, lines):
+    response = client.fetch('/lines?cty_id=c1', method='DELETE')
+    assert response.code == 400
+    response = client.fetch('/lines?city_id__bogus=c1', method='PATCH', body={'name': 'renamed'})
+    assert response.code == 400
+    assert resource.Line().count() == 50
+    response = client.fetch('/lines?city_id=c1', method='DELETE')
+    assert response.code == 200
+    assert json.loads(response.body)['count'] == 10
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 16:30
+# @File    : test_bulk_insert.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import sqlalchemy
+
+from ork.apps.traffic import resource
+
+
+class SmallChunkCity(resource.City):
+    _bulk_chunk_size = 3
+
+
+def _city(i, **kwargs):
+    return dict({'uuid': 'n%d' % i, 'id': str(100 + i), 'name': 'new city %d' % i}, **kwargs)
+
+
+def _statements(engine):
+    statements = []
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split(None, 1)[0].upper())
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _before)
+    return statements, lambda: sqlalchemy.event.remove(engine, 'before_cursor_execute', _before)
+
+
+def test_one_statement_per_chunk(lines):
+    statements, remove = _statements(resource.City()._pool.engine)
+    try:
+        created, errors = SmallChunkCity().create_many([_city(i) for i in range(7)])
+    finally:
+        remove()
+    assert errors == []
+    assert [city['uuid'] for city in created] == ['n%d' % i for i in range(7)]
+    # 7行分3块插入，每块一个savepoint
+    assert statements.count('INSERT') == 3
+    assert statements.count('SAVEPOINT') == 3
+    assert resource.City().count() == 12
+
+
+def test_failed_chunk_falls_back_to_rows(lines):
+    rows = [_city(i) for i in range(7)]
+    rows[1]['uuid'] = 'c1'  # 与已有的城市主键冲突
+    rows[4]['uuid'] = 'n3'  # 与同一批次中的行冲突
+    rows[5]['name'] = 'x' * 300  # 校验失败，不会写入数据库
+    statements, remove = _statements(resource.City()._pool.engine)
+    try:
+        created, errors = SmallChunkCity().create_many(rows)
+    finally:
+        remove()
+    assert [city['uuid'] for city in created] == ['n0', 'n2', 'n3', 'n6']
+    assert [error['index'] for error in errors] == [1, 4, 5]
+    assert all(error['message'] for error in errors)
+    # 失败的两个分块回滚到各自的savepoint后逐行重试
+    assert statements.count('ROLLBACK') == 4
+    assert resource.City().count() == 9
+    assert resource.City().get('c1')['name'] == 'city 1'
+
+
+def test_bulk_post(client, lines):
+    response = client.fetch('/cities', method='POST', body=[_city(1), _city(2, uuid='c2')])
+    assert response.code == 207
+    body = json.loads(response.body)
+    assert body['count'] == 1
+    assert [city['uuid'] for city in body['data']] == ['n1']
+    assert [error['index'] for error in body['errors']] == [1]
+    response = client.fetch('/cities', method='POST', body=[_city(3)])
+    assert response.code == 201
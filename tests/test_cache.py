@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 23:30
+# @File    : test_cache.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import time
+
+import pytest
+import sqlalchemy
+from tornado import gen
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+from ork.db import cache
+from ork.db import pool
+
+
+class CachedLine(resource.Line):
+    _cache_size = 16
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """
+    空的缓存，未启动监听
+    """
+    monkeypatch.setattr(cache, '_CACHES', {})
+    monkeypatch.setattr(cache, '_LISTENER', None)
+
+
+@pytest.fixture
+def statements(lines, caches):
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    engine = pool.POOL.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _capture)
+    yield captured
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', _capture)
+
+
+@pytest.fixture
+def listener(lines, caches, io_loop):
+    listener = cache.start_listener(pool.POOL.engine, io_loop=io_loop)
+    assert listener.listening
+    yield listener
+    listener.stop()
+
+
+def _wait(io_loop, condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        io_loop.run_sync(lambda: gen.sleep(0.01))
+    return condition()
+
+
+@pytest.mark.parametrize('rid, key', [
+    ('line-0001', ('line-0001',)),
+    (1, ('1',)),
+    (['a', 2], ('a', '2')),
+])
+def test_make_key(rid, key):
+    assert cache.make_key(rid) == key
+
+
+def test_lru_eviction():
+    lru = cache.LRUCache('test', 2, 60)
+    lru.set(('a',), 1)
+    lru.set(('b',), 2)
+    assert lru.get(('a',)) == 1
+    lru.set(('c',), 3)
+    # b最久未使用，被淘汰
+    assert lru.get(('b',)) is None
+    assert lru.get(('a',)) == 1 and lru.get(('c',)) == 3
+    assert lru.stats()['evictions'] == 1
+
+
+def test_expiration():
+    lru = cache.LRUCache('test', 2, -1)
+    lru.set(('a',), 1)
+    assert lru.get(('a',)) is None
+    assert lru.stats()['expirations'] == 1
+
+
+def test_variants_are_invalidated_together():
+    lru = cache.LRUCache('test', 2, 60)
+    lru.set(('a',), {'uuid': 'a'})
+    lru.set(('a',), '{"uuid": "a"}', True)
+    assert lru.get(('a',)) == {'uuid': 'a'}
+    assert lru.get(('a',), True) == '{"uuid": "a"}'
+    lru.invalidate(('a',))
+    assert lru.get(('a',)) is None and lru.get(('a',), True) is None
+
+
+def test_set_after_invalidation_is_discarded():
+    lru = cache.LRUCache('test', 2, 60)
+    token = lru.token()
+    # 查询期间发生失效，查询到的可能是失效前的数据
+    lru.invalidate(('a',))
+    lru.set(('a',), 'stale', token=token)
+    assert lru.get(('a',)) is None
+    lru.set(('a',), 'fresh', token=lru.token())
+    assert lru.get(('a',)) == 'fresh'
+
+
+def test_cache_is_opt_in(lines, caches):
+    assert resource.Line()._get_cache() is None
+    assert CachedLine()._get_cache() is not None
+
+
+def test_get_is_cached(statements):
+    res = CachedLine()
+    line = res.get('line-0003')
+    assert line['id'] == 3
+    count = len(statements)
+    assert res.get('line-0003') == line
+    assert json.loads(res.get('line-0003', as_json=True)) == line
+    assert len(statements) == count + 1
+    assert res.get('line-0003', as_json=True) == res.get('line-0003', as_json=True)
+    assert len(statements) == count + 1
+    # 返回的是副本，修改不影响缓存
+    line['name'] = 'changed'
+    assert res.get('line-0003')['name'] == 'line 3'
+
+
+@pytest.mark.parametrize('write', [
+    lambda res: res.update('line-0003', {'name': 'renamed'}),
+    lambda res: res.update_many({'city_id': 'c3'}, {'name': 'renamed'}),
+])
+def test_writes_invalidate(statements, write):
+    res = CachedLine()
+    res.get('line-0003')
+    write(res)
+    assert res.get('line-0003')['name'] == 'renamed'
+
+
+def test_delete_invalidates(statements):
+    res = CachedLine()
+    res.get('line-0003')
+    res.delete('line-0003')
+    with pytest.raises(HTTPError) as e:
+        res.get('line-0003')
+    assert e.value.status_code == 404
+
+
+def test_external_session_bypasses_cache(statements):
+    session = pool.POOL.transaction()
+    try:
+        assert CachedLine(transaction=session)._get_cache() is None
+    finally:
+        session.rollback()
+        session.remove()
+
+
+def test_notification_from_other_worker_invalidates(listener, io_loop):
+    res = CachedLine()
+    assert res.get('line-0003')['name'] == 'line 3'
+    line_cache = cache.get_cache('line', 16, 60)
+    assert line_cache.get(('line-0003',), False) is not None
+    # 其他worker(或者其他主机)直接修改数据并发送通知
+    with pool.POOL.engine.begin() as connection:
+        connection.execute(sqlalchemy.text("UPDATE line SET name = 'remote' WHERE uuid = 'line-0003'"))
+        connection.execute(sqlalchemy.select([sqlalchemy.func.pg_notify(
+            cache.CHANNEL, cache.notify_payload('line', ('line-0003',)))]))
+    assert _wait(io_loop, lambda: line_cache.get(('line-0003',), False) is None)
+    assert res.get('line-0003')['name'] == 'remote'
+
+
+def test_uncommitted_change_is_not_notified(listener, io_loop):
+    res = CachedLine()
+    res.get('line-0003')
+    line_cache = cache.get_cache('line', 16, 60)
+    session = pool.POOL.transaction()
+    CachedLine(transaction=session).update('line-0003', {'name': 'rolled back'})
+    session.rollback()
+    session.remove()
+    assert not _wait(io_loop, lambda: line_cache.get(('line-0003',), False) is None, timeout=0.3)
+    assert res.get('line-0003')['name'] == 'line 3'
+
+
+def test_cache_disabled_while_listener_is_down(listener):
+    assert CachedLine()._get_cache() is not None
+    listener.listening = False
+    assert not cache.enabled()
+    assert CachedLine()._get_cache() is None
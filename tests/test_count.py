@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 22:30
+# @File    : test_count.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+import sqlalchemy
+
+from ork.apps.traffic import resource
+from ork.db import pool
+
+
+@pytest.fixture
+def analyzed(lines):
+    lines.execute('ANALYZE line')
+    lines.execute('ANALYZE city')
+    return lines
+
+
+@pytest.fixture
+def statements(lines):
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    engine = pool.POOL.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _capture)
+    yield captured
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', _capture)
+
+
+def test_window_total_in_list_statement(statements):
+    rows = resource.Line().list(filters={'city_id': 'c1'}, orders=['id'], limit=3, count='exact')
+    assert [row['id'] for row in rows] == [1, 6, 11]
+    assert rows.total == 10
+    # 总数与列表在同一条语句中统计
+    assert len(statements) == 1
+    assert 'count(*) OVER ()' in statements[0]
+
+
+def test_total_is_not_counted_by_default(statements):
+    rows = resource.Line().list(orders=['id'], limit=3)
+    assert rows.total is None
+    assert 'OVER' not in statements[0]
+
+
+def test_empty_result_total_is_zero(lines):
+    assert resource.Line().list(filters={'city_id': 'none'}, count='exact').total == 0
+
+
+@pytest.mark.parametrize('kwargs', [dict(offset=100, limit=10), dict(limit=0)])
+def test_empty_page_total_is_unknown(lines, io_loop, kwargs):
+    # 没有返回行时无法从窗口统计得到总数(offset之前可能有数据)，由count重新统计
+    rows = resource.Line().list(orders=['id'], count='exact', **kwargs)
+    assert list(rows) == [] and rows.total is None
+    rows = io_loop.run_sync(lambda: resource.Line().alist(orders=['id'], count='exact', **kwargs))
+    assert list(rows) == [] and rows.total is None
+    assert resource.Line().count() == 50
+
+
+def test_cursor_page_has_no_window_total(lines):
+    # 第一页包含全部数据，游标之后的页面窗口统计只包含游标之后的数据，不使用
+    first = resource.Line().list(orders=['id'], limit=3, after='', count='exact')
+    assert first.total == 50
+    rows = resource.Line().list(orders=['id'], limit=3, after=first.next_cursor, count='exact')
+    assert [row['id'] for row in rows] == [3, 4, 5]
+    assert rows.total is None
+
+
+def test_estimate_count(analyzed):
+    res = resource.Line()
+    # 无过滤条件时使用pg_class.reltuples，ANALYZE之后与实际一致
+    assert res.estimate_count() == 50
+    estimated = res.estimate_count(filters={'city_id': 'c1'})
+    assert isinstance(estimated, int) and 0 < estimated <= 50
+
+
+def test_estimate_count_before_analyze(lines):
+    # 从未analyze过的表使用查询计划的估算行数
+    assert resource.Line().estimate_count() > 0
+
+
+@pytest.mark.parametrize('path, total', [('/lines', 50), ('/cities', 5)])
+def test_count_modes(analyzed, client, path, total):
+    def _get(query):
+        response = client.fetch('%s?%s' % (path, query))
+        assert response.code == 200
+        return json.loads(response.body)
+
+    body = _get('__limit=2')
+    assert body['count'] == total and len(body['data']) == 2
+    assert _get('__limit=2&__count=exact')['count'] == total
+    assert _get('__limit=2&__count=none')['count'] is None
+    assert _get('__limit=2&__count=estimate')['count'] == total
+    # 超出末尾的空页面仍然输出正确的总数
+    body = _get('__offset=%d&__limit=10' % (total + 10))
+    assert body == {'count': total, 'data': []}
+    assert _get('__limit=0')['count'] == total
+
+
+def test_count_mode_is_validated(lines, client):
+    assert client.fetch('/lines?__count=all').code == 400
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 21:00
+# @File    : test_executor.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import threading
+
+import pytest
+
+from ork.apps.traffic import resource
+from ork.core import executor
+
+
+@pytest.fixture
+def full(monkeypatch):
+    """
+    排队上限为0的线程池，所有经由线程池的调用都被拒绝
+    """
+    monkeypatch.setattr(executor.get_executor(), 'max_queue', 0)
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    """
+    记录资源写入所在的线程
+    """
+    names = []
+    create = resource.Line.create
+
+    def _create(self, data):
+        names.append(threading.current_thread().name)
+        return create(self, data)
+
+    monkeypatch.setattr(resource.Line, 'create', _create)
+    return names
+
+
+def test_crud_runs_in_executor(lines, client, threads):
+    response = client.fetch('/lines', method='POST', body={'id': 100, 'name': 'new', 'city_id': 'c1'})
+    assert response.code == 201
+    assert threads and threading.current_thread().name not in threads
+
+
+@pytest.mark.parametrize('method, path, body', [
+    ('POST', '/lines', {'id': 100, 'name': 'new', 'city_id': 'c1'}),
+    ('PATCH', '/line/line-0001', {'name': 'renamed'}),
+    ('DELETE', '/line/line-0001', None),
+    ('GET', '/cities', None),
+    ('GET', '/city/c1', None),
+])
+def test_traffic_endpoints_are_rejected_when_full(lines, client, full, method, path, body):
+    response = client.fetch(path, method=method, body=body)
+    assert response.code == 503
+    assert response.headers['Retry-After'] == str(executor.RETRY_AFTER)
+    assert resource.Line().get('line-0001')['name'] == 'line 1'
+
+
+def test_async_reads_skip_executor(lines, client, full):
+    assert client.fetch('/line/line-0001').code == 200
+    assert json.loads(client.fetch('/lines?__limit=1').body)['count'] == 50
+
+
+def test_disabled_by_config(lines, client, full, threads, monkeypatch):
+    monkeypatch.setattr(executor, 'ENABLED', False)
+    response = client.fetch('/lines', method='POST', body={'id': 100, 'name': 'new', 'city_id': 'c1'})
+    assert response.code == 201
+    assert threads == [threading.current_thread().name]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 11:00
+# @File    : test_export.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+from tornado.concurrent import Future
+from tornado.simple_httpclient import HTTPStreamClosedError
+
+from ork.apps.traffic import controller
+from ork.core import executor
+from ork.db import pool
+
+
+def test_export_ndjson(lines, client):
+    response = client.fetch('/lines/export?format=ndjson&__orders=id')
+    assert response.code == 200
+    rows = [json.loads(row) for row in response.body.decode('utf-8').splitlines()]
+    assert [row['uuid'] for row in rows] == ['line-%04d' % i for i in range(50)]
+
+
+def test_export_is_rejected_when_executor_is_full(lines, client, monkeypatch):
+    monkeypatch.setattr(executor.get_executor(), 'max_queue', 0)
+    response = client.fetch('/lines/export?format=csv')
+    assert response.code == 503
+
+
+def test_slow_client_times_out(lines, client, monkeypatch):
+    # flush一直不完成，模拟不再接收数据的客户端
+    monkeypatch.setattr(controller.ExportLine, 'export_chunk_size', 64)
+    monkeypatch.setattr(controller.ExportLine, 'export_write_timeout', 0.2)
+    monkeypatch.setattr(controller.ExportLine, 'flush', lambda self, *args, **kwargs: Future())
+    completed = executor.stats()['completed']
+    with pytest.raises(HTTPStreamClosedError):
+        client.fetch('/lines/export?format=csv')
+    # COPY被中止，线程以及数据库连接均已释放
+    assert executor.stats()['completed'] == completed + 1
+    assert executor.stats()['active'] == 0
+    assert pool.POOL.engine.pool.checkedout() == 0
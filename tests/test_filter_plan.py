@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 15:30
+# @File    : test_filter_plan.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+from sqlalchemy import orm
+
+from benchmarks import bench_filter_plan
+from ork.db import curd
+from ork.db import filter_wrapper
+
+
+def _sql(query):
+    return str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+
+
+def test_memoized_plan_builds_same_sql():
+    resource = bench_filter_plan.OperationLog()
+    session = orm.Session()
+    for terms in (1, 10, 50):
+        filters = bench_filter_plan.make_filters(terms)
+        expected = _sql(bench_filter_plan.build_unplanned(resource, session, filters))
+        assert _sql(bench_filter_plan.build(resource, session, filters)) == expected
+
+
+def test_plan_is_cached():
+    resource = bench_filter_plan.OperationLog()
+    plan = resource._get_filter_plan(resource.orm_meta, 'operate_time', 'gte')
+    assert plan is resource._get_filter_plan(resource.orm_meta, 'operate_time', 'gte')
+    column, func = plan
+    assert column is resource.orm_meta.operate_time
+    assert func.__self__ is filter_wrapper.FilterDateTime()
+
+
+def test_plan_cache_is_bounded(monkeypatch):
+    resource = bench_filter_plan.OperationLog()
+    monkeypatch.setattr(curd, '_PLAN_CACHE_SIZE', 2)
+    monkeypatch.setattr(curd, '_FILTER_PLAN_CACHE', curd._PlanCache())
+    monkeypatch.setattr(curd, '_COLUMN_CACHE', curd._PlanCache())
+    for i in range(5):
+        resource._get_filter_plan(resource.orm_meta, 'data_after.key%d' % i, 'eq')
+    assert len(curd._FILTER_PLAN_CACHE) == 2
+    assert len(curd._COLUMN_CACHE) == 2
+    # 已满时淘汰最久未使用的项，新的列仍然缓存
+    plan = resource._get_filter_plan(resource.orm_meta, 'operate_time', 'gte')
+    assert plan is resource._get_filter_plan(resource.orm_meta, 'operate_time', 'gte')
+
+
+def test_misses_are_not_cached(monkeypatch):
+    resource = bench_filter_plan.OperationLog()
+    monkeypatch.setattr(curd, '_FILTER_PLAN_CACHE', curd._PlanCache())
+    monkeypatch.setattr(curd, '_COLUMN_CACHE', curd._PlanCache())
+    for i in range(100):
+        assert resource._get_filter_plan(resource.orm_meta, 'junk%d' % i, 'eq') == (None, None)
+    assert resource._get_filter_plan(resource.orm_meta, 'operate_time', 'junk')[1] is None
+    assert len(curd._FILTER_PLAN_CACHE) == 0
+    assert len(curd._COLUMN_CACHE) == 1
+
+
+def test_filters_are_singletons():
+    assert filter_wrapper.FilterNumber() is filter_wrapper.FilterNumber()
+    assert filter_wrapper.Filter() is not filter_wrapper.FilterNumber()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 22:00
+# @File    : test_import.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+
+from ork.apps.traffic import resource
+from ork.common.handler import _RowParser
+
+CSV = (u'id,name,city_id\r\n'
+       u'1,"line, one",c1\r\n'
+       u'2,"two\nlines",c2\r\n'
+       u'3,"say ""hi""",c3\r\n'
+       u'4,线路,c4').encode('utf-8')
+CSV_ROWS = [
+    (0, {'id': '1', 'name': 'line, one', 'city_id': 'c1'}, None),
+    (1, {'id': '2', 'name': 'two\nlines', 'city_id': 'c2'}, None),
+    (2, {'id': '3', 'name': 'say "hi"', 'city_id': 'c3'}, None),
+    (3, {'id': '4', 'name': u'线路', 'city_id': 'c4'}, None),
+]
+NDJSON = u'{"id": 1, "name": "a"}\n\n{"id": 2, "name": "线路"}\n{"id": 3}'.encode('utf-8')
+NDJSON_ROWS = [
+    (0, {'id': 1, 'name': 'a'}, None),
+    (1, {'id': 2, 'name': u'线路'}, None),
+    (2, {'id': 3}, None),
+]
+
+
+def _parse(import_format, body, size):
+    parser = _RowParser(import_format)
+    rows = []
+    for start in range(0, len(body), size):
+        rows.extend(parser.feed(body[start:start + size]))
+    return rows + parser.close()
+
+
+@pytest.mark.parametrize('import_format, body, expected', [
+    ('csv', CSV, CSV_ROWS),
+    ('ndjson', NDJSON, NDJSON_ROWS),
+])
+def test_chunk_boundaries(import_format, body, expected):
+    # 任意位置分块(包括引号内、换行符以及多字节字符中间)结果都相同
+    for size in range(1, len(body) + 1):
+        assert _parse(import_format, body, size) == expected
+
+
+def test_trailing_row_without_newline():
+    parser = _RowParser('csv')
+    assert parser.feed(b'id,name\n1,a\n2,b') == [(0, {'id': '1', 'name': 'a'}, None)]
+    assert parser.close() == [(1, {'id': '2', 'name': 'b'}, None)]
+    assert parser.close() == []
+
+
+def test_csv_field_count_error():
+    rows = _parse('csv', b'id,name\n1\n2,b,c\n3,c\n', 4)
+    assert [(index, values) for index, values, error in rows] == [(0, None), (1, None), (2, {'id': '3', 'name': 'c'})]
+    assert 'expected 2 fields, got 1' in rows[0][2]
+    assert 'expected 2 fields, got 3' in rows[1][2]
+
+
+def test_unterminated_quote():
+    parser = _RowParser('csv')
+    assert parser.feed(b'id,name\n1,"a\n2,b\n') == []
+    rows = parser.close()
+    assert len(rows) == 1 and rows[0][1] is None
+    assert 'unterminated quoted field' in rows[0][2]
+
+
+def test_ndjson_malformed_row():
+    rows = _parse('ndjson', b'{"id": 1}\n{"id": \n{"id": 3}\n', 5)
+    assert [(index, values) for index, values, error in rows] == [(0, {'id': 1}), (1, None), (2, {'id': 3})]
+    assert 'malformed row' in rows[1][2]
+
+
+def test_import_csv(lines, client):
+    body = b'id,name,city_id\n100,imported,c1\n101,bad\n102,imported,c2\n'
+    response = client.fetch('/lines/import?format=csv', method='POST', body=body)
+    assert response.code == 207
+    result = json.loads(response.body)
+    assert result['count'] == 2
+    assert result['error_count'] == 1
+    assert result['errors'][0]['index'] == 1
+    rows = resource.Line().list(filters={'name': 'imported'}, orders=['id'])
+    assert [(row['id'], row['city_id']) for row in rows] == [(100, 'c1'), (102, 'c2')]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 21:00
+# @File    : test_instrument.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import threading
+import time
+
+import pytest
+import sqlalchemy.exc
+
+from tests import support
+from ork.core import config
+from ork.db import instrument
+from ork.db import pool
+
+
+@pytest.fixture
+def limited(db):
+    """
+    limit为1的连接池，等待名额最多0.5秒
+    """
+    engine = support.refresh_pool(pool_timeout=0.5).engine
+    engine.pool.set_limit(1)
+    return engine
+
+
+@pytest.fixture
+def pool_stats(monkeypatch):
+    monkeypatch.setitem(config.CONF._config._opts['db'], 'pool_stats', True)
+
+
+def _hold(engine, acquired, release):
+    connection = engine.connect()
+    acquired.set()
+    release.wait(5)
+    connection.close()
+
+
+def test_limit_times_out_waiting_for_slot(limited):
+    acquired, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=_hold, args=(limited, acquired, release))
+    holder.start()
+    acquired.wait(5)
+    try:
+        started = time.time()
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            limited.connect()
+        assert time.time() - started >= 0.5
+        # 连接池中还有空闲连接，等待的是名额
+        assert limited.pool.checkedout() == 1
+        assert limited.pool.stats.timeouts == 1
+    finally:
+        release.set()
+        holder.join()
+    # 超时的等待者不占用名额
+    assert limited.pool._in_use == 0
+    with limited.connect() as connection:
+        assert connection.scalar('SELECT 1') == 1
+
+
+def test_released_slot_goes_to_waiter(limited):
+    acquired, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=_hold, args=(limited, acquired, release))
+    holder.start()
+    acquired.wait(5)
+    got = []
+
+    def _wait():
+        with limited.connect():
+            got.append(limited.pool._in_use)
+
+    waiter = threading.Thread(target=_wait)
+    waiter.start()
+    deadline = time.time() + 5
+    while not limited.pool._waiters and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(limited.pool._waiters) == 1
+    release.set()
+    holder.join()
+    waiter.join()
+    # 名额直接交给等待者，同时占用的连接数始终不超过limit
+    assert got == [1]
+    assert limited.pool.stats.peak_checkedout == 1
+    assert limited.pool._in_use == 0
+
+
+def test_raising_limit_wakes_waiters(limited):
+    acquired, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=_hold, args=(limited, acquired, release))
+    holder.start()
+    acquired.wait(5)
+    got = threading.Event()
+
+    def _wait():
+        with limited.connect():
+            got.set()
+
+    waiter = threading.Thread(target=_wait)
+    waiter.start()
+    deadline = time.time() + 5
+    while not limited.pool._waiters and time.time() < deadline:
+        time.sleep(0.01)
+    limited.pool.set_limit(2)
+    try:
+        assert got.wait(5)
+    finally:
+        release.set()
+        holder.join()
+        waiter.join()
+    assert limited.pool._in_use == 0
+
+
+@pytest.mark.parametrize('limit, window, headroom, expected', [
+    # 剩余连接不足reserve时减少
+    (4, (10, 1.0, 0, 4), 5, 3),
+    # 等待超过目标时增加limit的1/4，至少1
+    (4, (10, 1.0, 0, 4), 100, 5),
+    (8, (10, 1.0, 0, 8), 100, 10),
+    # 出现超时时增加
+    (4, (10, 0.0, 1, 4), 100, 5),
+    # 增加不超过剩余连接按worker数平分的份额
+    (8, (10, 1.0, 0, 8), 6, 8),
+    (8, (10, 1.0, 0, 8), 7, 9),
+    # 空闲时逐个减少
+    (4, (10, 0.0, 0, 1), 100, 3),
+    (4, (10, 0.0, 0, 3), 100, 4),
+    # 始终在[min_size, max_size]之内
+    (1, (0, 0.0, 0, 0), 0, 1),
+    (12, (10, 1.0, 0, 12), 100, 12),
+])
+def test_next_limit(limit, window, headroom, expected):
+    limiter = instrument.AdaptiveLimit(min_size=1, max_size=12, workers=2, target_wait=0.005, reserve=5)
+    assert limiter.next_limit(limit, window, headroom) == expected
+
+
+def test_adjust_sets_pool_limit(limited, monkeypatch):
+    limiter = instrument.AdaptiveLimit(min_size=1, max_size=4, reserve=5)
+    monkeypatch.setattr(instrument.AdaptiveLimit, 'headroom', staticmethod(lambda engine: 100))
+    limited.pool.stats.record_checkout(0.1, 1, 0)
+    assert limiter.adjust(limited) == 2
+    assert limited.pool.limit == 2
+    # 统计窗口已重置，空闲时减少
+    assert limiter.adjust(limited) == 1
+
+
+def test_headroom_is_within_max_connections(db):
+    engine = pool.POOL.engine
+    assert 0 < instrument.AdaptiveLimit.headroom(engine) <= int(engine.scalar('SHOW max_connections'))
+
+
+def test_pool_stats_route_is_disabled_by_default(client):
+    assert client.fetch('/admin/pool-stats').code == 404
+
+
+def test_pool_stats_route_when_enabled(pool_stats, client):
+    body = json.loads(client.fetch('/admin/pool-stats').body)
+    assert body['pid'] == pool.POOL.pid
+    assert body['pools'][0]['size'] == support.POOL_PARAM['pool_size']
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 14:00
+# @File    : test_keyset.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+
+
+def _pages(res, orders, limit, **kwargs):
+    seen = []
+    cursor = ''
+    while True:
+        page = res.list(orders=orders, limit=limit, after=cursor, **kwargs)
+        seen.extend(page)
+        if not page.next_cursor:
+            return seen
+        cursor = page.next_cursor
+
+
+def test_pages_follow_order(lines):
+    rows = _pages(resource.Line(), ['-id'], 7)
+    assert [row['id'] for row in rows] == list(range(49, -1, -1))
+
+
+def test_mixed_directions(lines):
+    # 方向不一致时展开为OR条件，结果与一次性排序一致
+    expected = [(row['city_id'], row['id']) for row in resource.Line().list(orders=['city_id', '-id'])]
+    rows = _pages(resource.Line(), ['city_id', '-id'], 6)
+    assert [(row['city_id'], row['id']) for row in rows] == expected
+
+
+def test_duplicate_order_values_do_not_skip_rows(lines):
+    # 排序列有重复值时由主键保证翻页不重复、不遗漏
+    rows = _pages(resource.Line(), ['city_id'], 4, filters={'id': {'lt': 30}})
+    assert sorted(row['id'] for row in rows) == list(range(30))
+    assert len(rows) == 30
+
+
+def test_seek_predicate(lines):
+    res = resource.Line()
+    first = res.list(orders=['id'], limit=5, after='')
+    assert [row['id'] for row in first] == [0, 1, 2, 3, 4]
+    with res.get_session() as session:
+        query, keys, projection = res._list_query(session, orders=['id'], limit=5, after=first.next_cursor)
+        sql = str(query.statement.compile())
+    # 使用行值比较定位，而不是OFFSET
+    assert '(line.id, line.uuid) >' in sql
+    assert 'OFFSET' not in sql.upper()
+
+
+def test_invalid_cursor(lines):
+    with pytest.raises(HTTPError) as e:
+        resource.Line().list(orders=['id'], limit=5, after='bm90LWEtY3Vyc29y')
+    assert e.value.status_code == 400
+
+
+def test_cursor_over_http(client, lines):
+    ids = []
+    cursor = ''
+    while True:
+        response = client.fetch('/lines?__orders=-id&__limit=20&__after=%s' % cursor)
+        assert response.code == 200
+        body = json.loads(response.body)
+        ids.extend(row['id'] for row in body['data'])
+        if not body['next']:
+            break
+        cursor = body['next']
+    assert ids == list(range(49, -1, -1))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 21:30
+# @File    : test_metrics.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from ork.core import config
+from ork.core import metrics
+
+
+@pytest.fixture
+def path(tmpdir, monkeypatch):
+    """
+    多进程汇总使用临时目录，测试结束后恢复为只输出当前进程
+    """
+    monkeypatch.setattr(metrics, 'PATH', None)
+    metrics.setup(str(tmpdir))
+    return str(tmpdir)
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setitem(config.CONF._config._opts['metrics'], 'enabled', True)
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def _worker_file(path, pid, families):
+    with open(os.path.join(path, '%d.json' % pid), 'w') as f:
+        json.dump({'pid': pid, 'metrics': families}, f)
+
+
+def _families():
+    return {
+        'test_requests_total': metrics.family('counter', 'Requests.', ('route',), [(('/lines',), 3)]),
+        'test_in_flight': metrics.family('gauge', 'In flight.', ('route',), [(('/lines',), 2)]),
+        'test_latency_seconds': {'type': 'histogram', 'help': 'Latency.', 'labelnames': ['route'],
+                                 'buckets': [0.1, 1.0], 'samples': [[['/lines'], [1, 2, 0, 1.5]]]},
+    }
+
+
+def test_merge_drops_gauges_of_dead_workers(path, dead_pid):
+    _worker_file(path, os.getppid(), _families())
+    _worker_file(path, dead_pid, _families())
+    merged = metrics.collect()
+    # 计数器以及直方图合计所有worker，当前值只计入存活的worker
+    assert merged['test_requests_total']['samples'] == {('/lines',): 6}
+    assert merged['test_in_flight']['samples'] == {('/lines',): 2}
+    assert merged['test_latency_seconds']['samples'] == {('/lines',): [2, 4, 0, 3.0]}
+
+
+def test_merge_skips_gauge_family_of_dead_worker_only(path, dead_pid):
+    _worker_file(path, dead_pid, _families())
+    merged = metrics.collect()
+    assert 'test_in_flight' not in merged
+    assert merged['test_requests_total']['samples'] == {('/lines',): 3}
+
+
+def test_collect_includes_current_process(path):
+    counter = metrics.counter('test_collect_total', 'Collected.')
+    counter.inc()
+    merged = metrics.collect()
+    assert merged['test_collect_total']['samples'][()] >= 1
+    assert os.path.exists(os.path.join(path, '%d.json' % os.getpid()))
+
+
+def test_unreadable_file_is_skipped(path):
+    with open(os.path.join(path, '1.json'), 'w') as f:
+        f.write('{"pid": 1, "metr')
+    _worker_file(path, os.getppid(), _families())
+    assert metrics.collect()['test_requests_total']['samples'] == {('/lines',): 3}
+
+
+def test_periodic_write_runs_in_executor(path, monkeypatch):
+    threads = []
+    monkeypatch.setattr(metrics, 'write', lambda: threads.append(threading.current_thread()))
+    monkeypatch.setattr(metrics, '_PENDING', None)
+    metrics._write_in_background()
+    metrics._PENDING.result(5)
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_render_counter_and_gauge():
+    families = {
+        'test_requests_total': {'type': 'counter', 'help': 'Requests\nserved.', 'labelnames': ['route', 'method'],
+                                'samples': {('/line/(.*)', 'GET'): 3, ('/lines', 'GET'): 1}},
+        'test_up': {'type': 'gauge', 'help': 'Up.', 'labelnames': [], 'samples': {(): 0.5}},
+    }
+    assert metrics.render(families) == (
+        '# HELP test_requests_total Requests\\nserved.\n'
+        '# TYPE test_requests_total counter\n'
+        'test_requests_total{route="/line/(.*)",method="GET"} 3\n'
+        'test_requests_total{route="/lines",method="GET"} 1\n'
+        '# HELP test_up Up.\n'
+        '# TYPE test_up gauge\n'
+        'test_up 0.5\n')
+
+
+def test_render_escapes_label_values():
+    families = {'test_total': {'type': 'counter', 'help': 'Test.', 'labelnames': ['name'],
+                               'samples': {('a"b\\c\nd',): 1}}}
+    assert 'test_total{name="a\\"b\\\\c\\nd"} 1\n' in metrics.render(families)
+
+
+def test_render_histogram_is_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(('/lines',), value)
+    families = {}
+    metrics._merge(families, {'test_seconds': histogram.dump()}, True)
+    assert metrics.render(families) == (
+        '# HELP test_seconds Latency.\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{route="/lines",le="0.1"} 1\n'
+        'test_seconds_bucket{route="/lines",le="1.0"} 3\n'
+        'test_seconds_bucket{route="/lines",le="+Inf"} 4\n'
+        'test_seconds_sum{route="/lines"} 6.05\n'
+        'test_seconds_count{route="/lines"} 4\n')
+
+
+def test_route_is_disabled_when_metrics_are_off(client):
+    assert client.fetch('/metrics').code == 404
+
+
+def test_route_when_enabled(enabled, client):
+    response = client.fetch('/metrics')
+    assert response.code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert b'# TYPE ork_db_pool_connections gauge' in response.body
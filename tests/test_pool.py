@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 19:00
+# @File    : test_pool.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import time
+
+import pytest
+import sqlalchemy
+
+from tests import support
+from ork.db import pool
+
+
+@pytest.fixture
+def warm(db):
+    """
+    预先建立3个空闲连接(pool_size)的连接池，记录每次检出时的占用数以及执行的SELECT 1
+    """
+    db_pool = support.refresh_pool(pool_check_idle=0)
+    engine = db_pool.engine
+    assert db_pool.warmup(3) == 3
+    record = {'checkedout': [], 'pings': 0}
+
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        record['checkedout'].append(engine.pool.checkedout())
+
+    def _execute(conn, cursor, statement, parameters, context, executemany):
+        if statement == 'SELECT 1':
+            record['pings'] += 1
+
+    sqlalchemy.event.listen(engine, 'checkout', _checkout)
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _execute)
+    yield record
+    sqlalchemy.event.remove(engine, 'checkout', _checkout)
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', _execute)
+
+
+def _age(engine, seconds):
+    # 将连接池中全部空闲连接的空闲起始时间提前
+    for record in list(engine.pool._pool.queue):
+        record.info['idle_since'] -= seconds
+
+
+def test_check_holds_one_connection_at_a_time(warm):
+    engine = pool.POOL.engine
+    assert engine.pool.checkedin() == 3
+    assert pool.POOL.check() == 3
+    assert warm['pings'] == 3
+    assert warm['checkedout'] == [1] * 3
+    assert engine.pool.checkedin() == 3
+
+
+def test_check_skips_recently_used(warm):
+    engine = pool.POOL.engine
+    pool.POOL.check_idle = 60
+    assert pool.POOL.check() == 0
+    assert warm['pings'] == 0
+    # 跳过的连接保留原来的空闲起始时间，空闲超过阈值后再检查
+    _age(engine, 61)
+    assert pool.POOL.check() == 3
+    assert warm['pings'] == 3
+    assert pool.POOL.check() == 0
+
+
+def test_check_reconnects_terminated(warm, engine):
+    pids = [record.connection.get_backend_pid() for record in pool.POOL.engine.pool._pool.queue]
+    with engine.connect() as connection:
+        for pid in pids:
+            connection.execute(sqlalchemy.text('SELECT pg_terminate_backend(:pid)'), pid=pid)
+    # 第一个连接断开后整个连接池被作废，之后的连接在检出时重新建立
+    assert pool.POOL.check() == 2
+    with pool.POOL.engine.connect() as connection:
+        assert connection.scalar(sqlalchemy.text('SELECT 1')) == 1
+
+
+def test_replica_lag_is_not_checked_on_reads(db):
+    support.refresh_pool(replicas=[support.TEST_DB], replica_check_interval=0)
+    replica = pool.POOL.replicas[0]
+    # 尚未检查过的副本不参与读取，读取时不检查
+    assert pool.POOL.read_engine() is pool.POOL.engine
+    assert replica.engine.pool.stats.connects == 0
+    pool.POOL.check_replicas()
+    assert replica.healthy and replica.lag == 0
+    statements = []
+    sqlalchemy.event.listen(replica.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert all(pool.POOL.read_engine() is replica.engine for _ in range(5))
+    assert statements == []
+
+
+def test_unavailable_replica_is_skipped(db):
+    support.refresh_pool(replicas=['postgresql+psycopg2://postgres@/ork?host=/nonexistent'])
+    pool.POOL.check_replicas()
+    assert not pool.POOL.replicas[0].healthy
+    assert pool.POOL.read_engine() is pool.POOL.engine
+
+
+def test_replica_lag_is_checked_in_background(db):
+    support.refresh_pool(replicas=[support.TEST_DB], replica_check_interval=0.05)
+    replica = pool.POOL.replicas[0]
+    pool.POOL.start_health_check(0)
+    # 后台线程启动后立即检查一次
+    deadline = time.time() + 5
+    while replica.lag is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.POOL.read_engine() is replica.engine
+    checked_at = replica.checked_at
+    while replica.checked_at == checked_at and time.time() < deadline:
+        time.sleep(0.01)
+    assert replica.checked_at > checked_at
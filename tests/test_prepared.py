@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 15:00
+# @File    : test_prepared.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import pytest
+import sqlalchemy
+
+from ork.apps.traffic import resource
+from ork.db import models
+from ork.db import prepared
+
+LINE = models.Line.__table__
+
+
+class PreparedLine(resource.Line):
+    _read_engine = 'core'
+    _prepared_statements = True
+
+
+@pytest.fixture
+def cache_size(monkeypatch):
+    def _set(size):
+        monkeypatch.setattr(prepared, 'CACHE_SIZE', size)
+
+    prepared.reset_stats()
+    return _set
+
+
+@pytest.fixture
+def connection(lines):
+    # 独立的连接，不复用其他测试留下预编译语句的连接
+    engine = sqlalchemy.create_engine(lines.url, poolclass=sqlalchemy.pool.NullPool)
+    connection = engine.connect()
+    yield connection
+    connection.close()
+    engine.dispose()
+
+
+def _server_statements(connection):
+    return set(row[0] for row in connection.execute(
+    "SELECT name FROM pg_prepared_statements WHERE name LIKE 'ork\\_%%'"))
+
+
+def _shapes():
+    # 三种不同形态的查询
+    return [sqlalchemy.select([LINE.c.uuid]).where(LINE.c.id == sqlalchemy.bindparam('id', 3)),
+            sqlalchemy.select([LINE.c.uuid]).where(LINE.c.city_id == 'c1').order_by(LINE.c.id),
+            sqlalchemy.select([LINE.c.name]).where(LINE.c.id < 10).order_by(LINE.c.id.desc())]
+
+
+def test_lru_eviction_deallocates(connection, cache_size):
+    cache_size(2)
+    first, second, third = _shapes()
+    assert prepared.execute(connection, first) == [('line-0003',)]
+    prepared.execute(connection, second)
+    # 命中后first成为最近使用的语句，third挤出second
+    assert prepared.execute(connection, first.params(id=4)) == [('line-0004',)]
+    prepared.execute(connection, third)
+    first_sql, _ = prepared.compile_statement(first, connection.dialect)
+    second_sql, _ = prepared.compile_statement(second, connection.dialect)
+    third_sql, _ = prepared.compile_statement(third, connection.dialect)
+    assert _server_statements(connection) == {prepared._statement_name(first_sql),
+                                              prepared._statement_name(third_sql)}
+    assert list(prepared._connection_cache(connection)) == [first_sql, third_sql]
+    assert prepared.stats() == {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2}
+    # 被挤出的语句再次执行时重新PREPARE
+    assert len(prepared.execute(connection, second)) == 10
+    assert prepared._statement_name(second_sql) in _server_statements(connection)
+    assert prepared.stats()['evictions'] == 2
+
+
+def test_cache_follows_dbapi_connection(connection, cache_size):
+    cache_size(4)
+    prepared.execute(connection, _shapes()[0])
+    assert len(_server_statements(connection)) == 1
+    # 连接失效重连后服务端的预编译语句不存在，缓存也随之清空
+    connection.invalidate()
+    assert _server_statements(connection) == set()
+    prepared.execute(connection, _shapes()[0])
+    assert prepared.stats()['misses'] == 2
+    assert len(_server_statements(connection)) == 1
+
+
+def test_disabled_cache_executes_directly(connection, cache_size):
+    cache_size(0)
+    assert prepared.execute(connection, _shapes()[0]) == [('line-0003',)]
+    assert _server_statements(connection) == set()
+    assert prepared.stats()['misses'] == 0
+
+
+def test_resource_results_match(lines, cache_size):
+    cache_size(64)
+    kwargs = dict(filters={'city_id': 'c2', 'id': {'gt': 5}}, orders=['-id'], limit=4)
+    assert PreparedLine().list(**kwargs) == resource.Line().list(**kwargs)
+    assert PreparedLine().list(**kwargs) == resource.Line().list(**kwargs)
+    assert PreparedLine().get('line-0012') == resource.Line().get('line-0012')
+    assert PreparedLine().count(filters={'city_id': 'c2'}) == 10
+    stats = prepared.stats()
+    assert stats['misses'] == 3 and stats['hits'] >= 1
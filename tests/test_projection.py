@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 23:00
+# @File    : test_projection.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import datetime
+import json
+
+import pytest
+import sqlalchemy
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+from ork.db import curd
+from ork.db import models
+from ork.db import pool
+
+
+class OperationLog(curd.ResourceBase):
+    orm_meta = models.SysOperationLog
+    _primary_keys = ('id',)
+
+
+class CoreOperationLog(OperationLog):
+    _read_engine = 'core'
+
+
+@pytest.fixture
+def logs(db):
+    db.execute(models.SysOperationLog.__table__.insert(), [
+        {'id': i, 'resource': 'line', 'tenant_uuid': 't', 'user_name': 'u', 'operation': 'update',
+         'operate_time': datetime.datetime(2019, 5, 30, 12, i), 'data_before': {'name': 'before %d' % i},
+         'data_after': {'name': 'after %d' % i}} for i in range(3)])
+    return db
+
+
+@pytest.fixture
+def statements(db):
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    engine = pool.POOL.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _capture)
+    yield captured
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', _capture)
+
+
+def test_fields_only_selects_projected_columns(lines, statements):
+    rows = resource.Line().list(orders=['id'], limit=2, fields=['uuid', 'name'])
+    assert list(rows) == [{'uuid': 'line-0000', 'name': 'line 0'}, {'uuid': 'line-0001', 'name': 'line 1'}]
+    assert 'city_id' not in statements[0]
+
+
+def test_unknown_fields_are_rejected(lines):
+    with pytest.raises(HTTPError) as e:
+        resource.Line().list(fields=['name', 'password'])
+    assert e.value.status_code == 400
+    assert 'password' in e.value.reason
+
+
+def test_unknown_fields_over_http(lines, client):
+    assert client.fetch('/lines?__fields=name,password').code == 400
+
+
+def test_fields_over_http(lines, client):
+    response = client.fetch('/lines?__fields=uuid&__fields=name,%20city_id&__orders=id&__limit=1')
+    assert json.loads(response.body)['data'] == [{'uuid': 'line-0000', 'name': 'line 0', 'city_id': 'c0'}]
+
+
+def test_keyset_keys_are_not_output(lines):
+    res = resource.Line()
+    page = res.list(orders=['-id'], limit=3, after='', fields=['name'])
+    # 排序键id额外查询用于生成游标，但不输出
+    assert list(page) == [{'name': 'line 49'}, {'name': 'line 48'}, {'name': 'line 47'}]
+    page = res.list(orders=['-id'], limit=3, after=page.next_cursor, fields=['name'])
+    assert list(page) == [{'name': 'line 46'}, {'name': 'line 45'}, {'name': 'line 44'}]
+
+
+def test_keyset_keys_are_not_output_over_http(lines, client):
+    body = json.loads(client.fetch('/lines?__fields=name&__orders=id&__limit=2&__after=').body)
+    assert body['data'] == [{'name': 'line 0'}, {'name': 'line 1'}]
+    body = json.loads(client.fetch('/lines?__fields=name&__orders=id&__limit=2&__after=%s' % body['next']).body)
+    assert body['data'] == [{'name': 'line 2'}, {'name': 'line 3'}]
+
+
+@pytest.mark.parametrize('resource_class', [OperationLog, CoreOperationLog])
+def test_deferred_attributes_are_not_listed(logs, statements, resource_class):
+    rows = resource_class().list(orders=['id'])
+    assert [row['operate_time'] for row in rows] == [datetime.datetime(2019, 5, 30, 12, i) for i in range(3)]
+    assert all('data_before' not in row and 'data_after' not in row for row in rows)
+    assert 'data_before' not in statements[0]
+
+
+@pytest.mark.parametrize('resource_class', [OperationLog, CoreOperationLog])
+def test_deferred_attributes_are_read_in_detail(logs, resource_class):
+    log = resource_class().get(1)
+    assert log['data_before'] == {'name': 'before 1'}
+    assert log['data_after'] == {'name': 'after 1'}
+
+
+def test_deferred_attributes_can_be_projected(logs):
+    rows = OperationLog().list(orders=['id'], limit=1, fields=['id', 'data_after'])
+    assert list(rows) == [{'id': 0, 'data_after': {'name': 'after 0'}}]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 14:30
+# @File    : test_read_engine.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+
+from ork.apps.traffic import resource
+
+
+class CoreCity(resource.City):
+    _read_engine = 'core'
+
+
+class CoreLine(resource.Line):
+    _read_engine = 'core'
+
+
+LIST_CASES = [
+    (resource.Line, CoreLine, dict()),
+    (resource.Line, CoreLine, dict(orders=['-id'], offset=5, limit=10)),
+    (resource.Line, CoreLine, dict(orders=['city_id', '-name'], limit=7, after='')),
+    (resource.Line, CoreLine, dict(filters={'city_id': 'c1', 'id': {'gte': 10}}, orders=['id'])),
+    (resource.Line, CoreLine, dict(filters={'name': {'like': '1'}}, orders=['uuid'], fields=['uuid', 'name'])),
+    (resource.Line, CoreLine, dict(orders=['id'], limit=5, count='exact')),
+    (resource.City, CoreCity, dict()),
+    (resource.City, CoreCity, dict(orders=['-name'], limit=2, after='')),
+    (resource.City, CoreCity, dict(filters={'id': {'in': ['1', '3']}}, fields=['name'])),
+]
+
+
+@pytest.mark.parametrize('orm_resource, core_resource, kwargs', LIST_CASES)
+def test_list_matches_orm(lines, orm_resource, core_resource, kwargs):
+    for as_json in (False, True):
+        expected = orm_resource().list(as_json=as_json, **kwargs)
+        results = core_resource().list(as_json=as_json, **kwargs)
+        assert list(results) == list(expected)
+        assert results.total == expected.total
+        assert results.next_cursor == expected.next_cursor
+
+
+def test_iter_list_count_get_match_orm(lines):
+    kwargs = dict(filters={'id': {'lt': 40}}, orders=['-city_id', 'id'])
+    assert list(CoreLine().iter_list(chunk_size=7, **kwargs)) == list(resource.Line().iter_list(chunk_size=7,
+                                                                                                **kwargs))
+    assert CoreLine().count(filters={'city_id': 'c2'}) == resource.Line().count(filters={'city_id': 'c2'}) == 10
+    assert CoreLine().count(offset=45, limit=10) == resource.Line().count(offset=45, limit=10) == 5
+    assert CoreLine().get('line-0007') == resource.Line().get('line-0007')
+    assert json.loads(CoreLine().get('line-0007', as_json=True)) == resource.Line().get('line-0007')
+
+
+def test_core_returns_rows_not_instances(lines):
+    with CoreLine().get_session() as session:
+        query = CoreLine()._get_select(session, CoreLine()._core_attributes())
+        rows = query.all()
+        assert len(rows) == 50
+        # Core查询不会把对象放入会话的identity map
+        assert len(session.identity_map) == 0
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 14:00
+# @File    : test_search.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import pytest
+import sqlalchemy
+from sqlalchemy import Column
+from sqlalchemy import String
+
+from tests import support
+from ork.apps.traffic import resource
+from ork.db import models
+from ork.db import pool
+from ork.db.curd import ResourceBase
+from ork.db.dictbase import DictBase
+
+
+class Place(models.Base, DictBase):
+    __tablename__ = 'test_place'
+
+    attributes = ['uuid', 'name', 'city']
+    searchable = ['name']
+    search_method = 'tsvector'
+
+    uuid = Column(String(63), primary_key=True)
+    name = Column(String(255))
+    city = Column(String(63))
+
+
+class PlaceResource(ResourceBase):
+    orm_meta = Place
+    _primary_keys = ('uuid',)
+
+
+class ShardedPlace(PlaceResource):
+    _shard_key = 'city'
+
+
+class CorePlace(PlaceResource):
+    _read_engine = 'core'
+
+
+# ts_rank：west出现的次数越多相关度越高，p1、p3、p5、p6的相关度相同，按主键排列
+NAMES = {'p1': 'a west', 'p2': 'west west west', 'p3': 'road west north', 'p4': 'east', 'p5': 'western road',
+         'p6': 'west', 'p7': 'west west'}
+RANKED = ['p2', 'p7', 'p1', 'p3', 'p5', 'p6']
+
+
+def _insert(engine, rows):
+    with engine.begin() as connection:
+        connection.execute(Place.__table__.insert(), rows)
+
+
+@pytest.fixture
+def places(db):
+    support.create_schema(db, tables=[Place.__table__])
+    _insert(db, [{'uuid': uuid, 'name': name, 'city': 'c%d' % i} for i, (uuid, name) in
+                 enumerate(sorted(NAMES.items()))])
+    return db
+
+
+@pytest.fixture
+def statements(engine):
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    pool_engine = pool.POOL.engine
+    sqlalchemy.event.listen(pool_engine, 'before_cursor_execute', _capture)
+    yield captured
+    sqlalchemy.event.remove(pool_engine, 'before_cursor_execute', _capture)
+
+
+def _pages(res, limit, **kwargs):
+    seen = []
+    cursor = ''
+    while True:
+        page = res.list(limit=limit, after=cursor, **kwargs)
+        seen.extend(row['uuid'] for row in page)
+        if not page.next_cursor:
+            return seen
+        cursor = page.next_cursor
+
+
+@pytest.mark.parametrize('res', [PlaceResource, CorePlace])
+def test_ranked_without_orders(places, res):
+    rows = res().list(filters={'name': {'search': 'west'}})
+    assert [row['uuid'] for row in rows] == RANKED
+    # 指定排序规则时不按相关度排序
+    rows = res().list(filters={'name': {'search': 'west'}}, orders=['-uuid'])
+    assert [row['uuid'] for row in rows] == sorted(RANKED, reverse=True)
+
+
+def _where(statement):
+    return statement.split('WHERE', 1)[-1].split('ORDER BY', 1)[0]
+
+
+def test_count_is_not_ranked(places, statements):
+    res = PlaceResource()
+    assert res.count(filters={'name': {'search': 'west'}}) == len(RANKED)
+    assert [statement for statement in statements if 'ts_rank' in statement] == []
+    rows = res.list(filters={'name': {'search': 'west'}}, count='exact')
+    assert rows.total == len(RANKED)
+    assert 'ORDER BY CAST(ts_rank' in statements[-1]
+
+
+@pytest.mark.parametrize('res', [PlaceResource, CorePlace])
+def test_cursor_pages_include_rank(places, res, statements):
+    # 相关度相同的行跨页时按主键定位
+    assert _pages(res(), 2, filters={'name': {'search': 'west'}}) == RANKED
+    assert any('ts_rank' in _where(statement) for statement in statements)
+
+
+def test_cursor_with_projection(places):
+    res = PlaceResource()
+    first = res.list(filters={'name': {'search': 'west'}}, limit=3, after='', fields=['uuid'])
+    second = res.list(filters={'name': {'search': 'west'}}, limit=3, after=first.next_cursor, fields=['uuid'])
+    assert [row['uuid'] for row in first + second] == RANKED
+    assert list(first[0]) == ['uuid']
+
+
+def test_iter_list_ranked(places):
+    rows = PlaceResource().iter_list(filters={'name': {'search': 'west'}}, after='', chunk_size=4)
+    assert [row['uuid'] for row in rows] == RANKED
+
+
+def test_sharded_merge_by_rank(places, shards):
+    res = ShardedPlace()
+    for i, (uuid, name) in enumerate(sorted(NAMES.items())):
+        res.create({'uuid': uuid, 'name': name, 'city': 'c%d' % i})
+    assert all(engine.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(Place.__table__)).scalar()
+               for engine in shards)
+    assert [row['uuid'] for row in res.list(filters={'name': {'search': 'west'}})] == RANKED
+    assert _pages(res, 4, filters={'name': {'search': 'west'}}) == RANKED
+    rows = res.iter_list(filters={'name': {'search': 'west'}}, chunk_size=2)
+    assert [row['uuid'] for row in rows] == RANKED
+
+
+def test_tsvector_index_is_used(places):
+    _insert(places, [{'uuid': 'x%05d' % i, 'name': 'stop %d' % i, 'city': 'c0'} for i in range(2000)])
+    query = PlaceResource()._get_select(None, ['uuid'], filters={'name': {'search': 'west'}}, orders=[])
+    sql = str(query.statement.compile(dialect=places.dialect, compile_kwargs={'literal_binds': True}))
+    with places.connect() as connection:
+        connection.execute('ANALYZE test_place')
+        connection.execute('SET enable_seqscan = off')
+        plan = '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + sql))
+    assert 'ix_test_place_name_tsv' in plan
+
+
+def test_trigram_index_is_used(lines):
+    if not support.trigram_available(lines):
+        pytest.skip('pg_trgm is unavailable')
+    query = resource.Line()._get_select(None, ['uuid'], filters={'name': {'search': 'ne 4'}}, orders=[])
+    sql = str(query.statement.compile(dialect=lines.dialect, compile_kwargs={'literal_binds': True}))
+    with lines.connect() as connection:
+        connection.execute('ANALYZE line')
+        connection.execute('SET enable_seqscan = off')
+        plan = '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + sql))
+    assert 'ix_line_name_trgm' in plan
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 10:20
+# @File    : test_serializer.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import datetime
+import enum
+import json
+
+import sqlalchemy
+from sqlalchemy.ext.declarative import declarative_base
+
+from ork.core import utils
+from ork.db import dictbase
+from ork.db import models
+from ork.db import serializer
+
+
+class Direction(enum.Enum):
+    UP = 'up'
+    DOWN = 2
+
+
+class Trip(declarative_base(), dictbase.DictBase):
+    __tablename__ = 'trip'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    direction = sqlalchemy.Column(sqlalchemy.Enum(Direction))
+    kind = sqlalchemy.Column(sqlalchemy.Enum('bus', 'metro', name='trip_kind'))
+
+
+def _roundtrip(value):
+    # 改造之前的输出方式
+    return json.loads(json.dumps(value, cls=utils.ComplexEncoder))
+
+
+def test_dumps_matches_to_dict():
+    line = models.Line(uuid='line-1', id=7, name=u'线路 "7"\n', city_id='c1')
+    text = serializer.get_serializer(models.Line).dumps(line)
+    assert json.loads(text) == _roundtrip(line.to_dict())
+
+
+def test_detail_level_and_datetime():
+    log = models.SysOperationLog(id=1, resource='line', tenant_uuid='t', user_name='u', operation='create',
+                                 operate_time=datetime.datetime(2019, 5, 29, 10, 20, 30, 123456),
+                                 data_before=None, data_after={'when': '2019-05-29', 'n': [1, 2]})
+    list_text = serializer.get_serializer(models.SysOperationLog).dumps(log)
+    detail_text = serializer.get_serializer(models.SysOperationLog, serializer.DETAIL).dumps(log)
+    assert json.loads(list_text) == _roundtrip(log.to_dict())
+    assert json.loads(detail_text) == _roundtrip(log.to_detail_dict())
+    # 延迟加载的列不出现在list级别中
+    assert 'data_after' not in json.loads(list_text)
+    assert json.loads(list_text)['operate_time'] == '2019-05-29 10:20:30'
+
+
+def test_dumps_row_and_mapping():
+    line_serializer = serializer.get_serializer(models.Line, attributes=['uuid', 'city_id'])
+    row = {'uuid': 'line-2', 'id': 2, 'name': None, 'city_id': 'c2'}
+    assert json.loads(line_serializer.dumps_mapping(row)) == {'uuid': 'line-2', 'city_id': 'c2'}
+    full = serializer.get_serializer(models.Line).dumps_mapping(row)
+    assert json.loads(full) == {'uuid': 'line-2', 'id': 2, 'name': None, 'city_id': 'c2'}
+
+
+def test_serializer_is_cached_per_level():
+    assert serializer.get_serializer(models.City) is serializer.get_serializer(models.City)
+    assert serializer.get_serializer(models.City) is not serializer.get_serializer(models.City, serializer.DETAIL)
+
+
+def test_jsonable():
+    value = {'at': datetime.datetime(2019, 5, 29, 8, 0, 1, 5), 'days': (datetime.date(2019, 5, 1),)}
+    assert serializer.jsonable(value) == _roundtrip(value)
+
+
+def test_aware_datetime_keeps_offset():
+    at = datetime.datetime(2019, 5, 29, 10, 20, 30, 123456, tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+    log = models.SysOperationLog(id=1, resource='line', tenant_uuid='t', user_name='u', operation='create',
+                                 operate_time=at)
+    assert json.loads(serializer.get_serializer(models.SysOperationLog).dumps(log))['operate_time'] == \
+        '2019-05-29 10:20:30+08:00'
+    # 与to_dict以及jsonable的输出一致
+    assert _roundtrip(at) == '2019-05-29 10:20:30+08:00'
+    assert serializer.jsonable({'at': at}) == {'at': '2019-05-29 10:20:30+08:00'}
+    assert serializer.dumps(at.astimezone(datetime.timezone.utc)) == '"2019-05-29 02:20:30+00:00"'
+
+
+def test_enum_columns():
+    trip_serializer = serializer.get_serializer(Trip)
+    assert json.loads(trip_serializer.dumps(Trip(id=1, direction=Direction.UP, kind='bus'))) == {
+        'id': 1, 'direction': 'up', 'kind': 'bus'}
+    assert json.loads(trip_serializer.dumps_mapping({'id': 2, 'direction': Direction.DOWN, 'kind': None})) == {
+        'id': 2, 'direction': 2, 'kind': None}
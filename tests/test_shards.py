@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 18:00
+# @File    : test_shards.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+import sqlalchemy
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+from ork.db import models
+from ork.db import pool
+
+CITIES = ['c%d' % i for i in range(5)]
+
+
+@pytest.fixture
+def sharded_lines(shards):
+    """
+    50条线路按city_id分布在两个分片上：id为0 ~ 49，city_id为c0 ~ c4轮流，name为line 0 ~ line 6轮流
+    """
+    created, errors = resource.Line().create_many([
+        {'id': i, 'name': 'line %d' % (i % 7), 'city_id': CITIES[i % 5]} for i in range(50)])
+    assert not errors
+    return dict((line['id'], line) for line in created)
+
+
+@pytest.fixture
+def statements():
+    """
+    按分片记录执行的语句
+    """
+    engines = pool.POOL.router.engines
+    captured = [[] for _ in engines]
+    listeners = []
+    for shard, engine in enumerate(engines):
+        def _capture(conn, cursor, statement, parameters, context, executemany, shard=shard):
+            captured[shard].append(statement)
+
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', _capture)
+        listeners.append((engine, _capture))
+    yield captured
+    for engine, listener in listeners:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', listener)
+
+
+def _shard_rows(engine):
+    table = models.Line.__table__
+    return engine.execute(sqlalchemy.select([table.c.id, table.c.city_id])).fetchall()
+
+
+def test_rows_are_routed_by_city(shards, sharded_lines):
+    router = pool.POOL.router
+    placed = [_shard_rows(engine) for engine in shards]
+    assert sum(len(rows) for rows in placed) == 50
+    # 两个分片都有数据，每行都在其city_id对应的分片上
+    assert all(placed)
+    for shard, rows in enumerate(placed):
+        assert all(router.shard_for(city_id) == shard for line_id, city_id in rows)
+
+
+def test_shard_key_filter_reads_one_shard(sharded_lines, statements):
+    router = pool.POOL.router
+    shard = router.shard_for('c3')
+    rows = resource.Line().list(filters={'city_id': 'c3'}, orders=['id'])
+    assert [row['id'] for row in rows] == list(range(3, 50, 5))
+    assert statements[shard] and not statements[1 - shard]
+    # 主键读取需要在所有分片上定位
+    line = sharded_lines[7]
+    assert resource.Line().get(line['uuid'])['id'] == 7
+
+
+def _cities_by_shard():
+    router = pool.POOL.router
+    placed = [[], []]
+    for city in CITIES:
+        placed[router.shard_for(city)].append(city)
+    return placed
+
+
+def test_shard_key_in_string_is_split(sharded_lines, statements):
+    placed = _cities_by_shard()
+    cities = [placed[0][0], placed[1][0]]
+    expected = sorted(i for i in range(50) if CITIES[i % 5] in cities)
+    rows = resource.Line().list(filters={'city_id': {'in': ','.join(cities)}}, orders=['id'])
+    # 逗号分隔的两个城市分别在两个分片上，都需要读取
+    assert [row['id'] for row in rows] == expected
+    assert statements[0] and statements[1]
+
+
+def test_shard_key_in_string_reads_one_shard(sharded_lines, statements):
+    shard, cities = next((shard, cities) for shard, cities in enumerate(_cities_by_shard()) if len(cities) > 1)
+    cities = cities[:2]
+    rows = resource.Line().list(filters={'city_id': {'in': '%s, %s' % tuple(cities)}}, orders=['id'])
+    assert [row['id'] for row in rows] == sorted(i for i in range(50) if CITIES[i % 5] in cities)
+    assert statements[shard] and not statements[1 - shard]
+
+
+def test_shard_key_in_over_http(sharded_lines, client):
+    response = client.fetch('/lines?city_id__in=c1,c3&__orders=id&__count=exact')
+    body = json.loads(response.body)
+    assert body['count'] == 20
+    assert [row['id'] for row in body['data']] == sorted(i for i in range(50) if i % 5 in (1, 3))
+
+
+@pytest.mark.parametrize('orders, key', [
+    (['-id'], lambda line: -line['id']),
+    (['name', 'id'], lambda line: (line['name'], line['id'])),
+    (['-name', 'city_id', 'id'], lambda line: (-int(line['name'].split()[1]), line['city_id'], line['id'])),
+])
+def test_fan_out_merge_order(sharded_lines, orders, key):
+    expected = [line['id'] for line in sorted(sharded_lines.values(), key=key)]
+    res = resource.Line()
+    rows = res.list(orders=orders, count='exact')
+    assert [row['id'] for row in rows] == expected
+    assert rows.total == 50
+    page = res.list(orders=orders, offset=12, limit=9)
+    assert [row['id'] for row in page] == expected[12:21]
+    assert [row['id'] for row in res.iter_list(orders=orders, offset=5, limit=30, chunk_size=4)] == expected[5:35]
+
+
+def test_fan_out_cursor_pages(sharded_lines):
+    expected = [line['id'] for line in sorted(sharded_lines.values(), key=lambda line: (line['name'], -line['id']))]
+    res = resource.Line()
+    seen = []
+    cursor = ''
+    while True:
+        page = res.list(orders=['name', '-id'], limit=8, after=cursor)
+        seen.extend(row['id'] for row in page)
+        if not page.next_cursor:
+            break
+        cursor = page.next_cursor
+    assert seen == expected
+
+
+def _other_shard_city(city_id):
+    router = pool.POOL.router
+    return [city for city in CITIES if router.shard_for(city) != router.shard_for(city_id)][0]
+
+
+def _same_shard_city(city_id):
+    router = pool.POOL.router
+    return [city for city in CITIES if city != city_id and router.shard_for(city) == router.shard_for(city_id)][0]
+
+
+def test_shard_key_update_is_rejected(sharded_lines):
+    line = sharded_lines[0]
+    res = resource.Line()
+    with pytest.raises(HTTPError) as e:
+        res.update(line['uuid'], {'city_id': _other_shard_city(line['city_id'])})
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPError) as e:
+        res.update_many({'city_id': line['city_id']}, {'city_id': _other_shard_city(line['city_id'])})
+    assert e.value.status_code == 400
+    assert res.get(line['uuid'])['city_id'] == line['city_id']
+    # 分片不变时允许修改
+    city_id = _same_shard_city(line['city_id'])
+    before, after = res.update(line['uuid'], {'city_id': city_id})
+    assert after['city_id'] == city_id
+
+
+def test_shard_key_update_over_http(sharded_lines, client):
+    line = sharded_lines[1]
+    response = client.fetch('/line/%s' % line['uuid'], method='PATCH',
+                            body={'city_id': _other_shard_city(line['city_id'])})
+    assert response.code == 400
+    response = client.fetch('/lines?city_id=%s' % line['city_id'], method='PATCH', body={'city_id': 'c0'})
+    assert response.code == 400
+    response = client.fetch('/lines?__orders=-id&__limit=3')
+    assert [row['id'] for row in json.loads(response.body)['data']] == [49, 48, 47]
+
+
+def test_create_requires_shard_key(sharded_lines):
+    with pytest.raises(HTTPError) as e:
+        resource.Line().create({'id': 99, 'name': 'no city'})
+    assert e.value.status_code == 400
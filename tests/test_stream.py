@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 10:00
+# @File    : test_stream.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import threading
+
+import pytest
+
+from ork.apps.traffic import controller
+from ork.db import pool
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    """
+    在线程池中执行阻塞调用，记录iter_list逐批读取时所在的线程
+    """
+    names = []
+    next_chunk = controller.CollectionLine._next_chunk
+
+    def _next_chunk(rows, size):
+        names.append(threading.current_thread().name)
+        return next_chunk(rows, size)
+
+    monkeypatch.setattr(controller.CollectionLine, 'blocking_executor', True)
+    monkeypatch.setattr(controller.CollectionLine, 'stream_chunk_size', 7)
+    monkeypatch.setattr(controller.CollectionLine, '_next_chunk', staticmethod(_next_chunk))
+    return names
+
+
+def test_stream_matches_list(lines, client, threads):
+    expected = json.loads(client.fetch('/lines?__orders=-id').body)
+    response = client.fetch('/lines?__orders=-id&__stream=1')
+    assert response.code == 200
+    assert json.loads(response.body) == expected
+    response = client.fetch('/lines?__orders=-id', headers={'Accept': 'application/x-ndjson'})
+    rows = [json.loads(row) for row in response.body.decode('utf-8').splitlines()]
+    assert rows == expected['data']
+
+
+def test_chunks_are_read_off_the_io_loop(lines, client, threads):
+    response = client.fetch('/lines?__stream=ndjson')
+    assert len(response.body.decode('utf-8').splitlines()) == 50
+    # 50行每批7行，最后一批不足7行时结束
+    assert len(threads) == 8
+    assert threading.current_thread().name not in threads
+    # 生成器在其他线程中结束时会话同样被关闭，连接归还连接池
+    assert pool.POOL.engine.pool.checkedout() == 0
+
+
+def test_closed_when_client_stops_early(lines, client, threads):
+    response = client.fetch('/lines?__stream=1&__limit=10')
+    assert len(json.loads(response.body)['data']) == 10
+    assert pool.POOL.engine.pool.checkedout() == 0
+
+
+def test_stream_is_chunked(lines, client, threads):
+    response = client.fetch('/lines?__stream=ndjson')
+    assert response.headers['Content-Type'] == 'application/x-ndjson; charset=UTF-8'
+    assert response.headers.get('Transfer-Encoding') == 'chunked'
+    assert 'Content-Length' not in response.headers
+
+
+@pytest.mark.parametrize('query, expected', [
+    # 结果为空以及恰好为整批时都能正确结束
+    ('city_id=none', {'count': 0, 'data': []}),
+    ('__orders=id&__limit=14', {'count': 50, 'data': ['line-%04d' % i for i in range(14)]}),
+    ('__orders=id&__offset=45', {'count': 50, 'data': ['line-%04d' % i for i in range(45, 50)]}),
+    ('__orders=id&__limit=3&__count=none', {'count': None, 'data': ['line-0000', 'line-0001', 'line-0002']}),
+])
+def test_stream_boundaries(lines, client, threads, query, expected):
+    body = json.loads(client.fetch('/lines?__stream=1&' + query).body)
+    assert body['count'] == expected['count']
+    assert [row['uuid'] for row in body['data']] == expected['data']
+    response = client.fetch('/lines?__stream=ndjson&' + query)
+    assert [json.loads(row)['uuid'] for row in response.body.decode('utf-8').splitlines()] == expected['data']
+    assert pool.POOL.engine.pool.checkedout() == 0
+
+
+def test_stream_with_filters_and_fields(lines, client, threads):
+    response = client.fetch('/lines?__stream=ndjson&city_id=c2&__orders=-id&__fields=uuid,name')
+    rows = [json.loads(row) for row in response.body.decode('utf-8').splitlines()]
+    assert rows == [{'uuid': 'line-%04d' % i, 'name': 'line %d' % i} for i in range(47, 0, -5)]
+
+
+def test_stream_disabled(lines, client):
+    response = client.fetch('/lines?__stream=0&__limit=2')
+    assert response.headers.get('Transfer-Encoding') != 'chunked'
+    assert len(json.loads(response.body)['data']) == 2
+
+
+def test_stream_on_sync_handler(lines, client):
+    expected = json.loads(client.fetch('/cities?__orders=uuid').body)
+    assert json.loads(client.fetch('/cities?__orders=uuid&__stream=1').body) == expected
+    assert pool.POOL.engine.pool.checkedout() == 0
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/30 20:00
+# @File    : test_upsert.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+
+
+def test_same_natural_key_updates(lines):
+    res = resource.Line()
+    operation, created = res.create_or_update({'id': 100, 'city_id': 'c1', 'name': 'first'})
+    assert operation == 'create' and created['uuid'].startswith('line-')
+    # 没有提供uuid时按(city_id, id)找到已存在的线路，主键保持不变
+    operation, updated = res.create_or_update({'id': 100, 'city_id': 'c1', 'name': 'second'})
+    assert operation == 'update'
+    assert updated == dict(created, name='second')
+    assert res.count(filters={'id': 100}) == 1
+    # 线路编号在其他城市中是另一条线路
+    operation, other = res.create_or_update({'id': 100, 'city_id': 'c2', 'name': 'other'})
+    assert operation == 'create' and other['uuid'] != created['uuid']
+
+
+def test_existing_line_keeps_uuid(lines):
+    operation, updated = resource.Line().create_or_update({'id': 3, 'city_id': 'c3', 'name': 'renamed'})
+    assert operation == 'update'
+    assert updated == {'uuid': 'line-0003', 'id': 3, 'city_id': 'c3', 'name': 'renamed'}
+
+
+def test_missing_natural_key(lines):
+    with pytest.raises(HTTPError) as e:
+        resource.Line().create_or_update({'city_id': 'c1', 'name': 'no id'})
+    assert e.value.status_code == 400
+
+
+def test_primary_key_conflict(lines):
+    operation, city = resource.City().create_or_update({'uuid': 'c1', 'id': '1', 'name': 'renamed'})
+    assert operation == 'update' and city['name'] == 'renamed'
+
+
+def test_upsert_many(lines):
+    results, errors = resource.Line().upsert_many([
+        {'id': 1, 'city_id': 'c1', 'name': 'updated'},
+        {'id': 200, 'city_id': 'c0', 'name': 'created'},
+        {'city_id': 'c0', 'name': 'no id'},
+    ])
+    assert [(result['index'], result['operation']) for result in results] == [(0, 'update'), (1, 'create')]
+    assert results[0]['data']['uuid'] == 'line-0001'
+    assert [error['index'] for error in errors] == [2]
+
+
+def test_put_over_http(lines, client):
+    body = {'id': 300, 'city_id': 'c4', 'name': 'http'}
+    response = client.fetch('/lines', method='PUT', body=body)
+    assert response.code == 201
+    created = json.loads(response.body)['data']
+    response = client.fetch('/lines', method='PUT', body=dict(body, name='http again'))
+    assert response.code == 200
+    assert json.loads(response.body) == {'operation': 'update', 'data': dict(created, name='http again')}
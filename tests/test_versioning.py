@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 16:00
+# @File    : test_versioning.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import json
+import select
+
+import pytest
+
+from tests import support
+from ork.apps.traffic import resource
+from ork.db import cache
+from ork.db import curd
+from ork.db import models
+from ork.db import pool
+from ork.db import versioning
+
+
+class CachedLine(resource.Line):
+    _cache_size = 16
+
+
+def _new_line(i):
+    return {'id': 1000 + i, 'name': 'new %d' % i, 'city_id': 'c0'}
+
+
+@pytest.fixture
+def listen(lines):
+    """
+    在独立连接上监听变更通知，模拟其他主机上的worker
+    """
+    args, kwargs = lines.dialect.create_connect_args(lines.url)
+    connection = lines.dialect.dbapi.connect(*args, **kwargs)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute('LISTEN %s' % cache.CHANNEL)
+    cursor.close()
+
+    def _received(timeout=2.0):
+        payloads = []
+        while select.select([connection], [], [], timeout) != ([], [], []):
+            connection.poll()
+            while connection.notifies:
+                payloads.append(json.loads(connection.notifies.pop(0).payload))
+            timeout = 0.1
+        return payloads
+
+    yield _received
+    connection.close()
+
+
+def test_write_is_published(listen):
+    resource.Line().create(_new_line(1))
+    CachedLine().update('line-0003', {'name': 'renamed'})
+    assert listen() == [['line', None, False], ['line', ['line-0003'], True]]
+
+
+def test_notification_bumps_version():
+    before = versioning.version(models.Line)
+    line_cache = cache.get_cache('line', 16, 60)
+    line_cache.set(('line-0001',), {'uuid': 'line-0001'})
+    # 其他主机的写入：只增加版本号，不涉及缓存
+    cache._handle_payload(cache.notify_payload('line', invalidate=False))
+    assert versioning.version(models.Line) != before
+    assert line_cache.get(('line-0001',)) is not None
+    cache._handle_payload(cache.notify_payload('line', ('line-0001',)))
+    assert line_cache.get(('line-0001',)) is None
+    # 旧格式的通知同样可以处理
+    cache._handle_payload(json.dumps(['line', None]))
+
+
+def test_rollback_discards_pending(lines, listen):
+    before = versioning.version(models.Line)
+    session = pool.POOL.transaction()
+    resource.Line(transaction=session).create(_new_line(2))
+    assert len(session().info[curd._AFTER_COMMIT_KEY]) == 1
+    session.rollback()
+    assert curd._AFTER_COMMIT_KEY not in session().info
+    assert versioning.version(models.Line) == before
+    # 回滚的变更不会在之后的提交时生效，每次提交只执行本事务的回调
+    session.begin()
+    resource.Line(transaction=session).create(_new_line(3))
+    session.commit()
+    session.remove()
+    assert versioning.version(models.Line) == [before[0] + 1]
+    assert listen() == [['line', None, False]]
+
+
+def test_savepoint_commit_waits_for_outer_commit(lines):
+    before = versioning.version(models.Line)
+    session = pool.POOL.transaction()
+    session.begin_nested()
+    resource.Line(transaction=session).create(_new_line(4))
+    session.commit()
+    assert versioning.version(models.Line) == before
+    session.commit()
+    session.remove()
+    assert versioning.version(models.Line) == [before[0] + 1]
+
+
+def test_no_etag_without_listener(client, lines, monkeypatch):
+    response = client.fetch('/lines')
+    version_etag = response.headers['Etag']
+    assert client.fetch('/lines', headers={'If-None-Match': version_etag}).code == 304
+
+    class Disconnected(object):
+        listening = False
+
+    monkeypatch.setattr(cache, '_LISTENER', Disconnected())
+    response = client.fetch('/lines', headers={'If-None-Match': version_etag})
+    assert response.code == 200
+    # 只剩tornado根据响应内容计算的ETag
+    assert response.headers.get('Etag') != version_etag
+
+
+def test_etag_reads_primary_with_replicas(client, lines, shards):
+    # 分片库中空的line表作为落后于主库的副本
+    support.refresh_pool(replicas=[support.shard_urls()[0]])
+    pool.POOL.check_replicas()
+    response = client.fetch('/lines')
+    assert json.loads(response.body)['count'] == 0
+    # 条件请求读取主库并输出表版本ETag
+    response = client.fetch('/lines', headers={'If-None-Match': response.headers['Etag']})
+    assert response.code == 200
+    assert json.loads(response.body)['count'] == 50
+    version_etag = response.headers['Etag']
+    assert client.fetch('/lines', headers={'If-None-Match': version_etag}).code == 304
+    # 读取副本的响应只有根据内容计算的ETag
+    response = client.fetch('/lines')
+    assert json.loads(response.body)['count'] == 0
+    assert response.headers['Etag'] != version_etag
+    assert pool.POOL.replica_stats()[0]['reads'] == 2
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/5/29 17:20
+# @File    : test_write_engine.py
+# @Author  : donghaixing
+# Do have a faith in what you're doing.
+# Make your life a story worth telling.
+
+from __future__ import absolute_import
+
+import pytest
+from tornado.web import HTTPError
+
+from ork.apps.traffic import resource
+
+
+class ReturningCity(resource.City):
+    _write_engine = 'returning'
+
+
+class ReturningLine(resource.Line):
+    _write_engine = 'returning'
+
+
+def test_results_match_orm(lines):
+    created = ReturningLine().create({'id': 100, 'name': 'new', 'city_id': 'c1'})
+    assert created == resource.Line().get(created['uuid'])
+    orm_result = resource.Line().update('line-0001', {'name': 'orm'})
+    returning_result = ReturningLine().update('line-0002', {'name': 'returning'})
+    assert [sorted(record) for record in orm_result] == [sorted(record) for record in returning_result]
+    assert returning_result[0]['name'] == 'line 2' and returning_result[1]['name'] == 'returning'
+    assert ReturningLine().delete('line-0003') == (1, [{'uuid': 'line-0003', 'id': 3, 'name': 'line 3',
+                                                        'city_id': 'c3'}])
+    assert ReturningLine().delete('line-0003') == (0, [None])
+
+
+@pytest.mark.parametrize('res', [resource.City, ReturningCity])
+def test_create_conflict(lines, res):
+    with pytest.raises(HTTPError) as e:
+        res().create({'uuid': 'c1', 'id': '9', 'name': 'duplicate'})
+    assert e.value.status_code == 409
+    assert res().get('c1')['name'] == 'city 1'
+
+
+@pytest.mark.parametrize('res', [resource.City, ReturningCity])
+def test_update_conflict(lines, res):
+    with pytest.raises(HTTPError) as e:
+        res().update('c1', {'uuid': 'c2'})
+    assert e.value.status_code == 409
+    assert res().get('c1')['name'] == 'city 1'
+
+
+@pytest.mark.parametrize('res', [resource.Line, ReturningLine])
+def test_writes_in_caller_transaction(lines, res):
+    with res().transaction() as session:
+        created = res(transaction=session).create({'id': 100, 'name': 'new', 'city_id': 'c1'})
+        res(transaction=session).update('line-0001', {'name': 'renamed'})
+        assert res(transaction=session).delete('line-0002')[0] == 1
+    assert res().get(created['uuid'])['name'] == 'new'
+    assert res().get('line-0001')['name'] == 'renamed'
+    assert res().count(filters={'uuid': 'line-0002'}) == 0
+    # 外部事务回滚时全部撤销
+    with pytest.raises(RuntimeError):
+        with res().transaction() as session:
+            res(transaction=session).create({'id': 101, 'name': 'rolled back', 'city_id': 'c1'})
+            raise RuntimeError('rollback')
+    assert res().count(filters={'id': 101}) == 0
+
+
+def test_conflict_keeps_caller_transaction(lines):
+    with ReturningCity().transaction() as session:
+        with pytest.raises(HTTPError) as e:
+            ReturningCity(transaction=session).create({'uuid': 'c1', 'id': '9', 'name': 'duplicate'})
+        assert e.value.status_code == 409
+        # 冲突只回滚到SAVEPOINT，外部事务可以继续
+        ReturningCity(transaction=session).create({'uuid': 'c9', 'id': '9', 'name': 'city 9'})
+    assert ReturningCity().get('c9')['name'] == 'city 9'
+
+
+def test_update_missing(lines):
+    with pytest.raises(HTTPError) as e:
+        ReturningLine().update('line-9999', {'name': 'missing'})
+    assert e.value.status_code == 404